@@ -1,31 +1,20 @@
 import logging
-from functools import partial
-from typing import Any, Optional
 
 import numpy as np
 
-import qcodes.validators as vals
-from qcodes import VisaInstrument
-from qcodes import IPInstrument
-from qcodes.instrument import (
-    ChannelList, 
-    Instrument, 
-    InstrumentChannel, 
-    VisaInstrument,
-    IPInstrument
-    )
-from qcodes.parameters import (
-    ArrayParameter,
-    ManualParameter,
-    MultiParameter,
-    ParamRawDataType,
-    create_on_off_val_mapping,
+from qcodes.instrument import VisaInstrument
+
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import (
+    FrequencySweep as _FrequencySweep,
+    SpectrumAnalyzerMixin,
+    TraceReader,
 )
 
+
 log = logging.getLogger(__name__)
 
 
-class E4407B(VisaInstrument):
+class E4407B(SpectrumAnalyzerMixin, VisaInstrument):
     """
     Alpha qcodes driver for the Anritsu MS2090A series
 
@@ -55,21 +44,12 @@ class E4407B(VisaInstrument):
         self.write_termination=terminator
         #self.read_termination='\n'
         self._buffer_size = 999999
+        # Averaging state used by every trace, None when it must be queried
+        self._averaging_on = None
 
         #model = self.get_idn()#['model'].split('-')[0]
         
-        self.add_parameter(name='start',
-                           get_cmd='SENS:FREQ:START?',
-                           set_cmd=self._set_start,
-                           get_parser=float)
-        self.add_parameter(name='stop',
-                           get_cmd='SENS:FREQ:STOP?',
-                           set_cmd=self._set_stop,
-                           get_parser=float)
-        self.add_parameter(name='center',
-                   get_cmd='SENS:FREQ:CENT?',
-                   set_cmd=self._set_center,
-                   get_parser=float)
+        self._add_sweep_parameters()
         self.add_parameter(name='video_bandwidth',
                    get_cmd='SENS:BWID:VID?',
                    set_cmd=self._set_video_bandwidth,
@@ -89,29 +69,16 @@ class E4407B(VisaInstrument):
                    set_cmd=self._set_avg_cnt,
                    get_parser=int,
                    )    
-        self.add_parameter(name='span',
-                   get_cmd='SENS:FREQ:SPAN?',
-                   set_cmd=self._set_span,
-                   get_parser=float)
-        
-        self.add_parameter(
-            name="npts",
-            get_cmd="SENS:SWE:POIN?",
-            set_cmd=self._set_npts,
-            get_parser=int,
-        )
+        self.trace_reader = TraceReader(self)
 
         self.add_parameter(
             name="trace",
-            start=self.start(),
-            stop=self.stop(),
-            npts=self.npts(),
             channel=1,
             parameter_class=FrequencySweep,
         )
         
    
-        self.add_function('reset', call_cmd='*RST')
+        self.add_function('reset', call_cmd=self._reset)
         self.add_function('tooltip_on', call_cmd='SYST:ERR:DISP ON')
         self.add_function('tooltip_off', call_cmd='SYST:ERR:DISP OFF')
         self.add_function('cont_meas_on', call_cmd='INIT:CONT:ALL ON')
@@ -130,8 +97,19 @@ class E4407B(VisaInstrument):
         self.connect_message()
 
 
+    def _reset(self):
+        self.write('*RST')
+        self._averaging_on = None
+
     def _set_avg(self,val):
         self.write('SENS:AVER:STAT {}'.format(val))
+        self._averaging_on = None
+
+    def _get_averaging_on(self) -> bool:
+        "Averaging state, queried once after every change"
+        if self._averaging_on is None:
+            self._averaging_on = self.averaging() == 'on'
+        return self._averaging_on
 
     def _set_avg_cnt(self,val):
         self.write('SENS:AVER:COUN {}'.format(val))
@@ -140,45 +118,6 @@ class E4407B(VisaInstrument):
         "Strip newline and quotes from instrument reply"
         return var.rstrip()[1:-1]
 
-    def _set_start(self, val):
-        self.write('SENS:FREQ:START {:.7f}'.format(val))
-        stop = self.stop()
-        if val >= stop:
-            raise ValueError(
-                "Stop frequency must be larger than start frequency.")
-        # we get start as the vna may not be able to set it to the exact value provided
-        start = self.start()
-        if val != start:
-            log.warning(
-                "Could not set start to {} setting it to {}".format(val, start))
-        self._update_traces()
-
-    def _set_stop(self, val):
-        start = self.start()
-        if val <= start:
-            raise ValueError(
-                "Stop frequency must be larger than start frequency.")
-        self.write('SENS:FREQ:STOP {:.7f}'.format(val))
-        # we get stop as the vna may not be able to set it to the exact value provided
-        stop = self.stop()
-        if val != stop:
-            log.warning(
-                "Could not set stop to {} setting it to {}".format(val, stop))
-        self._update_traces()
-
-    def _set_npts(self, val):
-        self.write('SENS:SWE:POIN {:.7f}'.format(val))
-        self._update_traces()
-
-    def _set_span(self, val):
-        self.write('SENS:FREQ:SPAN {:.7f}'.format(val))
-        self._update_traces()
-
-    def _set_center(self, val):
-        self.write('SENS:FREQ:CENT {:.7f}'.format(val))
-        #time.sleep(0.01)
-        self._update_traces()
-
     def _set_video_bandwidth(self, val):
         self.write('SENS:BWID:VID {:.7f}'.format(val))
     
@@ -191,94 +130,19 @@ class E4407B(VisaInstrument):
         resp = self.visa_handle.read()
         return resp
 
-    def _update_traces(self):
-        """ updates start, stop and npts of all trace parameters"""
-        start = self.start()
-        stop = self.stop()
-        npts = self.npts()
-        for _, parameter in self.parameters.items():
-            if isinstance(parameter, (ArrayParameter, MultiParameter)):
-                try:
-                    parameter.set_sweep(start, stop, npts)
-                except AttributeError:
-                    pass
-
-class FrequencySweep(ArrayParameter):
+class FrequencySweep(_FrequencySweep):
     """
-    Hardware controlled parameter class for Rohde Schwarz ZNB trace.
-
-    Instrument returns an array of transmission or reflection data depending
-    on the active measurement.
-
-    Args:
-        name: parameter name
-        instrument: instrument the parameter belongs to
-        start: starting frequency of sweep
-        stop: ending frequency of sweep
-        npts: number of points in frequency sweep
-
-    Methods:
-          get(): executes a sweep and returns magnitude and phase arrays
-
+    Trace of the E4407B. Averaging is restarted for every trace.
     """
 
-    def __init__(
-        self,
-        name: str,
-        instrument: Instrument,
-        start: float,
-        stop: float,
-        npts: int,
-        channel: int,
-        **kwargs: Any,
-    ) -> None:
-        super().__init__(
-            name,
-            shape=(npts,),
-            instrument=instrument,
-            unit="dBm",
-            label=f"{instrument.short_name} magnitude",
-            setpoint_units=("Hz",),
-            setpoint_labels=(f"{instrument.short_name} frequency",),
-            setpoint_names=(f"{instrument.short_name}_frequency",),
-            **kwargs,
-        )
-        self.set_sweep(start, stop, npts)
-        self._instrument_channel = channel
-        self._instrument = instrument
-
-    def set_sweep(self, start: float, stop: float, npts: int) -> None:
-        """
-        sets the shapes and setpoint arrays of the parameter to
-        correspond with the sweep
-
-        Args:
-            start: Starting frequency of the sweep
-            stop: Stopping frequency of the sweep
-            npts: Number of points in the sweep
-
-        """
-        # Needed to update config of the software parameter on sweep change
-        # freq setpoints tuple as needs to be hashable for look up.
-        f = tuple(np.linspace(int(start), int(stop), num=npts))
-        self.setpoints = (f,)
-        self.shape = (npts,)
-
-    def get_raw(self) -> ParamRawDataType:
-        #assert isinstance(self.instrument, RohdeSchwarzZNBChannel)
-        return self._get_sweep_data()
-
-    def _get_sweep_data(self, force_polar: bool = False) -> np.ndarray:
-        # The device gives more data than nbytes indicates, so lets check against npoints
-        npoints = self._instrument.npts.get()
-        # The command send two responses: firstly the header indicating the block length (which we ignore), then the data itself
-        if self._instrument.averaging.get() == 'on':
+    def _get_sweep_data(self) -> np.ndarray:
+        if self._instrument._get_averaging_on():
             self._instrument.write("SENS:AVER:CLE")
         self._instrument.write("INIT:CONT OFF")
         self._instrument.write("INIT; *WAI")
-        trace = self._instrument.ask_raw("TRAC:DATA? TRACE1")
+        trace = self._instrument.trace_reader.read("TRAC:DATA? TRACE1")
         self._instrument.write("INIT:CONT ON")
-        return np.array(trace.split(','), dtype=np.float32)
+        return trace
 
     def _zerospan(self, frequency_start, frequency_stop, npts):
 
@@ -2,12 +2,211 @@
 # Etienne Dumur <etienne.dumur@gmail.com>, september 2020
 
 import os
-import pandas as pd
+import json
+import itertools
+import hashlib
+import tempfile
 import numpy as np
-from datetime import date
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 from qcodes.instrument.base import Instrument
 
+
+def _parse_date_time(date_str: str, time_str: str) -> datetime:
+    """
+    Return the date time of a log line with date 'dd-mm-yy' and time 'HH:MM:SS'.
+    """
+    # There is a space before the day for old BlueFors Control Sofware versions
+    day, month, year = date_str.strip().split('-')
+    hour, minute, second = time_str.strip().split(':')
+    return datetime(2000+int(year), int(month), int(day),
+                    int(hour), int(minute), int(second))
+
+
+def _to_float(fields: List[str], i: int) -> float:
+    """
+    Return field i as float or nan if it is missing or not a number.
+    """
+    try:
+        return float(fields[i])
+    except (IndexError, ValueError):
+        return np.nan
+
+
+class _LogTail:
+    """
+    Incremental reader of a log file the fridge software appends lines to.
+
+    The reader remembers the byte offset of the first line not read yet.
+    At the first read only the last lines of the file are read.
+
+    Args:
+    file_path: Path of the log file.
+    """
+
+    # Number of bytes read at the end of the file at the first read,
+    # enough for a few lines of any log file.
+    tail_size = 4096
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self._offset: Optional[int] = None
+
+    def read_lines(self) -> List[str]:
+        """
+        Return the complete lines appended since the previous read.
+        """
+        with open(self.file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            skip_first = False
+            if self._offset is None or size < self._offset:
+                # First read or the file has been replaced: read the tail only
+                self._offset = max(0, size - self.tail_size)
+                skip_first = self._offset > 0
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+
+        # A line without end of line is still being written
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        lines = data[:end].decode(errors='replace').splitlines()
+        if skip_first:
+            # The first line is probably incomplete
+            lines = lines[1:]
+        return lines
+
+
+class _LogIndex:
+    """
+    Persistent index of the values in a log file.
+
+    The index is a NumPy file with a sorted 'time' column in seconds since
+    1970 and a 'values' column, which is memory-mapped when loaded. A json
+    file stores the name of the NumPy file and the number of bytes of the
+    log file it indexes. When the log file grows, only the new lines are
+    parsed and added in memory. The index is written again once it has
+    doubled in size since it was last written, so a growing log file is not
+    rewritten at every load and the lines after the last write are parsed
+    again by the next process only.
+
+    A write saves a new NumPy file and then atomically replaces the json
+    file, so an interrupted write leaves the previous index intact. The
+    names of the NumPy and temporary files contain a key unique to the
+    index object, so processes sharing the index folder never overwrite or
+    remove each other's files.
+
+    Args:
+    file_path: Path of the log file.
+    index_path: Path of the index file without extension.
+    parse_values: Function returning the values of the fields of a line.
+    n_values: Number of values per line.
+    """
+
+    _instances = itertools.count()
+
+    def __init__(self, file_path: str, index_path: str,
+                 parse_values: Callable[[List[str]], List[float]],
+                 n_values: int) -> None:
+        self.file_path = file_path
+        self.index_path = index_path
+        self._parse_values = parse_values
+        self._dtype = np.dtype([('time', '<i8'), ('values', '<f8', (n_values,))])
+        self._data: Optional[np.ndarray] = None
+        self._size = 0
+        self._key = '{}-{}'.format(os.getpid(), next(_LogIndex._instances))
+        # NumPy file last written by this object and its number of rows
+        self._file: Optional[str] = None
+        self._written_rows = 0
+
+    def load(self) -> np.ndarray:
+        """
+        Return the index, updated when the log file has grown.
+        """
+        size = os.path.getsize(self.file_path)
+        if self._data is None:
+            self._data, self._size = self._read_index()
+            self._written_rows = len(self._data)
+        if size == self._size:
+            return self._data
+
+        replaced = size < self._size
+        if replaced:
+            self._data, self._size = np.zeros(0, self._dtype), 0
+        rows, size = self._parse(self._size)
+        data = np.concatenate([self._data, rows])
+        if len(data) > 1 and np.any(np.diff(data['time']) < 0):
+            data = data[np.argsort(data['time'], kind='stable')]
+        # Also releases the memory map of the file removed by _write_index
+        self._data, self._size = data, size
+        # The index of a replaced log file is stale and is always written
+        if replaced or len(data) >= 2 * self._written_rows:
+            self._write_index()
+        return self._data
+
+    def _parse(self, offset: int) -> Tuple[np.ndarray, int]:
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        times, values = [], []
+        for line in data[:end].decode(errors='replace').splitlines():
+            fields = line.split(',')
+            try:
+                date_time = _parse_date_time(fields[0], fields[1])
+                line_values = self._parse_values(fields)
+            except (IndexError, ValueError):
+                continue
+            times.append(int((date_time - datetime(1970, 1, 1)).total_seconds()))
+            values.append(line_values)
+        rows = np.zeros(len(times), self._dtype)
+        rows['time'] = times
+        if values:
+            rows['values'] = values
+        return rows, offset + end
+
+    def _read_index(self) -> Tuple[np.ndarray, int]:
+        try:
+            with open(self.index_path + '.json') as f:
+                index = json.load(f)
+            data = np.load(os.path.join(os.path.dirname(self.index_path),
+                                        index['file']), mmap_mode='r')
+            if data.dtype == self._dtype:
+                return data, index['size']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return np.zeros(0, self._dtype), 0
+
+    def _write_index(self) -> None:
+        folder = os.path.dirname(self.index_path)
+        base = os.path.basename(self.index_path)
+        name = '{}.{}.{}.npy'.format(base, self._key, self._size)
+        tmp_path = '{}.{}.tmp.json'.format(self.index_path, self._key)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            np.save(os.path.join(folder, name), self._data)
+            with open(tmp_path, 'w') as f:
+                json.dump({'size': self._size, 'file': name}, f)
+            # The index is only updated once the json file is replaced
+            os.replace(tmp_path, self.index_path + '.json')
+        except OSError:
+            # The index is kept in memory only
+            for path in (os.path.join(folder, name), tmp_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return
+        # Remove the previous NumPy file written by this object only, other
+        # processes may still have their own files memory-mapped.
+        if self._file is not None and self._file != name:
+            try:
+                os.remove(os.path.join(folder, self._file))
+            except OSError:
+                pass
+        self._file = name
+        self._written_rows = len(self._data)
+
+
 class BlueFors(Instrument):
     """
     This is the QCoDeS python driver to extract the temperature and pressure
@@ -27,6 +226,7 @@ class BlueFors(Instrument):
                        channel_still             : int,
                        channel_mixing_chamber    : int,
                        channel_magnet            : Optional[int] = None,
+                       index_folder_path         : Optional[str] = None,
                        **kwargs) -> None:
         """
         QCoDeS driver for BlueFors fridges.
@@ -47,12 +247,42 @@ class BlueFors(Instrument):
         channel_still: channel of the still.
         channel_mixing_chamber: channel of the mixing chamber.
         channel_magnet: channel of the magnet.
+        index_folder_path: Folder of the index files used by history().
+            Defaults to a folder in the temporary directory.
         """
 
         super().__init__(name = name, **kwargs)
 
         self.folder_path = os.path.abspath(folder_path)
 
+        # Readers of the log files of the current day
+        self._log_tails: Dict[str, _LogTail] = {}
+        # Latest (date time, value) per ('T' or 'P', channel) of all log files
+        self._latest: Dict[Tuple[str, int], Tuple[datetime, float]] = {}
+
+        if index_folder_path is None:
+            folder_hash = hashlib.sha1(self.folder_path.encode()).hexdigest()[:12]
+            index_folder_path = os.path.join(tempfile.gettempdir(),
+                                             'bluefors_index', folder_hash)
+        self.index_folder_path = os.path.abspath(index_folder_path)
+        self._log_indexes: Dict[str, _LogIndex] = {}
+
+        # ('T' or 'P', channel) per parameter, used by history()
+        self._history_channels: Dict[str, Tuple[str, int]] = {
+            'pressure_vacuum_can'        : ('P', channel_vacuum_can),
+            'pressure_pumping_line'      : ('P', channel_pumping_line),
+            'pressure_compressor_outlet' : ('P', channel_compressor_outlet),
+            'pressure_compressor_inlet'  : ('P', channel_compressor_inlet),
+            'pressure_mixture_tank'      : ('P', channel_mixture_tank),
+            'pressure_venting_line'      : ('P', channel_venting_line),
+            'temperature_50k_plate'      : ('T', channel_50k_plate),
+            'temperature_4k_plate'       : ('T', channel_4k_plate),
+            'temperature_still'          : ('T', channel_still),
+            'temperature_mixing_chamber' : ('T', channel_mixing_chamber),
+            }
+        if channel_magnet is not None:
+            self._history_channels['temperature_magnet'] = ('T', channel_magnet)
+
         self.add_parameter(name       = 'pressure_vacuum_can',
                            unit       = 'mBar',
                            get_parser = float,
@@ -150,29 +380,17 @@ class BlueFors(Instrument):
         file_path = os.path.join(self.folder_path, folder_name, 'CH'+str(channel)+' T '+folder_name+'.log')
 
         try:
-            df = pd.read_csv(file_path,
-                                delimiter = ',',
-                                names     = ['date', 'time', 'y'],
-                                header    = None)
-
-            try:
-                # There is a space before the day for old BlueFors Control Sofware versions
-                date_time = pd.to_datetime(
-                    df["date"] + "-" + df["time"], format=" %d-%m-%y-%H:%M:%S"
-                )
-            except Exception:
-                # There is no space before the day with BlueFors Control Software v2.2
-                date_time = pd.to_datetime(
-                    df["date"] + "-" + df["time"], format="%d-%m-%y-%H:%M:%S"
-                )
-            df["date_time"] = date_time
-            df.set_index("date_time", inplace=True)
-            df.sort_index(inplace=True)
-            return df.iloc[-1]["y"]
+            for line in self._read_new_lines('T'+str(channel), file_path):
+                try:
+                    fields = line.split(',')
+                    self._update_latest(('T', channel), fields[0], fields[1], float(fields[2]))
+                except (IndexError, ValueError):
+                    continue
+            return self._latest[('T', channel)][1]
         except (PermissionError, OSError) as err:
             self.log.warning('Cannot access log file: {}. Returning np.nan instead of the temperature value.'.format(err))
             return np.nan
-        except IndexError as err:
+        except KeyError as err:
             self.log.warning('Cannot parse log file: {}. Returning np.nan instead of the temperature value.'.format(err))
             return np.nan
 
@@ -193,26 +411,123 @@ class BlueFors(Instrument):
         file_path = os.path.join(self.folder_path, folder_name, 'maxigauge '+folder_name+'.log')
 
         try:
-            df = pd.read_csv(file_path,
-                            delimiter=',',
-                            names=['date', 'time',
-                                    'ch1_name', 'ch1_void1', 'ch1_status', 'ch1_pressure', 'ch1_void2', 'ch1_void3',
-                                    'ch2_name', 'ch2_void1', 'ch2_status', 'ch2_pressure', 'ch2_void2', 'ch2_void3',
-                                    'ch3_name', 'ch3_void1', 'ch3_status', 'ch3_pressure', 'ch3_void2', 'ch3_void3',
-                                    'ch4_name', 'ch4_void1', 'ch4_status', 'ch4_pressure', 'ch4_void2', 'ch4_void3',
-                                    'ch5_name', 'ch5_void1', 'ch5_status', 'ch5_pressure', 'ch5_void2', 'ch5_void3',
-                                    'ch6_name', 'ch6_void1', 'ch6_status', 'ch6_pressure', 'ch6_void2', 'ch6_void3',
-                                    'void'],
-                            header=None)
-
-            df["date_time"] = pd.to_datetime(df['date']+'-'+df['time'], format='%d-%m-%y-%H:%M:%S')
-            df.set_index("date_time", inplace=True)
-            df.sort_index(inplace=True)
-
-            return df.iloc[-1]['ch'+str(channel)+'_pressure']
+            # A line has the date, time, 6 fields per channel
+            # (name, void, status, pressure, void, void) and a void field.
+            for line in self._read_new_lines('maxigauge', file_path):
+                fields = line.split(',')
+                for ch in range(1, 7):
+                    try:
+                        self._update_latest(('P', ch), fields[0], fields[1],
+                                            float(fields[6*ch - 1]))
+                    except (IndexError, ValueError):
+                        continue
+            return self._latest[('P', channel)][1]
         except (PermissionError, OSError) as err:
             self.log.warning('Cannot access log file: {}. Returning np.nan instead of the pressure value.'.format(err))
             return np.nan
-        except IndexError as err:
+        except KeyError as err:
             self.log.warning('Cannot parse log file: {}. Returning np.nan instead of the pressure value.'.format(err))
             return np.nan
+
+
+    def _read_new_lines(self, log_name: str, file_path: str) -> List[str]:
+        """
+        Return the lines appended to the log file since the previous call.
+        A new reader is started when the day, and so the file, changes.
+        """
+        log_tail = self._log_tails.get(log_name)
+        if log_tail is None or log_tail.file_path != file_path:
+            log_tail = _LogTail(file_path)
+            self._log_tails[log_name] = log_tail
+        return log_tail.read_lines()
+
+
+    def _update_latest(self, key: Tuple[str, int], date_str: str, time_str: str,
+                       value: float) -> None:
+        """
+        Store the value if it is the most recent one of the channel.
+        """
+        date_time = _parse_date_time(date_str, time_str)
+        latest = self._latest.get(key)
+        if latest is None or date_time >= latest[0]:
+            self._latest[key] = (date_time, value)
+
+
+    def history(self, channel: str, start: datetime, stop: datetime,
+                max_points: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the values of a channel registered between start and stop.
+
+        The log files of the days between start and stop are indexed once.
+        The indexes are stored in index_folder_path and updated when a log
+        file grows.
+
+        Args:
+            channel (str): Name of the parameter, e.g. 'temperature_mixing_chamber'.
+            start (datetime): Start of the time range, included.
+            stop (datetime): Stop of the time range, included.
+            max_points (int): If given, consecutive values are averaged to
+                return at most max_points values.
+
+        Returns:
+            times (np.ndarray): Date times (numpy.datetime64) of the values.
+            values (np.ndarray): Temperatures in Kelvin or pressures in mBar.
+        """
+        if channel not in self._history_channels:
+            raise ValueError('Unknown channel {}, use one of {}'.format(
+                             channel, list(self._history_channels)))
+        kind, number = self._history_channels[channel]
+        epoch = datetime(1970, 1, 1)
+        t_start = int((start - epoch).total_seconds())
+        t_stop = int((stop - epoch).total_seconds())
+
+        times, values = [], []
+        day = start.date()
+        while day <= stop.date():
+            log_index = self._get_log_index(kind, number, day)
+            day += timedelta(days=1)
+            try:
+                data = log_index.load()
+            except OSError:
+                # No log file for this day
+                continue
+            i_start = np.searchsorted(data['time'], t_start, side='left')
+            i_stop = np.searchsorted(data['time'], t_stop, side='right')
+            times.append(np.array(data['time'][i_start:i_stop]))
+            column = number - 1 if kind == 'P' else 0
+            values.append(np.array(data['values'][i_start:i_stop, column]))
+
+        t = np.concatenate(times) if times else np.zeros(0, np.int64)
+        y = np.concatenate(values) if values else np.zeros(0)
+        if max_points is not None and len(t) > max_points:
+            bin_size = -(-len(t) // max_points)
+            bins = np.arange(0, len(t), bin_size)
+            counts = np.diff(np.append(bins, len(t)))
+            t = np.add.reduceat(t, bins) // counts
+            y = np.add.reduceat(y, bins) / counts
+        return t.astype('datetime64[s]'), y
+
+
+    def _get_log_index(self, kind: str, channel: int, day: date) -> _LogIndex:
+        """
+        Return the index of the log file of a day with the values of a channel.
+        """
+        folder_name = day.strftime("%y-%m-%d")
+        if kind == 'T':
+            file_name = 'CH'+str(channel)+' T '+folder_name+'.log'
+            parse_values: Callable[[List[str]], List[float]] = \
+                lambda fields: [float(fields[2])]
+            n_values = 1
+        else:
+            file_name = 'maxigauge '+folder_name+'.log'
+            parse_values = lambda fields: [_to_float(fields, 6*ch - 1)
+                                           for ch in range(1, 7)]
+            n_values = 6
+        file_path = os.path.join(self.folder_path, folder_name, file_name)
+        log_index = self._log_indexes.get(file_path)
+        if log_index is None:
+            index_path = os.path.join(self.index_folder_path, folder_name,
+                                      os.path.splitext(file_name)[0])
+            log_index = _LogIndex(file_path, index_path, parse_values, n_values)
+            self._log_indexes[file_path] = log_index
+        return log_index
@@ -4,7 +4,8 @@
 import logging
 import numpy as np
 import cmath, math
-from typing import Tuple, Any
+from functools import cached_property
+from typing import Tuple, Any, Optional
 
 from qcodes import VisaInstrument
 from qcodes.utils.validators import Numbers, Enum, Ints, Bool
@@ -16,6 +17,8 @@ from qcodes.instrument.parameter import (
     ParamRawDataType
 )
 
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import TraceReader
+
 log = logging.getLogger(__name__)
 
 class FrequencySweepMagPhase(MultiParameter):
@@ -88,17 +91,16 @@ class FrequencySweepMagPhase(MultiParameter):
         assert isinstance(self.instrument, M5180)
         self.instrument.write('CALC1:PAR:COUN 1') # 1 trace
         self.instrument.write('CALC1:PAR1:DEF {}'.format(self.name))
+        self.instrument._s_traces_defined = False
         self.instrument.trigger_source('bus') # set the trigger to bus
         self.instrument.write('TRIG:SEQ:SING') # Trigger a single sweep
         self.instrument.ask('*OPC?') # Wait for measurement to complete
 
         # get data from instrument
         self.instrument.write('CALC1:TRAC1:FORM SMITH')  # ensure correct format
-        sxx_raw = self.instrument.ask("CALC1:TRAC1:DATA:FDAT?")
+        sxx = self.instrument.trace_reader.read("CALC1:TRAC1:DATA:FDAT?")
         self.instrument.write('CALC1:TRAC1:FORM MLOG')
 
-        # Get data as numpy array
-        sxx = np.fromstring(sxx_raw, dtype=float, sep=',')
         sxx = sxx[0::2] + 1j*sxx[1::2]
 
         return self.instrument._db(sxx), np.unwrap(np.angle(sxx))
@@ -158,16 +160,14 @@ class PointMagPhase(MultiParameter):
 
         self.instrument.write('CALC1:PAR:COUN 1') # 1 trace
         self.instrument.write('CALC1:PAR1:DEF {}'.format(self.name[-3:]))
+        self.instrument._s_traces_defined = False
         self.instrument.trigger_source('bus') # set the trigger to bus
         self.instrument.write('TRIG:SEQ:SING') # Trigger a single sweep
         self.instrument.ask('*OPC?') # Wait for measurement to complete
 
         # get data from instrument
         self.instrument.write('CALC1:TRAC1:FORM SMITH')  # ensure correct format
-        sxx_raw = self.instrument.ask("CALC1:TRAC1:DATA:FDAT?")
-
-        # Get data as numpy array
-        sxx = np.fromstring(sxx_raw, dtype=float, sep=',')
+        sxx = self.instrument.trace_reader.read("CALC1:TRAC1:DATA:FDAT?")
         sxx = sxx[0::2] + 1j*sxx[1::2]
 
         # Return the average of the trace, which will have "start" as
@@ -231,16 +231,14 @@ class PointIQ(MultiParameter):
 
         self.instrument.write('CALC1:PAR:COUN 1') # 1 trace
         self.instrument.write('CALC1:PAR1:DEF {}'.format(self.name[-3:]))
+        self.instrument._s_traces_defined = False
         self.instrument.trigger_source('bus') # set the trigger to bus
         self.instrument.write('TRIG:SEQ:SING') # Trigger a single sweep
         self.instrument.ask('*OPC?') # Wait for measurement to complete
 
         # get data from instrument
         self.instrument.write('CALC1:TRAC1:FORM SMITH')  # ensure correct format
-        sxx_raw = self.instrument.ask("CALC1:TRAC1:DATA:FDAT?")
-
-        # Get data as numpy array
-        sxx = np.fromstring(sxx_raw, dtype=float, sep=',')
+        sxx = self.instrument.trace_reader.read("CALC1:TRAC1:DATA:FDAT?")
 
         # Return the average of the trace, which will have "start" as
         # its setpoint
@@ -248,6 +246,34 @@ class PointIQ(MultiParameter):
 
 
 
+class SParameterSweep:
+    """
+    All S parameters of a 2-port frequency sweep.
+
+    Magnitude and phase are only computed when they are accessed.
+    """
+
+    def __init__(self, frequencies: np.ndarray, s: np.ndarray) -> None:
+        """
+        Args:
+            frequencies (np.ndarray): frequencies of the sweep in Hz
+            s (np.ndarray): complex S parameters with shape (4, npts) in
+                the order s11, s12, s21, s22
+        """
+        self.frequencies = frequencies
+        self.s = s
+
+    @cached_property
+    def db(self) -> np.ndarray:
+        """Magnitude in dB with shape (4, npts)"""
+        return M5180._db(self.s)
+
+    @cached_property
+    def phase(self) -> np.ndarray:
+        """Phase in rad with shape (4, npts)"""
+        return np.angle(self.s)
+
+
 class M5180(VisaInstrument):
     """
     This is the QCoDeS python driver for the VNA M5180 from Copper Mountain
@@ -278,7 +304,15 @@ class M5180(VisaInstrument):
                          timeout    = timeout,
                          **kwargs)
 
-        self.add_function('reset', call_cmd='*RST')
+        self.add_function('reset', call_cmd=self._reset)
+
+        # The traces are transferred as binary blocks of 64 bit floats,
+        # unless another format is set with data_transfer_format. The
+        # transfer format is selected with every query.
+        self.trace_reader = self._make_trace_reader('real')
+        # whether the traces are set up for get_s_parameters
+        self._s_traces_defined = False
+        self._frequencies: Optional[np.ndarray] = None
 
         # set the unit of the electrical distance to meter
         self.write('CALC1:CORR:EDEL:DIST:UNIT MET')
@@ -414,7 +448,7 @@ class M5180(VisaInstrument):
                            get_parser=int,
                            set_parser=int,
                            get_cmd='CALC1:PAR:COUN?',
-                           set_cmd='CALC1:PAR:COUN {}',
+                           set_cmd=self._set_nb_traces,
                            unit='',
                            vals=Ints(min_value=1,
                                      max_value=16))
@@ -430,7 +464,7 @@ class M5180(VisaInstrument):
                            label='Data format during transfer',
                            get_parser=str,
                            get_cmd='FORM:DATA?',
-                           set_cmd='FORM:DATA {}',
+                           set_cmd=self._set_data_transfer_format,
                            vals = Enum('ascii', 'real', 'real32'))
 
         self.add_parameter(name='s11',
@@ -568,6 +602,21 @@ class M5180(VisaInstrument):
         self.write("SENS1:SWE:POIN {}".format(val))
         self.update_lin_traces()
 
+    def _reset(self) -> None:
+        """Resets the instrument, which also removes the trace setup."""
+        self.write('*RST')
+        self._s_traces_defined = False
+        self._frequencies = None
+
+    def _set_nb_traces(self, val: int) -> None:
+        """Sets the number of traces.
+
+        Args:
+            val (int): number of traces
+        """
+        self.write('CALC1:PAR:COUN {}'.format(val))
+        self._s_traces_defined = False
+
     def _get_trigger(self) -> str:
         """Gets trigger source.
 
@@ -593,6 +642,62 @@ class M5180(VisaInstrument):
         """
         self.write('TRIG:SOUR '+trigger.upper())
 
+    def _make_trace_reader(self, data_format: str) -> TraceReader:
+        """Returns a trace reader for a data transfer format.
+
+        Args:
+            data_format (str): 'ascii', 'real' or 'real32'
+        """
+        datatype = 'f' if data_format == 'real32' else 'd'
+        return TraceReader(
+            self,
+            binary=data_format != 'ascii',
+            binary_format=f'FORM:DATA {data_format.upper()};:FORM:BORD SWAP',
+            ascii_format='FORM:DATA ASC',
+            datatype=datatype)
+
+    def _set_data_transfer_format(self, data_format: str) -> None:
+        """Sets the data format used by all trace transfers.
+
+        Args:
+            data_format (str): 'ascii', 'real' or 'real32'
+        """
+        self.write(f'FORM:DATA {data_format}')
+        self.trace_reader = self._make_trace_reader(data_format)
+
+    def get_s_parameters(self) -> SParameterSweep:
+        """
+        Measure all S parameters with a single sweep.
+
+        The four traces are set up with the first call and reused by later
+        calls, until another parameter changes the traces. The traces are
+        read in a single transfer, in the format set by data_transfer_format,
+        and the frequencies are cached until the sweep is changed.
+
+        Returns:
+            SParameterSweep: frequencies [Hz] and the complex S parameters
+            as (4, npts) array, with magnitude and phase computed on access
+        """
+        if not self._s_traces_defined:
+            # 4 traces, S11, S12, S21 and S22, in Smith chart format
+            self.write(';:'.join(
+                ['CALC1:PAR:COUN 4']
+                + [f'CALC1:PAR{i}:DEF {s}' for i, s in
+                   enumerate(('S11', 'S12', 'S21', 'S22'), start=1)]
+                + [f'CALC1:TRAC{i}:FORM SMITH' for i in range(1, 5)]))
+            self._s_traces_defined = True
+        self.write('TRIG:SEQ:SING') # Trigger a single sweep
+        self.ask('*OPC?') # Wait for measurement to complete
+
+        queries = [f"CALC1:TRAC{i}:DATA:FDAT?" for i in range(1, 5)]
+        if self._frequencies is None:
+            queries.append("SENS1:FREQ:DATA?")
+        traces = self.trace_reader.read_many(queries)
+        if self._frequencies is None:
+            self._frequencies = traces.pop()
+        data = np.stack(traces)
+        return SParameterSweep(self._frequencies, data[:, 0::2] + 1j*data[:, 1::2])
+
     def get_s(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray,
                              np.ndarray, np.ndarray, np.ndarray, np.ndarray,
                              np.ndarray]:
@@ -606,47 +711,20 @@ class M5180(VisaInstrument):
             s21 magnitude [dB], s21 phase [rad],
             s22 magnitude [dB], s22 phase [rad]
         """
+        sweep = self.get_s_parameters()
+        db, phase = sweep.db, sweep.phase
 
-        self.write('CALC1:PAR:COUN 4') # 4 trace
-        self.write('CALC1:PAR1:DEF S11') # Choose S11 for trace 1
-        self.write('CALC1:PAR2:DEF S12') # Choose S12 for trace 2
-        self.write('CALC1:PAR3:DEF S21') # Choose S21 for trace 3
-        self.write('CALC1:PAR4:DEF S22') # Choose S22 for trace 4
-        self.write('CALC1:TRAC1:FORM SMITH')  # Trace format
-        self.write('CALC1:TRAC2:FORM SMITH')  # Trace format
-        self.write('CALC1:TRAC3:FORM SMITH')  # Trace format
-        self.write('CALC1:TRAC4:FORM SMITH')  # Trace format
-        self.write('TRIG:SEQ:SING') # Trigger a single sweep
-        self.ask('*OPC?') # Wait for measurement to complete
-
-        # Get data as string
-        freq_raw = self.ask("SENS1:FREQ:DATA?")
-        s11_raw = self.ask("CALC1:TRAC1:DATA:FDAT?")
-        s12_raw = self.ask("CALC1:TRAC2:DATA:FDAT?")
-        s21_raw = self.ask("CALC1:TRAC3:DATA:FDAT?")
-        s22_raw = self.ask("CALC1:TRAC4:DATA:FDAT?")
-
-        # Get data as numpy array
-        freq = np.fromstring(freq_raw, dtype=float, sep=',')
-        s11 = np.fromstring(s11_raw, dtype=float, sep=',')
-        s11 = s11[0::2] + 1j*s11[1::2]
-        s12 = np.fromstring(s12_raw, dtype=float, sep=',')
-        s12 = s12[0::2] + 1j*s12[1::2]
-        s21 = np.fromstring(s21_raw, dtype=float, sep=',')
-        s21 = s21[0::2] + 1j*s21[1::2]
-        s22 = np.fromstring(s22_raw, dtype=float, sep=',')
-        s22 = s22[0::2] + 1j*s22[1::2]
-
-        return (np.array(freq), self._db(s11), np.array(np.angle(s11)),
-                                self._db(s12), np.array(np.angle(s12)),
-                                self._db(s21), np.array(np.angle(s21)),
-                                self._db(s22), np.array(np.angle(s22)))
+        return (np.array(sweep.frequencies), db[0], phase[0],
+                                             db[1], phase[1],
+                                             db[2], phase[2],
+                                             db[3], phase[3])
 
     def update_lin_traces(self) -> None:
         """
         Updates start, stop and npts of all trace parameters so that the
         setpoints and shape are updated for the sweep.
         """
+        self._frequencies = None
         start = self.start()
         stop = self.stop()
         npts = self.npts()
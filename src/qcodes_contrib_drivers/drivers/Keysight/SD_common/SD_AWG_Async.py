@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
 import threading
-import queue
 import sys
-from typing import Dict, List, Union, Optional, TypeVar, Callable, Any, cast
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Union, Optional, TypeVar, Callable, Any, cast
 import time
 import logging
-from functools import wraps
+from functools import wraps, partial
 
 import numpy as np
 
 from .SD_Module import keysightSD1, result_parser
 from .SD_AWG import SD_AWG
 from .memory_manager import MemoryManager
+from .waveform_cache import WaveformCache, CachedWaveform
+from .upload_queue import (Task, _StopTask, TaskQueue, Conversion,
+                           cancel_released_upload)
 
 
 F = TypeVar('F', bound=Callable[..., Any])
@@ -43,60 +46,13 @@ def switchable(switch: Callable[[Any], bool], enabled: bool) -> Callable[[F], F]
     return switchable_decorator
 
 
-class Task:
-    """
-    Task to be executed asynchronously.
-
-    Args:
-        f: function to execute
-        instance: object function `f` belongs to
-        args: argument list to pass to function
-        kwargs: keyword arguments to pass to function
-    """
-
-    verbose = False
-    ''' Enables verbose logging '''
-
-    def __init__(self, f:F, instance: Any, *args, **kwargs) -> None:
-        self._event = threading.Event()
-        self._f = f
-        self._instance = instance
-        self._args = args
-        self._kwargs = kwargs
-
-    def run(self) -> None:
-        """
-        Executes the function. The function result can be retrieved with property `result`.
-        """
-        start = time.perf_counter()
-        if not self._instance._start_time:
-            self._instance._start_time = start
-
-        if Task.verbose:
-            logging.debug(f'[{self._instance.name}] > {self._f.__name__}')
-        self._result = self._f(self._instance, *self._args, **self._kwargs)
-        if Task.verbose:
-            total = time.perf_counter() - self._instance._start_time
-            logging.debug(f'[{self._instance.name}] < {self._f.__name__} ({(time.perf_counter()-start)*1000:5.2f} ms '
-                          f'/ {total*1000:5.2f} ms)')
-        self._event.set()
-
-    @property
-    def result(self) -> Any:
-        """
-        Returns the result of the executed function.
-        Waits till function has been executed.
-        """
-        self._event.wait()
-        return self._result
-
-
-def threaded(wait: bool = False) -> Callable[[F], F]:
+def threaded(wait: bool = False, priority: float = 0) -> Callable[[F], F]:
     """
     Decoractor to execute the wrapped method in the background thread.
 
     Args:
         wait: if True waits till the function has been executed.
+        priority: priority of the task in the queue of the background thread.
     """
 
     def threaded_decorator(func):
@@ -105,7 +61,7 @@ def threaded(wait: bool = False) -> Callable[[F], F]:
         def func_wrapper(self, *args, **kwargs):
 
             task = Task(func, self, *args, **kwargs)
-            self._task_queue.put(task)
+            self._submit(task, priority)
             if wait:
                 result = task.result
                 self._start_time = None
@@ -166,20 +122,31 @@ class WaveformReference:
 class _WaveformReferenceInternal(WaveformReference):
     """
     Reference to waveform in AWG memory.
+    References to waveforms with the same data share the cached waveform.
 
     Args:
-        allocated_slot: memory slot containing reference to address in AWG memory.
+        cached_wave: cached waveform containing reference to address in AWG memory.
+        cache: cache the waveform belongs to.
         awg_name: name of the AWG
     """
 
-    def __init__(self, allocated_slot: MemoryManager.AllocatedSlot, awg_name: str) -> None:
-        super().__init__(allocated_slot.number, awg_name)
-        self._allocated_slot = allocated_slot
-        self._uploaded = threading.Event()
-        self._upload_error: Optional[str] = None
+    def __init__(self, cached_wave: CachedWaveform, cache: WaveformCache,
+                 awg_name: str) -> None:
+        super().__init__(cached_wave.wave_number, awg_name)
+        self._cached_wave = cached_wave
+        self._cache = cache
         self._released: bool = False
+        self._slot_released: bool = False
         self._queued_count: int = 0
 
+    @property
+    def _uploaded(self) -> threading.Event:
+        return self._cached_wave.uploaded
+
+    @property
+    def _upload_error(self) -> Optional[str]:
+        return self._cached_wave.upload_error
+
 
     def release(self) -> None:
         """
@@ -229,8 +196,9 @@ class _WaveformReferenceInternal(WaveformReference):
 
 
     def _try_release_slot(self) -> None:
-        if self._released and self._queued_count <= 0:
-            self._allocated_slot.release()
+        if self._released and self._queued_count <= 0 and not self._slot_released:
+            self._slot_released = True
+            self._cache.release(self._cached_wave)
 
 
     def __del__(self) -> None:
@@ -248,6 +216,17 @@ class SD_AWG_Async(SD_AWG):
     This driver is derived from SD_AWG and uses a thread to upload waveforms.
     This class creates reusable memory slots of different sizes in AWG.
     It assigns waveforms to the smallest available memory slot.
+    Uploaded waveforms stay in AWG memory after release. Uploading a waveform
+    with the same data again reuses the waveform in memory. By default only
+    waveforms of at most `cache_size_limit` samples are cached. The least
+    recently used waveforms are evicted when AWG memory is full.
+
+    Uploads are executed in order of priority. The waveforms of the next
+    uploads in the queue are converted to AWG format by a pool of worker
+    threads shared by all modules, so the conversion of the next wave
+    overlaps with the transfer of the previous wave. Uploads of waveforms that are released before they are uploaded
+    are cancelled. AWG memory is reserved in the background with low priority.
+    The durations of the last upload are available as parameters.
 
     Only one instance of this class per AWG module is allowed.
     By default the maximum size of a waveform is limited to 1e6 samples.
@@ -288,6 +267,25 @@ class SD_AWG_Async(SD_AWG):
     _modules: Dict[str, 'SD_AWG_Async'] = {}
     """ All async modules by unique module id. """
 
+    reservation_priority: float = -1
+    """ Priority of the reservation of AWG memory relative to uploads (default 0) """
+
+    conversion_workers: int = 4
+    """ Number of threads converting waveforms for all modules """
+
+    conversion_look_ahead: int = 2
+    """ Number of queued tasks for which the waveform conversion is started in advance """
+
+    cache_size_limit: int = 1_000_000
+    """
+    Waveforms with more samples are not cached unless use_cache is True.
+    The digest of a waveform is computed on the calling thread and takes
+    about 15 ms per million samples.
+    """
+
+    _conversion_pool: Optional[ThreadPoolExecutor] = None
+    _conversion_pool_lock = threading.Lock()
+
     def __init__(self, name, chassis, slot, channels, triggers, waveform_size_limit=1e6,
                  asynchronous=True, **kwargs) -> None:
         super().__init__(name, chassis, slot, channels, triggers, **kwargs)
@@ -295,6 +293,45 @@ class SD_AWG_Async(SD_AWG):
         self._asynchronous = False
         self._waveform_size_limit = waveform_size_limit
         self._start_time = None
+        self._upload_metrics: Dict[str, float] = {
+            'queue_time': 0.0, 'conversion_time': 0.0, 'transfer_time': 0.0,
+            'latency': 0.0, 'uploaded': 0, 'cancelled': 0}
+
+        self.add_parameter('upload_queue_time',
+                           label='upload queue time',
+                           unit='s',
+                           get_cmd=partial(self._upload_metrics.get, 'queue_time'),
+                           docstring='Time the last upload waited in the queue')
+        self.add_parameter('upload_conversion_time',
+                           label='upload conversion time',
+                           unit='s',
+                           get_cmd=partial(self._upload_metrics.get, 'conversion_time'),
+                           docstring='Time the last upload waited for the conversion '
+                                     'of the waveform after it was dequeued')
+        self.add_parameter('upload_transfer_time',
+                           label='upload transfer time',
+                           unit='s',
+                           get_cmd=partial(self._upload_metrics.get, 'transfer_time'),
+                           docstring='Time to transfer the last uploaded waveform to the AWG')
+        self.add_parameter('upload_latency',
+                           label='upload latency',
+                           unit='s',
+                           get_cmd=partial(self._upload_metrics.get, 'latency'),
+                           docstring='Time from upload_waveform() till the last '
+                                     'waveform was in AWG memory')
+        self.add_parameter('uploads_completed',
+                           label='uploads completed',
+                           get_cmd=partial(self._upload_metrics.get, 'uploaded'),
+                           docstring='Number of waveforms uploaded')
+        self.add_parameter('uploads_cancelled',
+                           label='uploads cancelled',
+                           get_cmd=partial(self._upload_metrics.get, 'cancelled'),
+                           docstring='Number of uploads cancelled, because the '
+                                     'waveform was released before upload')
+        self.add_parameter('upload_queue_length',
+                           label='upload queue length',
+                           get_cmd=self._get_queue_length,
+                           docstring='Number of tasks in the queue of the uploader thread')
 
         module_id = self._get_module_id()
         if module_id in SD_AWG_Async._modules:
@@ -516,7 +553,7 @@ class SD_AWG_Async(SD_AWG):
         if self._asynchronous:
             self._release_waverefs_awg(awg_number)
 
-    @threaded(wait=True)
+    @threaded(wait=True, priority=Task.LAST)
     def uploader_ready(self) -> bool:
         """ Waits until uploader thread is ready with tasks queued before this call. """
         return True
@@ -585,29 +622,60 @@ class SD_AWG_Async(SD_AWG):
 
 
     @switchable(asynchronous, enabled=True)
-    def upload_waveform(self, wave: Union[List[float], List[int], np.ndarray]
+    def upload_waveform(self, wave: Union[List[float], List[int], np.ndarray],
+                        use_cache: Optional[bool] = None, priority: float = 0
                         ) -> _WaveformReferenceInternal:
         """
         Upload the wave using the uploader thread for this AWG.
+        The upload is skipped when a wave with the same data is still in AWG memory.
+
         Args:
             wave: wave data to upload.
+            use_cache: if False the wave is always uploaded and not cached.
+                By default only waves of at most `cache_size_limit` samples
+                are cached.
+            priority: waves with a higher priority are uploaded first.
         Returns:
             reference to the wave
         """
         if len(wave) < 2000:
             raise Exception(f'{len(wave)} is less than 2000 samples required for proper functioning of AWG')
 
-        allocated_slot = self._memory_manager.allocate(len(wave))
-        ref = _WaveformReferenceInternal(allocated_slot, self.name)
-        self.log.debug(f'upload: {ref.wave_number}')
-        self._upload(wave, ref)
+        if use_cache is None:
+            use_cache = len(wave) <= self.cache_size_limit
+        key = None
+        if use_cache:
+            # convert once for the digest and the conversion to SD_Wave
+            wave = np.ascontiguousarray(wave, dtype=float)
+            key = WaveformCache.key(wave)
+        cached_wave, upload = self._waveform_cache.acquire(key, len(wave))
+        ref = _WaveformReferenceInternal(cached_wave, self._waveform_cache, self.name)
+        if upload:
+            self.log.debug(f'upload: {ref.wave_number}')
+            conversion = Conversion(self._get_conversion_pool(),
+                                    SD_AWG_Async._convert, wave, cached_wave)
+            task = Task(SD_AWG_Async._upload, self, wave, conversion, cached_wave,
+                        time.perf_counter())
+            task.prepare = conversion.start
+            self._submit(task, priority)
+        else:
+            self.log.debug(f'cached: {ref.wave_number}')
         return ref
 
+    @switchable(asynchronous, enabled=True)
+    def waveform_cache_statistics(self) -> Dict[str, int]:
+        """
+        Returns the hits, misses and evictions of the waveform cache and
+        the number of (unreferenced) waveforms in the cache.
+        """
+        return self._waveform_cache.statistics()
+
     def release_waveform_memory(self) -> None:
         """
         Releases all AWG memory regardless of any references being held.
         """
         if self.asynchronous():
+            self._waveform_cache.clear()
             self._memory_manager.release_all()
 
     def close(self) -> None:
@@ -636,11 +704,13 @@ class SD_AWG_Async(SD_AWG):
         """
         super().flush_waveform()
         self._memory_manager: MemoryManager = MemoryManager(self.log, self._waveform_size_limit)
+        self._waveform_cache: WaveformCache = WaveformCache(self._memory_manager)
         self._enqueued_waverefs:Dict[int, List[_WaveformReferenceInternal]] = {}
         for i in range(self.channels):
             self._enqueued_waverefs[i+1] = []
 
-        self._task_queue: queue.Queue = queue.Queue()
+        self._task_queue: TaskQueue = TaskQueue(SD_AWG_Async.conversion_look_ahead)
+        self._reserved_slots: Set[int] = set()
         self._init_awg_memory()
         self._thread: threading.Thread = threading.Thread(target=self._run, name=f'uploader-{self.module_id}')
         self._thread.start()
@@ -651,7 +721,7 @@ class SD_AWG_Async(SD_AWG):
         Stops the asynchronous upload thread and memory manager.
         """
         if self._task_queue:
-            self._task_queue.put('STOP')
+            self._submit(_StopTask(self), Task.LAST)
 
         # wait at most 15 seconds. Should be more enough for normal scenarios
         self._thread.join(15)
@@ -659,6 +729,7 @@ class SD_AWG_Async(SD_AWG):
             self.log.error(f'AWG upload thread {self.module_id} stop failed. Thread still running.')
 
         self._release_waverefs()
+        del self._waveform_cache
         del self._memory_manager
         del self._task_queue
         del self._thread
@@ -675,75 +746,121 @@ class SD_AWG_Async(SD_AWG):
         self._enqueued_waverefs[awg_number] = []
 
 
-    @threaded()
     def _init_awg_memory(self) -> None:
         """
         Initialize memory on the AWG by uploading waveforms with all zeros.
+        The slots are reserved in the background with low priority.
+        Uploads to slots that are not yet reserved reserve the slot first.
         """
         new_slots = self._memory_manager.get_uninitialized_slots()
         if len(new_slots) == 0:
             return
 
         self.log.info(f'Reserving awg memory for {len(new_slots)} slots')
-
-        zeros: np.ndarray = np.zeros(0)
-        wave = None
-        total_size = 0
-        total_duration = 0.0
         for slot in new_slots:
-            start = time.perf_counter()
-            if len(zeros) != slot.size or wave is None:
-                zeros = np.zeros(slot.size, float)
-                wave = keysightSD1.SD_Wave()
-                result_parser(wave.newFromArrayDouble(keysightSD1.SD_WaveformTypes.WAVE_ANALOG, zeros))
-            super().load_waveform(wave, slot.number)
-            duration = time.perf_counter() - start
-            # self.log.debug(f'uploaded {slot.size} in  {duration*1000:5.2f} ms ({slot.size/duration/1e6:5.2f} MSa/s)')
-            total_duration += duration
-            total_size += slot.size
-
-        self.log.info(f'Awg memory reserved: {len(new_slots)} slots, {total_size/1e6} MSa in '
-                      f'{total_duration*1000:5.2f} ms ({total_size/total_duration/1e6:5.2f} MSa/s)')
-
-    @threaded()
+            self._submit(Task(SD_AWG_Async._reserve_slot, self, slot.number, slot.size),
+                         SD_AWG_Async.reservation_priority)
+
+    def _reserve_slot(self, number: int, size: int) -> None:
+        if number in self._reserved_slots:
+            return
+        start = time.perf_counter()
+        if self._zeros is None or self._zeros_size != size:
+            # keep only one wave with zeros. It can be very large.
+            self._zeros = keysightSD1.SD_Wave()
+            result_parser(self._zeros.newFromArrayDouble(keysightSD1.SD_WaveformTypes.WAVE_ANALOG,
+                                                         np.zeros(size, float)))
+            self._zeros_size = size
+        super().load_waveform(self._zeros, number)
+        self._reserved_slots.add(number)
+        duration = time.perf_counter() - start
+        if Task.verbose:
+            self.log.debug(f'reserved slot {number}: {size} in {duration*1000:5.2f} ms '
+                           f'({size/duration/1e6:5.2f} MSa/s)')
+
+    @staticmethod
+    def _convert(wave_data: Union[List[float], List[int], np.ndarray],
+                 cached_wave: CachedWaveform) -> Optional[keysightSD1.SD_Wave]:
+        """
+        Converts the wave data to an SD_Wave in a thread of the conversion pool.
+        Returns None when the wave has been released before conversion.
+        """
+        if cached_wave.ref_count <= 0:
+            return None
+        wave = keysightSD1.SD_Wave()
+        result_parser(wave.newFromArrayDouble(keysightSD1.SD_WaveformTypes.WAVE_ANALOG, wave_data))
+        return wave
+
     def _upload(self,
                 wave_data: Union[List[float], List[int], np.ndarray],
-                wave_ref: _WaveformReferenceInternal) -> None:
-        # self.log.debug(f'Uploading {wave_ref.wave_number}')
+                conversion: Conversion,
+                cached_wave: CachedWaveform,
+                submit_time: float) -> None:
+        # self.log.debug(f'Uploading {cached_wave.wave_number}')
+        metrics = self._upload_metrics
+        start = time.perf_counter()
+        queue_time = start - submit_time
+        if cancel_released_upload(self._waveform_cache, cached_wave, conversion):
+            self.log.debug(f'Cancelled upload {cached_wave.wave_number}')
+            metrics['cancelled'] += 1
+            return
         try:
-            start = time.perf_counter()
-
-            wave = keysightSD1.SD_Wave()
-            result_parser(wave.newFromArrayDouble(keysightSD1.SD_WaveformTypes.WAVE_ANALOG, wave_data))
-            super().reload_waveform(wave, wave_ref.wave_number)
-
-            duration = time.perf_counter() - start
-            speed = len(wave_data)/duration
-            self.log.debug(f'Uploaded {wave_ref.wave_number} in {duration*1000:5.2f} ms ({speed/1e6:5.2f} MSa/s)')
+            wave = conversion.result()
+            if wave is None:
+                # released and referenced again before conversion
+                wave = SD_AWG_Async._convert(wave_data, cached_wave)
+            converted = time.perf_counter()
+
+            slot = cached_wave.allocated_slot
+            if slot.number not in self._reserved_slots:
+                self._reserve_slot(slot.number, slot.size)
+            super().reload_waveform(wave, cached_wave.wave_number)
+
+            end = time.perf_counter()
+            speed = len(wave_data)/(end - converted)
+            metrics['queue_time'] = queue_time
+            metrics['conversion_time'] = converted - start
+            metrics['transfer_time'] = end - converted
+            metrics['latency'] = end - submit_time
+            metrics['uploaded'] += 1
+            self.log.debug(f'Uploaded {cached_wave.wave_number} in {(end-converted)*1000:5.2f} ms '
+                           f'({speed/1e6:5.2f} MSa/s)')
         except Exception as ex:
             msg = f'{type(ex).__name__}:{ex}'
             min_value = np.min(wave_data)
             max_value = np.max(wave_data)
             if min_value < -1.0 or max_value > 1.0:
                 msg += ': Voltage out of range'
-            self.log.error(f'Failure load waveform {wave_ref.wave_number}: {msg}' )
-            wave_ref._upload_error = msg
+            self.log.error(f'Failure load waveform {cached_wave.wave_number}: {msg}' )
+            cached_wave.upload_error = msg
+            # don't reuse the failed upload
+            self._waveform_cache.invalidate(cached_wave)
 
         # signal upload done, either successful or with error
-        wave_ref._uploaded.set()
+        cached_wave.uploaded.set()
+
+    def _submit(self, task: Task, priority: float) -> None:
+        self._task_queue.submit(task, priority)
 
+    def _get_queue_length(self) -> int:
+        if not self._asynchronous:
+            return 0
+        return self._task_queue.qsize()
+
+    @classmethod
+    def _get_conversion_pool(cls) -> ThreadPoolExecutor:
+        with cls._conversion_pool_lock:
+            if cls._conversion_pool is None:
+                cls._conversion_pool = ThreadPoolExecutor(
+                        cls.conversion_workers, thread_name_prefix='awg-conversion')
+            return cls._conversion_pool
 
     def _run(self) -> None:
         self.log.info('Uploader ready')
+        self._zeros: Optional[keysightSD1.SD_Wave] = None
+        self._zeros_size = 0
 
-        while True:
-            task: Task = self._task_queue.get()
-            if task == 'STOP':
-                break
-            try:
-                task.run()
-            except:
-                logging.error('Task thread error', exc_info=True)
-            del task
+        self._task_queue.run()
 
+        self._zeros = None
         self.log.info('Uploader terminated')
@@ -28,6 +28,8 @@ class MemoryManager:
         number: int
         allocation_ref: int
         memory_manager: 'MemoryManager'
+        size: int = 0
+        '''Reserved number of samples'''
 
         def release(self) -> None:
             self.memory_manager.release(self)
@@ -43,6 +45,7 @@ class MemoryManager:
         Used to check for incorrect or missing release calls.
         '''
         allocation_time: str = ''
+        wave_size: int = 0
 
     # Note (M3202A): size must be multiples of 10 and >= 2000
     memory_sizes = [
@@ -83,6 +86,10 @@ class MemoryManager:
         self._max_waveform_size = waveform_size_limit
         self._create_memory_slots(waveform_size_limit)
 
+    @property
+    def max_waveform_size(self) -> int:
+        return self._max_waveform_size
+
     def get_uninitialized_slots(self) -> List['MemoryManager._MemorySlot']:
         """
         Returns list of slots that must be initialized (reserved in AWG)
@@ -122,10 +129,12 @@ class MemoryManager:
                 self._allocation_ref_count += 1
                 self._slots[slot].allocation_ref = self._allocation_ref_count
                 self._slots[slot].allocated = True
+                self._slots[slot].wave_size = wave_size
                 self._slots[slot].allocation_time = datetime.now().strftime('%H:%M:%S.%f')
                 if MemoryManager.verbose:
                     self._log.debug(f'Allocated slot {slot}')
-                return MemoryManager.AllocatedSlot(slot, self._slots[slot].allocation_ref, self)
+                return MemoryManager.AllocatedSlot(slot, self._slots[slot].allocation_ref, self,
+                                                   size=slot_size)
 
         raise Exception(f'No free memory slots left for waveform with'
                         f' {wave_size} samples.')
@@ -198,6 +207,32 @@ class MemoryManager:
 
         raise Exception(f'Requested waveform size {size} is too big')
 
+    def statistics(self) -> Dict[str, float]:
+        '''
+        Returns utilisation and fragmentation of the AWG memory.
+
+        'capacity', 'reserved' and 'used' are numbers of samples of the
+        managed memory, the allocated memory and the allocated waveforms.
+        'utilisation' is the fraction of the capacity used by waveforms.
+        'internal_fragmentation' is the fraction of the allocated memory not
+        used by the waveforms. 'external_fragmentation' is the fraction of the
+        free memory that is not in the largest free slot.
+        '''
+        capacity = sum(slot.size for slot in self._slots)
+        reserved = sum(slot.size for slot in self._slots if slot.allocated)
+        used = sum(slot.wave_size for slot in self._slots if slot.allocated)
+        largest_free = max([size for size, slots in self._free_memory_slots.items()
+                            if len(slots) > 0], default=0)
+        free = capacity - reserved
+        return {
+            'capacity': capacity,
+            'reserved': reserved,
+            'used': used,
+            'utilisation': used / capacity if capacity else 0.0,
+            'internal_fragmentation': 1 - used / reserved if reserved else 0.0,
+            'external_fragmentation': 1 - largest_free / free if free else 0.0,
+            }
+
     def mem_usage(self):
         '''
         Example:
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import threading
+import queue
+import itertools
+import time
+import logging
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, List, Optional, TypeVar
+
+from .waveform_cache import WaveformCache, CachedWaveform
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class Task:
+    """
+    Task to be executed asynchronously.
+    Tasks with a higher priority are executed first. Tasks with equal
+    priority are executed in order of submission.
+
+    Args:
+        f: function to execute
+        instance: object function `f` belongs to
+        args: argument list to pass to function
+        kwargs: keyword arguments to pass to function
+    """
+
+    verbose = False
+    ''' Enables verbose logging '''
+
+    LAST = float('-inf')
+    ''' Priority of tasks that must run after all tasks submitted before '''
+
+    _sequence = itertools.count()
+
+    def __init__(self, f:F, instance: Any, *args, **kwargs) -> None:
+        self._event = threading.Event()
+        self._f = f
+        self._instance = instance
+        self._args = args
+        self._kwargs = kwargs
+        self.priority: float = 0
+        self.prepare: Optional[Callable[[], Any]] = None
+        ''' Called when the task is one of the next tasks in the queue '''
+        self._order = next(Task._sequence)
+
+    def __lt__(self, other: 'Task') -> bool:
+        return (-self.priority, self._order) < (-other.priority, other._order)
+
+    def run(self) -> None:
+        """
+        Executes the function. The function result can be retrieved with property `result`.
+        """
+        start = time.perf_counter()
+        if not self._instance._start_time:
+            self._instance._start_time = start
+
+        if Task.verbose:
+            logging.debug(f'[{self._instance.name}] > {self._f.__name__}')
+        self._result = self._f(self._instance, *self._args, **self._kwargs)
+        if Task.verbose:
+            total = time.perf_counter() - self._instance._start_time
+            logging.debug(f'[{self._instance.name}] < {self._f.__name__} ({(time.perf_counter()-start)*1000:5.2f} ms '
+                          f'/ {total*1000:5.2f} ms)')
+        self._event.set()
+
+    @property
+    def result(self) -> Any:
+        """
+        Returns the result of the executed function.
+        Waits till function has been executed.
+        """
+        self._event.wait()
+        return self._result
+
+
+class _StopTask(Task):
+    """
+    Task that stops the background thread after all tasks submitted before.
+    """
+    def __init__(self, instance: Any) -> None:
+        super().__init__(lambda instance: None, instance)
+
+
+class Conversion:
+    """
+    Conversion of a waveform that is started on the conversion pool when
+    the upload is one of the next tasks of the upload thread.
+    The conversion runs in the calling thread if it was not started
+    before its result is needed.
+
+    Args:
+        pool: executor running the conversion
+        f: conversion function
+        args: arguments to pass to the function
+    """
+    def __init__(self, pool: Executor, f: Callable[..., Any], *args) -> None:
+        self._pool = pool
+        self._f = f
+        self._args = args
+        self._future: Optional[Future] = None
+        self._cancelled = False
+
+    def start(self) -> None:
+        """ Submits the conversion to the pool, if not started or cancelled. """
+        if self._future is None and not self._cancelled:
+            self._future = self._pool.submit(self._f, *self._args)
+
+    def started(self) -> bool:
+        return self._future is not None
+
+    def cancel(self) -> None:
+        self._cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def result(self) -> Any:
+        """ Returns the converted waveform. Waits till the conversion is done. """
+        if self._future is None:
+            return self._f(*self._args)
+        return self._future.result()
+
+
+class TaskQueue:
+    """
+    Priority queue of the tasks of an upload thread.
+
+    The thread executing `run` takes the next `look_ahead` tasks from the
+    queue in advance and prepares them, e.g. starts the conversion of their
+    waveforms, while the current task runs. Tasks submitted later with a
+    higher priority still run first.
+
+    Args:
+        look_ahead: number of tasks to prepare ahead of the running task
+    """
+    def __init__(self, look_ahead: int = 2) -> None:
+        self.look_ahead = look_ahead
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._pending: List[Task] = []
+
+    def submit(self, task: Task, priority: float) -> None:
+        task.priority = priority
+        self._queue.put(task)
+
+    def qsize(self) -> int:
+        """ Returns the number of tasks waiting for execution. """
+        return self._queue.qsize() + len(self._pending)
+
+    def run(self) -> None:
+        """
+        Executes tasks in order of priority until a `_StopTask` is executed.
+        Tasks after the `_StopTask` stay in the queue.
+        """
+        pending = self._pending
+        while True:
+            if not pending:
+                pending.append(self._queue.get())
+            # always take at least one task from the queue, so a task with
+            # a higher priority than the pending tasks is not delayed.
+            while len(pending) <= self.look_ahead:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            pending.sort()
+            task = pending.pop(0)
+            if isinstance(task, _StopTask):
+                for remaining in pending:
+                    self._queue.put(remaining)
+                pending.clear()
+                break
+            for next_task in pending:
+                if next_task.prepare is not None:
+                    next_task.prepare()
+            try:
+                task.run()
+            except:
+                logging.error('Task thread error', exc_info=True)
+            del task
+
+
+def cancel_released_upload(cache: WaveformCache, cached_wave: CachedWaveform,
+                           conversion: Conversion) -> bool:
+    """
+    Cancels the upload and conversion of a waveform that has been released
+    before it was uploaded.
+
+    Returns:
+        True if the upload has been cancelled.
+    """
+    if not cache.discard_unreferenced(cached_wave):
+        return False
+    conversion.cancel()
+    cached_wave.upload_error = 'Upload cancelled'
+    cached_wave.uploaded.set()
+    return True
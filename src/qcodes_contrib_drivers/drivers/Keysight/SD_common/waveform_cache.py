@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Union, List, Tuple
+
+import numpy as np
+
+from .memory_manager import MemoryManager
+
+
+class CachedWaveform:
+    """
+    Waveform resident in AWG memory.
+
+    The entry is shared by all references to waveforms with the same content.
+    The memory slot is kept when the last reference is released, so the
+    waveform can be reused without upload until the slot is evicted.
+
+    Args:
+        key: digest of the waveform data
+        allocated_slot: memory slot containing the waveform
+    """
+    def __init__(self, key: Optional[bytes],
+                 allocated_slot: MemoryManager.AllocatedSlot) -> None:
+        self.key = key
+        self.allocated_slot = allocated_slot
+        self.ref_count: int = 0
+        self.cached: bool = key is not None
+        self.uploaded = threading.Event()
+        self.upload_error: Optional[str] = None
+
+    @property
+    def wave_number(self) -> int:
+        return self.allocated_slot.number
+
+
+class WaveformCache:
+    """
+    Content addressed cache of waveforms in AWG memory.
+
+    Waveforms are identified by a digest of their data. Memory slots of
+    waveforms that are not referenced anymore stay allocated until the
+    memory manager runs out of memory. Then the least recently used
+    unreferenced waveforms are evicted.
+
+    Args:
+        memory_manager: memory manager allocating the AWG memory.
+    """
+
+    def __init__(self, memory_manager: MemoryManager) -> None:
+        self._memory_manager = memory_manager
+        self._entries: 'OrderedDict[bytes, CachedWaveform]' = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @staticmethod
+    def key(wave: Union[List[float], List[int], np.ndarray]) -> bytes:
+        """
+        Returns the digest of the waveform data.
+        Lists and arrays with the same values have the same digest.
+        """
+        data = np.ascontiguousarray(wave, dtype=float)
+        return hashlib.blake2b(data.data, digest_size=16).digest()
+
+    def acquire(self, key: Optional[bytes], wave_size: int
+                ) -> Tuple[CachedWaveform, bool]:
+        """
+        Returns the entry for the waveform and increments its reference count.
+
+        Args:
+            key: digest of the waveform or None to bypass the cache.
+            wave_size: number of samples of the waveform.
+        Returns:
+            entry and True if the waveform must be uploaded.
+        """
+        with self._lock:
+            if key is not None:
+                entry = self._entries.get(key, None)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.ref_count += 1
+                    self.hits += 1
+                    return entry, False
+                self.misses += 1
+
+            entry = CachedWaveform(key, self._allocate(wave_size))
+            entry.ref_count = 1
+            if key is not None:
+                self._entries[key] = entry
+            return entry, True
+
+    def release(self, entry: CachedWaveform) -> None:
+        """
+        Decrements the reference count of the entry.
+        The memory slot is released when the entry is not cached anymore.
+        """
+        with self._lock:
+            entry.ref_count -= 1
+            if entry.ref_count <= 0 and not entry.cached:
+                entry.allocated_slot.release()
+
+    def invalidate(self, entry: CachedWaveform) -> None:
+        """
+        Removes the entry from the cache, e.g. after a failed upload.
+        """
+        with self._lock:
+            self._remove(entry)
+
+    def discard_unreferenced(self, entry: CachedWaveform) -> bool:
+        """
+        Removes the entry if it is not referenced anymore.
+        Used to cancel uploads of waveforms released before they were uploaded.
+
+        Returns:
+            True if the entry has been removed.
+        """
+        with self._lock:
+            if entry.ref_count > 0:
+                return False
+            if entry.cached:
+                self._remove(entry)
+            return True
+
+    def clear(self) -> None:
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock:
+            for entry in list(self._entries.values()):
+                self._remove(entry)
+
+    def statistics(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'unreferenced': sum(1 for entry in self._entries.values()
+                                    if entry.ref_count <= 0),
+                }
+
+    def _remove(self, entry: CachedWaveform) -> None:
+        if not entry.cached:
+            return
+        entry.cached = False
+        del self._entries[entry.key]
+        if entry.ref_count <= 0:
+            entry.allocated_slot.release()
+
+    def _allocate(self, wave_size: int) -> MemoryManager.AllocatedSlot:
+        if wave_size > self._memory_manager.max_waveform_size:
+            # evicting entries won't help
+            return self._memory_manager.allocate(wave_size)
+        while True:
+            try:
+                return self._memory_manager.allocate(wave_size)
+            except Exception:
+                victim = self._select_victim(wave_size)
+                if victim is None:
+                    raise
+                self._remove(victim)
+                self.evictions += 1
+
+    def _select_victim(self, wave_size: int) -> Optional[CachedWaveform]:
+        # least recently used unreferenced entry with a slot that fits.
+        # A smaller slot can never hold the waveform.
+        for entry in self._entries.values():
+            if entry.ref_count <= 0 and entry.allocated_slot.size >= wave_size:
+                return entry
+        return None
@@ -1,8 +1,10 @@
 """  oi.DECS driver for Proteox dilution refrigerator systems  """
 """ Developed and maintained by Oxford Instruments NanoScience """
 
+from concurrent.futures import Future
 from functools import partial
-from typing import Any, Union
+from typing import Any, Optional, Union
+import threading
 import time
 import subprocess
 import platform
@@ -11,6 +13,8 @@ import numpy as np
 from qcodes.instrument import VisaInstrument
 from qcodes.parameters import MultiParameter
 
+from .stability_monitor import StabilityMonitor
+
 from qcodes_contrib_drivers.drivers.OxfordInstruments._decsvisa.src.decs_visa_tools.decs_visa_settings import PORT
 from qcodes_contrib_drivers.drivers.OxfordInstruments._decsvisa.src.decs_visa_tools.decs_visa_settings import HOST
 from qcodes_contrib_drivers.drivers.OxfordInstruments._decsvisa.src.decs_visa_tools.decs_visa_settings import SHUTDOWN
@@ -152,6 +156,10 @@ class oiDECS(VisaInstrument):
 
         super().__init__(name, f'TCPIP::{HOST}::{PORT}::SOCKET', terminator=WRITE_DELIM, **kwargs)
 
+        # The monitor polls from its own thread
+        self._io_lock = threading.RLock()
+        self.monitor: Optional[StabilityMonitor] = None
+
         self.add_parameter(
             "PT1_Head_Temperature",
             unit="K",
@@ -516,55 +524,77 @@ class oiDECS(VisaInstrument):
             time.sleep(1)
         print(f'Status: {self.Magnet_State()}.')
 
-    def wait_until_temperature_stable_std_control(self, stable_mean, stable_std, time_between_readings):
+    def wait_until_temperature_stable_std_control(self, stable_mean, stable_std, time_between_readings,
+                                                  wait=True):
         """
         Mixing chamber temperature control utility function
 
         Takes a moving average of 30 temperature readings and finds the mean and the std of the last 30 readings,
         until the difference between the mean and target value is below 'stable_mean' and the standard deviation is below 'stable_std'.
+        The readings are taken by a StabilityMonitor on a background thread.
 
         Args:
             stable_mean: float - difference between the mean and target value to be achieved by the last 30 temperature readings
             stable_std: float - standard deviation to be achieved by the last 30 temperature readings
             time_between_readings: float - time between taking temperature readings
-        
+            wait: bool - if False, returns a Future with the temperature instead of waiting
+
         """
         target_temp = self.Mixing_Chamber_Temperature_Target()
 
         print(f'Waiting for temperature to stablilise at {target_temp} K.')
-        
-        #take 30 temperature readings 
+
         t1 = time.time()
-        t_array = np.zeros(30)
-        for n in range(0,30):
-            time.sleep(time_between_readings)
-            temp = self.Mixing_Chamber_Temperature()
-            t_array[n] = float(temp)
-            
-        stab = False
-        while stab is False:
-            time.sleep(time_between_readings)
-            temp = self.Mixing_Chamber_Temperature()
-            t_array = np.append(t_array, float(temp))
-
-            t_array = t_array[1:]
+        monitor = self.start_monitor(time_between_readings)
+        future = monitor.wait_until_stable('MC', target_temp, max_deviation=stable_mean,
+                                           max_std=stable_std, window=30)
+
+        def report(future: Future) -> None:
+            if future.cancelled() or future.exception() is not None:
+                return
+            tt = time.time()-t1
+            _, t_array = monitor.history('MC', 30)
             s = np.std(t_array)
             m = np.abs(np.mean(t_array) - target_temp)
-            
-            if (s < stable_std) and (m < stable_mean):
-                stab = True
-                
-        t2 = time.time()
-        tt = t2-t1
-        print(f'Temperature = {t_array[-1]} K')
-        print(f'Temperature stable after {int(tt)} seconds. (Mean-Target = {m} K, StdDev = {s} K)')
+            print(f'Temperature = {future.result()} K')
+            print(f'Temperature stable after {int(tt)} seconds. (Mean-Target = {m} K, StdDev = {s} K)')
+
+        future.add_done_callback(report)
+        if not wait:
+            return future
+        future.result()
+
+    def start_monitor(self, interval: float = 1.0) -> StabilityMonitor:
+        """
+        Starts polling the mixing chamber temperature ('MC') on a background
+        thread, see StabilityMonitor. A running monitor with the same
+        interval is reused.
+
+        Args:
+            interval: time between readings in s
+        """
+        if self.monitor is not None and self.monitor.running:
+            if self.monitor.interval == interval:
+                return self.monitor
+            self.monitor.stop()
+        self.monitor = StabilityMonitor({'MC': self.Mixing_Chamber_Temperature},
+                                        interval, name=f'{self.name}-monitor')
+        self.monitor.start()
+        return self.monitor
+
+    def stop_monitor(self) -> None:
+        """ Stops the background monitor and cancels pending waits. """
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
 
     def ask(self, cmd: str) -> str:
         """
         Args:
             cmd: the command to send to the instrument
         """
-        resp = self.visa_handle.query(cmd)
+        with self._io_lock:
+            resp = self.visa_handle.query(cmd)
 
         return resp
 
@@ -581,7 +611,12 @@ class oiDECS(VisaInstrument):
         # Hence ask rather than write
         self.ask(dressed_cmd)
 
+    def write_raw(self, cmd: str) -> None:
+        with self._io_lock:
+            super().write_raw(cmd)
+
     def close(self) -> None:
+        self.stop_monitor()
         # Kill off the WAMP and socket connections
         self.write(SHUTDOWN)
         return super().close()
@@ -1,53 +1,183 @@
 # This Python file uses the following encoding: utf-8
 # Etienne Dumur <etienne.dumur@gmail.com>, october 2020
+import math
+import mmap
 import os
-from typing import Optional
-import pandas as pd
+from typing import Dict, List, Optional, Tuple
 import subprocess
 import time
 
+import numpy as np
 
 from qcodes.instrument.base import Instrument
 
 
+class _VCLReader:
+    """
+    Incremental reader of the binary vcl log files of the Triton software.
+
+    A vcl file starts with a header of `header_size` bytes which contains
+    the channel names as NUL padded ASCII records of `name_size` bytes. The
+    header is followed by one record per log entry, made of one
+    little-endian float64 per channel, the first channel being the time.
+
+    The file is memory-mapped and only the records appended since the last
+    read are parsed. The layout is checked when the header is read and the
+    times are checked against the previous read; a ValueError is raised
+    when the file does not match the layout.
+
+    This layout has not been validated against the files of every version
+    of the Triton software, so the reader is only used when asked for.
+
+    Args:
+        path: Path of the vcl log file.
+    """
+
+    header_size = 0x7000
+    name_size = 32
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.names: List[str] = []
+        self.rows_read = 0
+        self.last_row: Dict[str, float] = {}
+        self._last_time = -math.inf
+        self._state: Optional[Tuple[int, int]] = None
+
+    def read_new_rows(self) -> np.ndarray:
+        """
+        Return the records appended since the last read, one row per
+        record. A record that is still being written is left for the next
+        read.
+        """
+        stat = os.stat(self.path)
+        state = (stat.st_size, stat.st_mtime_ns)
+        if state == self._state:
+            return np.empty((0, len(self.names)))
+        if stat.st_size < self.header_size:
+            raise ValueError('Not a vcl file, header incomplete: '+self.path)
+
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if not self.names:
+                    self.names = self._parse_names(mm[:self.header_size])
+                row_size = 8 * len(self.names)
+                n_rows = (len(mm) - self.header_size) // row_size
+                if n_rows < self.rows_read:
+                    # The file has been replaced, e.g. by a new log file
+                    self.rows_read = 0
+                    self._last_time = -math.inf
+                rows = np.frombuffer(
+                    mm, dtype='<f8', count=(n_rows - self.rows_read) * len(self.names),
+                    offset=self.header_size + self.rows_read * row_size,
+                    ).reshape(-1, len(self.names)).copy()
+
+        self._check_times(rows)
+        self.rows_read = n_rows
+        self._state = state
+        if len(rows):
+            self.last_row = dict(zip(self.names, rows[-1].tolist()))
+            self._last_time = rows[-1, 0]
+        return rows
+
+    def _parse_names(self, header: bytes) -> List[str]:
+        """
+        Return the channel names: the longest run of consecutive name
+        records of the header.
+        """
+        best: List[str] = []
+        run: List[str] = []
+        for offset in range(0, len(header) - self.name_size + 1, self.name_size):
+            name = self._parse_name(header[offset:offset + self.name_size])
+            if name is None:
+                run = []
+                continue
+            run.append(name)
+            if len(run) > len(best):
+                best = list(run)
+        if len(best) < 2:
+            raise ValueError('No channel names in the vcl header: '+self.path)
+        return best
+
+    @staticmethod
+    def _parse_name(record: bytes) -> Optional[str]:
+        """
+        Return the name stored in a NUL padded ASCII record or None.
+        """
+        name, _, padding = record.partition(b'\0')
+        if not name or padding.strip(b'\0'):
+            return None
+        if not all(0x20 <= c < 0x7f for c in name):
+            return None
+        return name.decode('ascii').strip()
+
+    def _check_times(self, rows: np.ndarray) -> None:
+        times = np.concatenate(([self._last_time], rows[:, 0]))
+        if len(rows) and (not np.all(np.isfinite(times[1:]))
+                          or np.any(np.diff(times) < 0)):
+            raise ValueError('Unexpected vcl layout, the first channel '
+                             'is not a time: '+self.path)
+
+
 class Triton(Instrument):
     """
     This is the QCoDeS python driver to extract the temperature and pressure
     from a Oxford Triton fridge.
     """
 
-    def __init__(self, name: str, file_path: str, converter_path: str,
+    # Log file column of every channel. Above the threshold temperature the
+    # mixing chamber temperature is read from the cernox.
+    _temperature_columns = {'50k': 'PT1 Plate T(K)',
+                            '4k': 'PT2 Plate T(K)',
+                            'magnet': 'Magnet T(K)',
+                            'still': 'Still T(K)',
+                            '100mk': '100mK Plate T(K)',
+                            'mc': 'MC cernox T(K)'}
+    _pressure_columns = {'condensation': 'P2 Condense (Bar)',
+                         'tank': 'P1 Tank (Bar)',
+                         'forepump': 'P5 ForepumpBack (Bar)'}
+
+    def __init__(self, name: str, file_path: str,
+                 converter_path: Optional[str] = None,
                  threshold_temperature: float = 4, conversion_timer: float = 30,
-                 magnet: bool = False, **kwargs) -> None:
+                 magnet: bool = False, native_reader: bool = False,
+                 **kwargs) -> None:
         """
         QCoDeS driver for Oxford Triton fridges.
         ! This driver get parameters from the fridge log files.
         ! It does not interact with the fridge electronics.
-        Since Oxford fridges use binary format for their log file "vcl", this
-        driver convert vcl log files into csv files before returning fridge
-        parameters.
-        The conversion is done by using a binary file named
-        "VCL_2_ASCII_CONVERTER.exe" that is provided by Oxford Instrument along
-        with other binaries to handle the fridge log files.
-        You must provide a valid path toward the VCL converter and consequently
-        we advice users to make sure the converter is always reachable by the
-        driver.
+        Oxford fridges use a binary format for their log file "vcl".
+        We convert that file in csv format using the
+        "VCL_2_ASCII_CONVERTER.exe" provided by Oxford Instrument along with
+        other binaries to handle the fridge log files.
+        With native_reader, the driver reads the vcl file directly instead:
+        the file is memory-mapped and only the records appended since the
+        last read are parsed. This reader is experimental. When the file
+        does not match the expected layout or lacks a column, the driver
+        falls back to the converter, if converter_path is given.
         Args:
             name: Name of the instrument.
             file_path: Path of the vcl log file.
-            converter_path: Path of the vcl converter file.
+            converter_path: Path of the vcl converter file. Only optional
+                with native_reader.
             threshold_temperature: Threshold temperature of
                 the mixing chamber thermometers.
                 Defaults to 4K.
                 Below, the temperature is read from the RuO2.
                 Above, the temperature is read from the cernox.
-            conversion_timer: Time between two vcl conversions.
-                Defaults to 30s.
+            conversion_timer: Minimum time between two vcl conversions
+                with the converter. Defaults to 30s.
             magnet: Is there a magnet in the fridge.
                 Default True.
+            native_reader: Read the vcl file without the converter,
+                experimental. Defaults to False.
         """
 
-        if not os.path.isfile(converter_path):
+        if converter_path is None:
+            if not native_reader:
+                raise ValueError('converter_path is required without '
+                                 'native_reader.')
+        elif not os.path.isfile(converter_path):
             raise ValueError('converter_path is not a valid file path.')
 
         if not os.path.isfile(file_path):
@@ -57,9 +187,21 @@ class Triton(Instrument):
         
         self.file_path = os.path.abspath(file_path)
         self.threshold_temperature = threshold_temperature
-        self.converter_path = os.path.abspath(converter_path)
+        self.converter_path = (None if converter_path is None
+                               else os.path.abspath(converter_path))
+        self._reader = _VCLReader(self.file_path) if native_reader else None
+        # Columns read by the parameters
+        self._columns = list(self._temperature_columns.values()) + \
+            ['MC RuO2 T(K)'] + list(self._pressure_columns.values())
+        if not magnet:
+            self._columns.remove(self._temperature_columns['magnet'])
         self.conversion_timer = conversion_timer
         self._timer = time.time()
+        # (size, modification time) of the vcl file at the last conversion
+        self._vcl_state: Optional[Tuple[int, int]] = None
+        # Last line of the csv file and (size, modification time) of the file
+        self._last_row: Dict[str, float] = {}
+        self._csv_state: Optional[Tuple[int, int]] = None
 
         self.add_parameter(name='pressure_condensation_line',
                            unit='Bar',
@@ -122,31 +264,119 @@ class Triton(Instrument):
         """
         Convert vcl file into csv file using proprietary binary exe.
         The executable is called through the python subprocess library.
-        To avoid to frequent file conversion, a timer of self.conversion_timer
-        second is used.
+        The file is only converted when it has changed since the last
+        conversion. To avoid to frequent file conversion, a timer of
+        self.conversion_timer second is used.
         Returns:
             str: The output of the bash command
         """
-        
+        if self.converter_path is None:
+            raise ValueError('No converter_path given.')
+
         conversion = False
-        if self._timer+self.conversion_timer <= time.time():
-            conversion = True
-        elif not os.path.isfile(self.file_path[:-3]+'txt'):
+        if not os.path.isfile(self.file_path[:-3]+'txt'):
             conversion = True
+        elif self._timer+self.conversion_timer <= time.time():
+            conversion = self._get_file_state(self.file_path) != self._vcl_state
 
         if conversion:
             self._timer = time.time()
+            self._vcl_state = self._get_file_state(self.file_path)
             
-            # Run a bash command to convert vcl into csv
+            # Run the converter to convert vcl into csv
             cp = subprocess.run([self.converter_path, self.file_path],
                                 stdout=subprocess.PIPE,
-                                universal_newlines=True,
-                                shell=True)
+                                universal_newlines=True)
     
             return cp.stdout
         else:
             return None
 
+    def get_last_row(self) -> Dict[str, float]:
+        """
+        Return the last registered values of all columns of the log file.
+        Only the records appended since the last call are read.
+
+        Returns:
+            row: Value per column name.
+        """
+        if self._reader is None:
+            return self._get_last_converted_row()
+        try:
+            self._reader.read_new_rows()
+            missing = set(self._columns) - set(self._reader.names)
+            if missing:
+                raise ValueError('Columns missing in the vcl file: '
+                                 + ', '.join(sorted(missing)))
+        except ValueError:
+            if self.converter_path is None:
+                raise
+            return self._get_last_converted_row()
+        return self._reader.last_row
+
+    def _get_last_converted_row(self) -> Dict[str, float]:
+        """
+        Return the last row of the csv file written by the converter.
+        The csv file is only read again when it has changed.
+        """
+
+        # Convert the vcl file into csv file
+        self.vcl2csv()
+
+        csv_path = self.file_path[:-3]+'txt'
+        csv_state = self._get_file_state(csv_path)
+        if csv_state != self._csv_state:
+            header, line = self._read_first_and_last_line(csv_path)
+            self._last_row = {name: self._to_float(value) for name, value
+                              in zip(header.split('\t'), line.split('\t'))
+                              if name.strip()}
+            self._csv_state = csv_state
+
+        return self._last_row
+
+    @staticmethod
+    def _to_float(value: str) -> float:
+        """
+        Return the value of a csv field, NaN for empty or invalid fields.
+        """
+        try:
+            return float(value)
+        except ValueError:
+            return math.nan
+
+    @staticmethod
+    def _get_file_state(path: str) -> Tuple[int, int]:
+        """
+        Return the size and the modification time of a file.
+        """
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _read_first_and_last_line(path: str) -> Tuple[str, str]:
+        """
+        Return the header and the last line of a text file without reading
+        the lines in between.
+        """
+        with open(path, 'rb') as f:
+            header = f.readline()
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size
+            block = 4096
+            while True:
+                offset = max(start, size - block)
+                f.seek(offset)
+                lines = f.read(size - offset).splitlines()
+                lines = [line for line in lines if line.strip()]
+                # The first line of the block may be incomplete
+                if len(lines) > 1 or offset == start:
+                    break
+                block *= 2
+        if not lines:
+            raise ValueError('No values in file: '+path)
+        return (header.decode().rstrip('\r\n'),
+                lines[-1].decode().rstrip('\r\n'))
+
     def get_temperature(self, channel: str) -> float:
         """
         Return the last registered temperature of the channel.
@@ -157,33 +387,18 @@ class Triton(Instrument):
             temperature: Temperature of the channel in Kelvin.
         """
 
-        # Convert the vcl file into csv file
-        self.vcl2csv()
-        
-        df = pd.read_csv(self.file_path[:-3]+'txt', delimiter="\t")
-
-        if channel == '50k':
-            return df.iloc[-1]['PT1 Plate T(K)']
-        elif channel == '4k':
-            return df.iloc[-1]['PT2 Plate T(K)']
-        elif channel == 'magnet':
-            return df.iloc[-1]['Magnet T(K)']
-        elif channel == 'still':
-            return df.iloc[-1]['Still T(K)']
-        elif channel == '100mk':
-            return df.iloc[-1]['100mK Plate T(K)']
-        elif channel == 'mc':
-            # There are two thermometers for the mixing chamber.
-            # Depending of the threshold temperature we return one or the other
-            temp = df.iloc[-1]['MC cernox T(K)']
-            
-            if temp > self.threshold_temperature:
-                return temp
-            else:
-                return df.iloc[-1]['MC RuO2 T(K)']
-        else:
+        if channel not in self._temperature_columns:
             raise ValueError('Unknown channel: '+channel)
 
+        row = self.get_last_row()
+
+        temp = row[self._temperature_columns[channel]]
+        if channel == 'mc' and temp <= self.threshold_temperature:
+            # There are two thermometers for the mixing chamber.
+            # Below the threshold temperature the RuO2 is read
+            return row['MC RuO2 T(K)']
+        return temp
+
     def get_pressure(self, channel: str) -> float:
         """
         Return the last registered pressure of the channel.
@@ -194,16 +409,7 @@ class Triton(Instrument):
             pressure: Pressure of the channel in Bar.
         """
         
-        # Convert the vcl file into csv file
-        self.vcl2csv()
-        
-        df = pd.read_csv(self.file_path[:-3]+'txt', delimiter="\t")
-        
-        if channel == 'condensation':
-            return df.iloc[-1]['P2 Condense (Bar)']
-        elif channel == 'tank':
-            return df.iloc[-1]['P1 Tank (Bar)']
-        elif channel == 'forepump':
-            return df.iloc[-1]['P5 ForepumpBack (Bar)']
-        else:
-            raise ValueError('Unknown channel: '+channel)
\ No newline at end of file
+        if channel not in self._pressure_columns:
+            raise ValueError('Unknown channel: '+channel)
+
+        return self.get_last_row()[self._pressure_columns[channel]]
\ No newline at end of file
@@ -1,18 +1,21 @@
 import configparser
 import re
+import threading
+from concurrent.futures import Future
 from functools import partial
 import logging
 from traceback import format_exc
-from typing import Optional, Any, Union, List, Dict
+from typing import Optional, Any, Union, List, Dict, Sequence
 
 from qcodes import IPInstrument
 from qcodes.utils.validators import Enum, Ints
 
 from time import sleep
-import sys
 
 import numpy as np
 
+from .stability_monitor import StabilityMonitor
+
 class Triton(IPInstrument):
     r"""
     Triton Driver
@@ -26,6 +29,9 @@ class Triton(IPInstrument):
         fetch registry directly from fridge-computer
     """
 
+    stability_tick = 60
+    """ Evaluation interval in s, choose not lower than lakeshore update freq (60 s) """
+
     def __init__(
             self,
             name: str,
@@ -41,6 +47,10 @@ class Triton(IPInstrument):
         super().__init__(name, address=address, port=port,
                          terminator=terminator, timeout=timeout, **kwargs)
 
+        # The monitor polls from its own thread
+        self._io_lock = threading.RLock()
+        self.monitor: Optional[StabilityMonitor] = None
+
         self._heater_range_auto = False
         self._heater_range_temp = [0.0,    0.015,  0.02,    0.05,   0.1,      0.2,   0.5,    1.5,      40.,     300]
         self._heater_range_curr = [0.0,   0.0316,   0.1,   0.316,     1,     3.16,   10.,   31.6,     100.,    100.]
@@ -284,6 +294,34 @@ class Triton(IPInstrument):
             return actualtemp
 
     def _istempreached(self,val,tolerance):
+        future = self.temperature_reached(val, tolerance)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt: don't leave the wait adjusting the heater
+            future.cancel()
+            if self.monitor is not None:
+                self.monitor.remove_interlock(self._temperature_interlock_name(val))
+            raise
+
+    @staticmethod
+    def _temperature_interlock_name(val: float) -> str:
+        return f'circulation pressure ({val} K setpoint)'
+
+    def temperature_reached(self, val: float, tolerance: float = 0.02) -> 'Future[float]':
+        """
+        Returns a future that is done with the temperature of the control
+        channel when it is stable within tolerance around val.
+
+        The temperature is evaluated every 60 s by the monitor thread, which
+        adjusts the heater range when needed. Temperature control is turned
+        off and the future fails with an InterlockError when P2 or P3 are
+        too high while circulating.
+
+        Args:
+            val: temperature setpoint in K
+            tolerance: relative tolerance, at least 2 mK
+        """
         thighperc = val*(1+tolerance)
         tlowperc = val/(1+tolerance)
         thighabs = val+0.002
@@ -296,51 +334,92 @@ class Triton(IPInstrument):
             tlow = tlowperc
 
         print('Temp. lower limit: ' + "{:.4f}".format(tlow) + ' K\nTemp. upper limit: ' + "{:.4f}".format(thigh) + ' K')
+        channel = self._get_named_control_channel()
+        monitor = self.start_monitor(extra_channels=[channel])
         stability_samples_limit = 2 # consecutive samples within tolerance to be considered stable
-        stability_samples = 0       # init
         tlow_samples_limit = 5      # increases heater power after n-samples
-        tlow_samples = 0            # init
-        tick = 60                   # polling interval, choose not lower than lakeshore update freq (60 s)
-        for i in range(0,int(tick)): # allows keyboard interrupts every second
-            sleep(1)
-        while stability_samples != stability_samples_limit:
-            actualtemp = eval("self.%s.get()" % (self ._get_named_control_channel()))
-            for i in range(0,int(tick)): # allows keyboard interrupts every second
-                if self.turbo_status.get()=='on':
-                    if self.P3.get() > 3e-3 or self.P2.get() > 2.5:
-                        self.pid_setpoint.set(str(0))
-                        self.pid_range.set(0.0)
-                        self.pid_mode.set('off')
-                        sys.exit('Temperature control aborted, P2 at ' + "{:.4f}".format(self.P2.get()) + ' Bar, P3 at ' + "{:.4f}".format(self.P3.get()*1e3) + ' mBar.')
-                        # throw error and abort
-                sleep(1)
+        # polls per evaluation, every poll if the monitor is slower than the tick
+        period = max(1, round(self.stability_tick / monitor.interval))
+        state = {'polls': 0, 'stability_samples': 0, 'tlow_samples': 0}
+
+        def reached(values: Dict[str, float]) -> bool:
+            state['polls'] += 1
+            if state['polls'] % period != 0:
+                return False
+            actualtemp = values[channel]
             heatind = self._heater_range_curr.index(self.pid_range.get())
             if self._get_heater_percentage('H1')<5:
-                if heatind-1 >= 1: 
+                if heatind-1 >= 1:
                     self.pid_range.set(self._heater_range_curr[heatind-1])
-                    print('Heater power decreased to: ' + str(self._heater_range_curr[heatind-1]))  
+                    print('Heater power decreased to: ' + str(self._heater_range_curr[heatind-1]))
             if actualtemp > tlow and actualtemp < thigh:
-                stability_samples = stability_samples + 1
-                print('T = '+ str(actualtemp) + ', waiting for temp to stabilise. Samples:' + str(stability_samples))
+                state['stability_samples'] += 1
+                print('T = '+ str(actualtemp) + ', waiting for temp to stabilise. Samples:' + str(state['stability_samples']))
             elif actualtemp < tlow:
-                stability_samples = 0
-                tlow_samples = tlow_samples + 1
-                print('Waiting to reach temp, temp = ' + str(actualtemp) + ' Tlow_samples:' + str(tlow_samples))
+                state['stability_samples'] = 0
+                state['tlow_samples'] += 1
+                print('Waiting to reach temp, temp = ' + str(actualtemp) + ' Tlow_samples:' + str(state['tlow_samples']))
             elif actualtemp > thigh:
                 if val > 1.5:
                     self.pid_range.set(10.)
-                stability_samples = 0
-                tlow_samples = 0
+                state['stability_samples'] = 0
+                state['tlow_samples'] = 0
                 print('Temp higher than setpoint: '+ str(actualtemp) +', waiting...')
-            if tlow_samples >= tlow_samples_limit and self._get_heater_percentage('H1')>95:
-                tlow_samples = 0
+            if state['tlow_samples'] >= tlow_samples_limit and self._get_heater_percentage('H1')>95:
+                state['tlow_samples'] = 0
                 heatind = self._heater_range_curr.index(self.pid_range.get())
                 if heatind+1 < len(self._heater_range_curr):
                     self.pid_range.set(self._heater_range_curr[heatind+1])
                     print('Heater power increased to: ' + str(self._heater_range_curr[heatind+1]))
-                #timeout = 0
-        print('Temp reached & stable')
-        return(actualtemp)
+            if state['stability_samples'] >= stability_samples_limit:
+                print('Temp reached & stable')
+                return True
+            return False
+
+        interlock = self._temperature_interlock_name(val)
+        monitor.add_interlock(interlock, self._circulation_pressure_too_high,
+                              self._abort_temperature_control)
+        future = monitor.wait_until(reached, result_channel=channel)
+        future.add_done_callback(lambda _: monitor.remove_interlock(interlock))
+        return future
+
+    def start_monitor(self, interval: float = 1.0,
+                      extra_channels: Sequence[str] = ()) -> StabilityMonitor:
+        """
+        Starts polling MC, P2, P3, the turbo status and extra channels on a
+        background thread, see StabilityMonitor. The running monitor is
+        reused when it polls all requested channels.
+
+        Args:
+            interval: time between polls in s.
+            extra_channels: names of other parameters to poll.
+        """
+        channels = {'MC': self.MC, 'P2': self.P2, 'P3': self.P3,
+                    'turbo': lambda: 1.0 if self.turbo_status.get() == 'on' else 0.0}
+        for name in extra_channels:
+            channels[name] = getattr(self, name)
+        if self.monitor is not None and self.monitor.running:
+            if set(channels) <= set(self.monitor.channels):
+                return self.monitor
+            self.monitor.stop()
+        self.monitor = StabilityMonitor(channels, interval, name=f'{self.name}-monitor')
+        self.monitor.start()
+        return self.monitor
+
+    def stop_monitor(self) -> None:
+        """ Stops the background monitor and cancels pending waits. """
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+
+    def _circulation_pressure_too_high(self, values: Dict[str, float]) -> bool:
+        return values['turbo'] == 1.0 and (values['P3'] > 3e-3 or values['P2'] > 2.5)
+
+    def _abort_temperature_control(self, values: Dict[str, float]) -> None:
+        self.pid_setpoint.set(str(0))
+        self.pid_range.set(0.0)
+        self.pid_mode.set('off')
+        print('Temperature control aborted, P2 at ' + "{:.4f}".format(values['P2']) + ' Bar, P3 at ' + "{:.4f}".format(values['P3']*1e3) + ' mBar.')
 
     def _get_turbo_status(self):
         result = self.ask('READ:DEV:TURB1:PUMP:SIG:STATE')
@@ -692,3 +771,15 @@ class Triton(IPInstrument):
 
     def _recv(self) -> str:
         return super()._recv().rstrip()
+
+    def ask_raw(self, cmd: str) -> str:
+        with self._io_lock:
+            return super().ask_raw(cmd)
+
+    def write_raw(self, cmd: str) -> None:
+        with self._io_lock:
+            super().write_raw(cmd)
+
+    def close(self) -> None:
+        self.stop_monitor()
+        super().close()
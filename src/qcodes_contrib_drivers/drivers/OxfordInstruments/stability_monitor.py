@@ -0,0 +1,343 @@
+"""
+Background monitor of fridge channels.
+
+A StabilityMonitor polls a set of channels on its own thread at a fixed
+interval and keeps the readings in ring buffers. Waits for a condition or
+for a stable channel are evaluated after every poll and return a
+concurrent.futures.Future, so a measurement script can do other work while
+waiting. Use asyncio.wrap_future() to await them in asyncio code.
+
+Interlocks are checked after every poll as well. When an interlock trips,
+it is removed, its action is executed and all pending waits fail with an
+InterlockError.
+
+Example:
+    monitor = StabilityMonitor({'MC': fridge.MC, 'P2': fridge.P2}, interval=1.0)
+    monitor.add_interlock('P2 too high', lambda values: values['P2'] > 2.5,
+                          action=lambda values: fridge.pid_mode('off'))
+    monitor.start()
+    stable = monitor.wait_until_stable('MC', target=0.1, max_deviation=0.002,
+                                       max_std=0.001, window=30)
+    ...  # other work
+    temperature = stable.result()
+"""
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+Values = Dict[str, float]
+
+
+class InterlockError(RuntimeError):
+    """ Raised by waits that were pending when an interlock tripped """
+
+
+class RingBuffer:
+    """
+    The last `size` readings of a channel with their time.
+
+    Args:
+        size: number of readings kept.
+    """
+
+    def __init__(self, size: int) -> None:
+        self._times = np.zeros(size)
+        self._values = np.full(size, np.nan)
+        self.count = 0
+        """ Number of readings appended since creation """
+
+    def append(self, t: float, value: float) -> None:
+        i = self.count % len(self._values)
+        self._times[i] = t
+        self._values[i] = value
+        self.count += 1
+
+    def last(self, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns times and values of the last n readings, oldest first.
+        """
+        size = len(self._values)
+        n = min(self.count, size) if n is None else min(n, self.count, size)
+        indices = np.arange(self.count - n, self.count) % size
+        return self._times[indices], self._values[indices]
+
+
+class _WindowStatistics:
+    """
+    Mean and standard deviation of the last `window` values, updated per
+    value in constant time.
+
+    Failed readings are NaN. The mean and standard deviation are NaN while
+    such a reading is in the window and are recomputed when it leaves.
+    """
+
+    # recompute the sums regularly to avoid accumulation of rounding errors
+    _recompute_interval = 1000
+
+    def __init__(self, window: int) -> None:
+        self._values = np.zeros(window)
+        self.count = 0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    def add(self, value: float) -> None:
+        window = len(self._values)
+        i = self.count % window
+        old = self._values[i]
+        self._values[i] = value
+        self.count += 1
+        removed = old if self.count > window else 0.0
+        if (self.count % self._recompute_interval == 0
+                or not math.isfinite(value) or not math.isfinite(removed)):
+            values = self._values[:min(self.count, window)]
+            self._sum = float(np.sum(values))
+            self._sum_squares = float(np.sum(values**2))
+        else:
+            self._sum += value - removed
+            self._sum_squares += value**2 - removed**2
+
+    @property
+    def full(self) -> bool:
+        return self.count >= len(self._values)
+
+    @property
+    def mean(self) -> float:
+        return self._sum / min(self.count, len(self._values))
+
+    @property
+    def std(self) -> float:
+        n = min(self.count, len(self._values))
+        return math.sqrt(max(self._sum_squares / n - self.mean**2, 0.0))
+
+
+def _resolve(future: Future, exception: Optional[BaseException] = None,
+             result: Any = None) -> None:
+    """ Sets the outcome of a future unless the caller cancelled it meanwhile """
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class _Wait:
+    def __init__(self, condition: Callable[[Values], bool],
+                 result: Callable[[Values], Any],
+                 deadline: Optional[float]) -> None:
+        self.condition = condition
+        self.result = result
+        self.deadline = deadline
+        self.future: Future = Future()
+
+
+class StabilityMonitor:
+    """
+    Polls channels on a background thread and evaluates waits and
+    interlocks after every poll.
+
+    Args:
+        channels: function returning the value per channel name, e.g. the
+            parameters of an instrument.
+        interval: time between the starts of two polls in s.
+        buffer_size: number of readings kept per channel.
+        name: name of the thread.
+    """
+
+    def __init__(self, channels: Dict[str, Callable[[], Any]],
+                 interval: float = 1.0, buffer_size: int = 3600,
+                 name: str = 'stability-monitor') -> None:
+        self.channels = dict(channels)
+        self.interval = interval
+        self.name = name
+        self._buffers = {channel: RingBuffer(buffer_size) for channel in channels}
+        self._latest: Values = {}
+        self._interlocks: List[Tuple[str, Callable[[Values], bool],
+                                     Optional[Callable[[Values], None]]]] = []
+        self._waits: List[_Wait] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """ Starts polling. Does nothing when already running. """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """ Stops polling and cancels the pending waits. """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        with self._lock:
+            waits, self._waits = self._waits, []
+        for wait in waits:
+            wait.future.cancel()
+
+    def latest(self) -> Values:
+        """ Returns the last reading of every channel. """
+        with self._lock:
+            return dict(self._latest)
+
+    def history(self, channel: str, n: Optional[int] = None
+                ) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns times and values of the last n readings of a channel. """
+        with self._lock:
+            return self._buffers[channel].last(n)
+
+    def add_interlock(self, name: str, tripped: Callable[[Values], bool],
+                      action: Optional[Callable[[Values], None]] = None) -> None:
+        """
+        Adds a safety check evaluated after every poll.
+        The interlock is removed when it trips.
+
+        Args:
+            name: description used in the error of failed waits.
+            tripped: returns True when the readings are unsafe.
+            action: executed on the monitor thread when tripped.
+        """
+        with self._lock:
+            self._interlocks.append((name, tripped, action))
+
+    def remove_interlock(self, name: str) -> None:
+        """ Removes the interlocks with the name. """
+        with self._lock:
+            self._interlocks = [interlock for interlock in self._interlocks
+                                if interlock[0] != name]
+
+    def wait_until(self, condition: Callable[[Values], bool],
+                   timeout: Optional[float] = None,
+                   result_channel: Optional[str] = None) -> Future:
+        """
+        Returns a future that is done when `condition(readings)` is True
+        after a poll.
+
+        Args:
+            condition: evaluated on the monitor thread after every poll.
+            timeout: time in s after which the future fails with a TimeoutError.
+            result_channel: channel whose reading is the result of the future.
+                By default the result is the dictionary with all readings.
+        """
+        if result_channel is None:
+            return self._add_wait(condition, lambda values: values, timeout)
+        return self._add_wait(condition, lambda values: values[result_channel],
+                              timeout)
+
+    def wait_until_stable(self, channel: str, target: float,
+                          max_deviation: float, max_std: float = math.inf,
+                          window: int = 30, timeout: Optional[float] = None
+                          ) -> 'Future[float]':
+        """
+        Returns a future that is done with the last reading of the channel
+        when the mean of the last `window` readings since this call differs
+        less than `max_deviation` from `target` and their standard deviation
+        is less than `max_std`.
+
+        The statistics are updated per reading, not recomputed over the window.
+        """
+        statistics = _WindowStatistics(window)
+
+        def stable(values: Values) -> bool:
+            statistics.add(values[channel])
+            return (statistics.full
+                    and abs(statistics.mean - target) < max_deviation
+                    and statistics.std < max_std)
+
+        return self._add_wait(stable, lambda values: values[channel], timeout)
+
+    def _add_wait(self, condition: Callable[[Values], bool],
+                  result: Callable[[Values], Any],
+                  timeout: Optional[float]) -> Future:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = _Wait(condition, result, deadline)
+        with self._lock:
+            self._waits.append(wait)
+        return wait.future
+
+    def _run(self) -> None:
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            self._poll()
+            next_poll += self.interval
+            # skip polls that were missed, e.g. by slow channels
+            now = time.monotonic()
+            if next_poll < now:
+                next_poll = now
+            self._stop.wait(next_poll - now)
+
+    def _poll(self) -> None:
+        values: Values = {}
+        for channel, get in self.channels.items():
+            try:
+                values[channel] = float(get())
+            except Exception:
+                log.warning(f'{self.name}: reading {channel} failed', exc_info=True)
+                values[channel] = math.nan
+        now = time.time()
+
+        with self._lock:
+            for channel, value in values.items():
+                self._buffers[channel].append(now, value)
+            self._latest = values
+            interlocks = list(self._interlocks)
+            waits = list(self._waits)
+
+        for name, tripped, action in interlocks:
+            try:
+                is_tripped = tripped(values)
+            except Exception:
+                log.warning(f'{self.name}: interlock {name} failed', exc_info=True)
+                is_tripped = True
+            if is_tripped:
+                self._trip(name, action, values)
+                return
+
+        done = []
+        for wait in waits:
+            if wait.future.done():
+                # cancelled by the caller
+                done.append(wait)
+                continue
+            try:
+                if wait.condition(values):
+                    _resolve(wait.future, result=wait.result(values))
+                elif wait.deadline is not None and time.monotonic() > wait.deadline:
+                    _resolve(wait.future, TimeoutError('Condition not reached in time'))
+                else:
+                    continue
+            except Exception as ex:
+                _resolve(wait.future, ex)
+            done.append(wait)
+        with self._lock:
+            self._waits = [wait for wait in self._waits if wait not in done]
+
+    def _trip(self, name: str, action: Optional[Callable[[Values], None]],
+              values: Values) -> None:
+        log.error(f'{self.name}: interlock {name} tripped: {values}')
+        self.remove_interlock(name)
+        if action is not None:
+            try:
+                action(values)
+            except Exception:
+                log.error(f'{self.name}: interlock action of {name} failed',
+                          exc_info=True)
+        with self._lock:
+            waits, self._waits = self._waits, []
+        for wait in waits:
+            _resolve(wait.future, InterlockError(f'Interlock {name} tripped: {values}'))
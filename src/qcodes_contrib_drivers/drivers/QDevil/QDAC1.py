@@ -3,11 +3,12 @@
 # Version 2.2 QDevil 2023-02-20
 
 import logging
+import threading
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
 from enum import Enum
 from functools import partial
-from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import pyvisa
 import pyvisa.constants
@@ -58,6 +59,31 @@ class Generator:
         self.t_end = 9.9e9
 
 
+class _RampRequest:
+    #  Class used in the internal book keeping of queued ramps
+    def __init__(self, slow_chans: Sequence[int], slow_vstart: Sequence[float],
+                 slow_vend: Sequence[float], fast_chans: Sequence[int],
+                 fast_vstart: Sequence[float], fast_vend: Sequence[float],
+                 step_length_ms: int, slow_steps: int, fast_steps: int):
+        self.slow_chans = list(slow_chans)
+        self.slow_vstart = list(slow_vstart)
+        self.slow_vend = list(slow_vend)
+        self.fast_chans = list(fast_chans)
+        self.fast_vstart = list(fast_vstart)
+        self.fast_vend = list(fast_vend)
+        self.step_length_ms = step_length_ms
+        self.slow_steps = slow_steps
+        self.fast_steps = fast_steps
+
+    @property
+    def channels(self) -> List[int]:
+        return [*self.slow_chans, *self.fast_chans]
+
+    @property
+    def duration(self) -> float:
+        return self.slow_steps * self.fast_steps * self.step_length_ms / 1000
+
+
 class QDacChannel(InstrumentChannel):
     """
     A single output channel of the QDac.
@@ -143,7 +169,9 @@ class QDacChannel(InstrumentChannel):
     ) -> Dict[Any, Any]:
         update_currents = self._parent._update_currents and update
         if update and not self._parent._get_status_performed:
-            self._parent._update_cache(update_currents=update_currents)
+            self._parent._update_cache(
+                update_currents=update_currents,
+                max_age=self._parent.max_status_age)
         # call update_cache rather than getting the status individually for
         # each parameter. This is only done if _get_status_performed is False
         # this is used to signal that the parent has already called it and
@@ -205,6 +233,7 @@ class QDac(VisaInstrument):
     """
 
     # set nonzero value (seconds) to accept older status when reading settings
+    # in snapshot() and print_overview(). Set to 0 to always read the status.
     max_status_age = 1
 
     def __init__(self,
@@ -229,6 +258,13 @@ class QDac(VisaInstrument):
         super().__init__(name, address, **kwargs)
         handle = self.visa_handle
         self._get_status_performed = False
+        # Serialises the communication, as queued ramps are started from a
+        # timer thread
+        self._lock = threading.RLock()
+        self._ramp_timer: Optional[threading.Timer] = None
+        # time.monotonic() of the latest status and current readings
+        self._status_time = -float('inf')
+        self._currents_time = -float('inf')
 
         assert isinstance(handle, SerialInstrument)
         # Communication setup + firmware check
@@ -319,6 +355,11 @@ class QDac(VisaInstrument):
         self._assigned_triggers: Dict[int, int] = {}  # {fg: trigger}
         # Sync channels
         self._syncoutputs: Dict[int, int] = {}  # {chan: syncoutput}
+        # Ramps waiting for function generators to become available
+        if self._ramp_timer:
+            self._ramp_timer.cancel()
+            self._ramp_timer = None
+        self._ramp_queue: Deque[_RampRequest] = deque()
 
     def _load_state(self) -> None:
         """
@@ -401,6 +442,8 @@ class QDac(VisaInstrument):
         and all parameters to their default values, including removing any
         assigned sync putputs, function generators, triggers etc.
         """
+        # Queued ramps must not start after the reset
+        self.cancel_queued_ramps()
         # In case the QDAC has been switched off/on
         # clear the io buffer and set verbose False
         self.device_clear()
@@ -415,8 +458,9 @@ class QDac(VisaInstrument):
         self.channels[0:self.num_chans].sync_delay(0)
         self.channels[0:self.num_chans].sync_duration(0.01)
 
+        self._status_time = -float('inf')
         if update_currents:
-            self.channels[0:self.num_chans].i.get()
+            self._update_currents_cache()
         self.mode_force(False)
         self._reset_bookkeeping()
 
@@ -427,7 +471,8 @@ class QDac(VisaInstrument):
     ) -> Dict[Any, Any]:
         update_currents = self._update_currents and update is True
         if update:
-            self._update_cache(update_currents=update_currents)
+            self._update_cache(update_currents=update_currents,
+                               max_age=self.max_status_age)
             self._get_status_performed = True
         # call _update_cache rather than getting the status individually for
         # each parameter. We set _get_status_performed to True
@@ -451,9 +496,27 @@ class QDac(VisaInstrument):
         Args:
             chan (int): The 1-indexed channel number
         """
-        self.clear_read_queue()
-        self.write(f'set {chan}')
-        return self._write_response
+        with self._lock:
+            self.clear_read_queue()
+            self.write(f'set {chan}')
+            return self._write_response
+
+    def _get_voltages(self, chans: Sequence[int]) -> List[float]:
+        """
+        Ask for the voltages of several channels with a single message
+
+        Args:
+            chans: The 1-indexed channel numbers
+        """
+        if not chans:
+            return []
+        with self._lock:
+            self.clear_read_queue()
+            responses = self._write_all(';'.join(f'set {ch}' for ch in chans))
+        voltages = [float(response) for response in responses]
+        for chan, voltage in zip(chans, voltages):
+            self.channels[chan-1].v.cache.set(voltage)
+        return voltages
 
     def _set_voltage(self, chan: int, v_set: float) -> None:
         """
@@ -464,8 +527,9 @@ class QDac(VisaInstrument):
             v_set: The target voltage
 
         If a finite slope has been assigned, a function generator will
-        ramp the voltage.
+        ramp the voltage. Ramps of the channel still queued are cancelled.
         """
+        self.cancel_queued_ramps([chan])
         slope = self._slopes.get(chan, None)
         if not slope:
             # Should not be necessary to wav here.
@@ -487,10 +551,12 @@ class QDac(VisaInstrument):
         v_half_span = v_span / 2
         s_half_duration = s_duration / 2
         v_half_way = v_start + v_half_span
-        self.ramp_voltages([chan], [v_start], [v_half_way], s_half_duration)
+        # The first half may be queued, so wait for its estimated end
+        s_first_half = self.ramp_voltages([chan], [v_start], [v_half_way],
+                                          s_half_duration)
         LOG.warning('Trying to ramp more than 10 volts. '
             'Waiting for first ramp to finish')
-        time.sleep(s_half_duration)
+        time.sleep(s_first_half)
         self.ramp_voltages([chan], [v_half_way], [v_set], s_half_duration)
 
     def _set_mode(self, chan: int, new_mode: Mode) -> None:
@@ -540,6 +606,7 @@ class QDac(VisaInstrument):
 
         if old_mode == new_mode:
             return
+        self.cancel_queued_ramps([chan])
 
         # If the voltage range is going to change we have to take care of
         # setting the voltage after the switch, and therefore read it first
@@ -605,14 +672,30 @@ class QDac(VisaInstrument):
         """
         return 1e-6*self._num_verbose(s)
 
-    def _update_cache(self, update_currents: bool = False) -> None:
+    def _update_cache(self, update_currents: bool = False,
+                      max_age: float = 0) -> None:
         """
         Function to query the instrument and get the status of all channels.
-        Takes a while to finish.
 
-        The `status` call generates 27 or 51 lines of output. Send the command
-        and read the first one, which is the software version line
-        the full output looks like:
+        The status (and the currents) are only read if the latest reading
+        is at least max_age seconds old.
+
+        Args:
+            update_currents: Also read the current of all channels
+            max_age: Accept cached values up to this age in seconds
+        """
+        with self._lock:
+            if time.monotonic() - self._status_time >= max_age:
+                self._update_status_cache()
+            if update_currents and \
+                    time.monotonic() - self._currents_time >= max_age:
+                self._update_currents_cache()
+
+    def _update_status_cache(self) -> None:
+        """
+        Read the status of all channels and update the caches of v and mode.
+
+        The `status` call generates 27 or 51 lines of output, which look like:
         Software Version: 1.07\r\n
         Channel\tOut V\t\tVoltage range\tCurrent range\n
         \n
@@ -620,12 +703,18 @@ class QDac(VisaInstrument):
         7\t  0.000000\t\tX 1\t\tpA\n
         ... (all 24/48 channels like this)
         (no termination afterward besides the \n ending the last channel)
+
+        The response is read in as few reads as possible and parsed as it
+        arrives.
         """
         irange_trans = {'hi cur': 1, 'lo cur': 0}
         vrange_trans = {'X 1': 0, 'X 0.1': 1}
 
-        # Status call, check the
-        version_line = self.ask('status')
+        self.visa_handle.write('status')
+        lines = self._read_lines()
+
+        # Check the software version line
+        version_line = next(lines)
         if version_line.startswith('Software Version: '):
             self.version = version_line.strip().split(': ')[1]
         else:
@@ -633,7 +722,7 @@ class QDac(VisaInstrument):
             raise ValueError('unrecognized version line: ' + version_line)
 
         # Check header line
-        header_line = self.read()
+        header_line = next(lines)
         headers = header_line.lower().strip('\r\n').split('\t')
         expected_headers = ['channel', 'out v', '', 'voltage range',
                             'current range']
@@ -641,8 +730,8 @@ class QDac(VisaInstrument):
             raise ValueError('unrecognized header line: ' + header_line)
 
         chans_left = set(self._chan_range)
-        while chans_left:
-            line = self.read().strip()
+        for line in lines:
+            line = line.strip()
             if not line:
                 continue
             chanstr, v, _, vrange, _, irange = line.split('\t')
@@ -654,10 +743,32 @@ class QDac(VisaInstrument):
             self.channels[chan-1].v.cache.set(float(v))
             self.channels[chan-1].v.vals = self._v_vals(chan, vrange_int)
             chans_left.remove(chan)
+            if not chans_left:
+                break
+        self._status_time = time.monotonic()
 
-        if update_currents:
-            for chan in self._chan_range:
-                self.channels[chan-1].i.get()
+    def _update_currents_cache(self) -> None:
+        """
+        Read the current of all channels with a single message and update
+        the caches of i.
+        """
+        cmd = ';'.join(f'get {chan}' for chan in self._chan_range)
+        for chan, response in zip(self._chan_range, self._write_all(cmd)):
+            self.channels[chan-1].i.cache.set(self._current_parser(response))
+        self._currents_time = time.monotonic()
+
+    def _read_lines(self) -> Iterator[str]:
+        """
+        Yield the lines of a multi-line response. Everything waiting in the
+        serial buffer is read at once, instead of reading line by line.
+        """
+        handle = self.visa_handle
+        pending = b''
+        while True:
+            pending += handle.read_bytes(max(handle.bytes_in_buffer, 1))
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                yield line.decode(handle.encoding)
 
     def _setsync(self, chan: int, sync: int) -> None:
         """
@@ -806,12 +917,33 @@ class QDac(VisaInstrument):
         available in `_write_response`
         """
 
+        self._write_response = self._write_all(cmd)[-1]
+
+    def _write_all(self, cmd: str) -> List[str]:
+        """
+        Like write(), but returns the responses to all concatenated commands
+        """
         LOG.debug(f"Writing to instrument {self.name}: {cmd}")
-        self.visa_handle.write(cmd)
-        for _ in range(cmd.count(';')+1):
-            self._write_response = self.visa_handle.read()
-            if self._write_response.startswith('Error: '):
-                LOG.warning(self._write_response)
+        responses = []
+        with self._lock:
+            self.visa_handle.write(cmd)
+            for _ in range(cmd.count(';')+1):
+                response = self.visa_handle.read()
+                if response.startswith('Error: '):
+                    LOG.warning(response)
+                responses.append(response)
+        return responses
+
+    def ask_raw(self, cmd: str) -> str:
+        with self._lock:
+            return super().ask_raw(cmd)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._ramp_timer:
+                self._ramp_timer.cancel()
+                self._ramp_timer = None
+        super().close()
 
     def read(self) -> str:
         return self.visa_handle.read()
@@ -830,7 +962,7 @@ class QDac(VisaInstrument):
             Sequence[str]: Messages lingering in queue
         """
         lingering = list()
-        with self.timeout.set_to(0.001):
+        with self._lock, self.timeout.set_to(0.001):
             while True:
                 try:
                     message = self.visa_handle.read()
@@ -878,9 +1010,12 @@ class QDac(VisaInstrument):
     def print_overview(self, update_currents: bool =  False) -> None:
         """
         Pretty-prints the status of the QDac
+
+        A status read less than max_status_age seconds ago is reused.
         """
 
-        self._update_cache(update_currents=update_currents)
+        self._update_cache(update_currents=update_currents,
+                           max_age=self.max_status_age)
 
         for ii in range(self.num_chans):
             line = f"Channel {ii+1} \n"
@@ -910,8 +1045,9 @@ class QDac(VisaInstrument):
     def _get_functiongenerator(self, chan: int) -> int:
         """
         Function for getting a free generator (of 8 available) for a channel.
-        Used as helper function for ramp_voltages, but may also be used if the
-        user wants to use a function generator for something else.
+        May be used if the user wants to use a function generator for
+        something else. The ramp functions queue ramps instead, see
+        ramp_voltages_2d().
         If there are no free generators this function will wait for up to
         fgs_timeout for one to be ready.
 
@@ -922,6 +1058,10 @@ class QDac(VisaInstrument):
             chan: (1..24/48) the channel for which a function generator is
                   requested.
         """
+        with self._lock:
+            return self._get_functiongenerator_locked(chan)
+
+    def _get_functiongenerator_locked(self, chan: int) -> int:
         fgs_timeout = 2  # Max time to wait for next available generator
 
         if len(self._assigned_fgs) < 8:
@@ -1043,8 +1183,14 @@ class QDac(VisaInstrument):
             fast_steps:   number of steps in the fast direction.\n
 
         Returns:
-            Estimated time of the excecution of the 2D scan.\n
+            Estimated time until the 2D scan has finished.\n
         NOTE: This function returns as the ramps are started.
+
+        If there are not enough function generators available, the ramp is
+        queued and started (from a timer thread) as soon as enough of the
+        running ramps have finished, so this function does not block. Ramps
+        are started in the order they were requested. Start voltages that
+        are not provided are read (in one message) when the ramp starts.
         """
         channellist = [*slow_chans, *fast_chans]
         v_endlist = [*slow_vend, *fast_vend]
@@ -1069,8 +1215,10 @@ class QDac(VisaInstrument):
             if chan not in range(1, self.num_chans+1):
                 raise ValueError(
                         f'Channel number must be 1-{self.num_chans}.')
-            if not (chan in self._assigned_fgs):
-                self._get_functiongenerator(chan)
+        if no_channels > len(self._fgs):
+            raise RuntimeError(
+                f'Trying to ramp {no_channels} channels simultaneously, but '
+                f'there are only {len(self._fgs)} generators.')
 
         # Voltage validation
         for i in range(no_channels):
@@ -1078,39 +1226,204 @@ class QDac(VisaInstrument):
         if v_startlist:
             for i in range(no_channels):
                 self.channels[channellist[i]-1].v.validate(v_startlist[i])
+        if (slow_vstart and len(slow_vstart) != len(slow_chans)) or \
+                (fast_vstart and len(fast_vstart) != len(fast_chans)):
+            raise ValueError(
+                'Number of start voltages do not match number of channels!')
 
-        # Get start voltages if not provided
-        if not slow_vstart:
-            slow_vstart = [self.channels[ch-1].v.get() for ch in slow_chans]
-        if not fast_vstart:
-            fast_vstart = [self.channels[ch-1].v.get() for ch in fast_chans]
+        request = _RampRequest(slow_chans, slow_vstart, slow_vend,
+                               fast_chans, fast_vstart, fast_vend,
+                               step_length_ms, slow_steps, fast_steps)
+        with self._lock:
+            if not self._ramp_queue and \
+                    self._allocate_generators(request.channels):
+                self._start_ramp(request)
+                return request.duration
+            self._ramp_queue.append(request)
+            time_start = self._schedule_queued_ramps()
+        LOG.info(f'Not enough generators available, ramp of channels '
+                 f'{channellist} queued for {time_start - time.time():.3f} s')
+        return time_start - time.time() + request.duration
+
+    def cancel_queued_ramps(self, chans: Optional[Sequence[int]] = None
+                            ) -> int:
+        """
+        Cancel the ramps waiting for function generators, see
+        ramp_voltages_2d(). Ramps already started are not stopped.
+
+        Args:
+            chans: Cancel only the ramps of any of these channels (1 indexed).
+                   Defaults to all channels.
 
+        Returns:
+            Number of ramps cancelled
+        """
+        with self._lock:
+            kept = deque(request for request in self._ramp_queue
+                         if chans is not None and
+                         not set(request.channels).intersection(chans))
+            n_cancelled = len(self._ramp_queue) - len(kept)
+            if not n_cancelled:
+                return 0
+            self._ramp_queue = kept
+            if self._ramp_queue:
+                self._schedule_queued_ramps()
+            elif self._ramp_timer:
+                self._ramp_timer.cancel()
+                self._ramp_timer = None
+        LOG.info(f'Cancelled {n_cancelled} queued ramps')
+        return n_cancelled
+
+    def _allocate_generators(self, chans: Sequence[int]) -> bool:
+        """
+        Assign a function generator to every channel that does not already
+        have one. Unassigned generators are used first, then the generators
+        of other channels whose ramps have finished (earliest first), which
+        are put back in DC mode.
+
+        Returns:
+            False (and nothing is assigned) if there are not enough
+            generators available
+        """
+        time_now = time.time()
+        needed = [ch for ch in chans if ch not in self._assigned_fgs]
+        unassigned = sorted(self._fgs.difference(
+                        {g.fg for g in self._assigned_fgs.values()}))
+        finished = sorted((g.t_end, ch) for ch, g in self._assigned_fgs.items()
+                          if ch not in chans and g.t_end <= time_now)
+        if len(needed) > len(unassigned) + len(finished):
+            return False
+        released = []
+        for chan in needed:
+            if unassigned:
+                fg = unassigned.pop(0)
+            else:
+                _, oldchan = finished.pop(0)
+                fg = self._assigned_fgs.pop(oldchan).fg
+                released.append(oldchan)
+            self._assigned_fgs[chan] = Generator(fg)
+        if released:
+            # Set the old channels in DC mode
+            self.write(';'.join(
+                'set {ch} {voltage:.6f};wav {ch} 0 0 0'.format(
+                    ch=ch, voltage=self.channels[ch-1].v.cache())
+                for ch in released))
+        return True
+
+    def _queued_start_times(self) -> List[float]:
+        """
+        Estimated start time of every queued ramp, allocating generators
+        the same way as _allocate_generators() will do.
+        """
+        t_ends = {ch: g.t_end for ch, g in self._assigned_fgs.items()}
+        n_unassigned = len(self._fgs) - len(t_ends)
+        time_start = time.time()
+        start_times = []
+        for request in self._ramp_queue:
+            chans = request.channels
+            n_needed = len([ch for ch in chans if ch not in t_ends])
+            others = sorted((t_end, ch) for ch, t_end in t_ends.items()
+                            if ch not in chans)
+            n_taken = max(0, n_needed - n_unassigned)
+            if n_taken:
+                time_start = max(time_start, others[n_taken-1][0])
+            n_unassigned -= n_needed - n_taken
+            for _, ch in others[:n_taken]:
+                t_ends.pop(ch)
+            for ch in chans:
+                t_ends[ch] = time_start + request.duration
+            start_times.append(time_start)
+        return start_times
+
+    def _schedule_queued_ramps(self) -> float:
+        """
+        (Re)start the timer that starts the first queued ramp.
+
+        Returns:
+            Estimated start time of the last queued ramp
+        """
+        start_times = self._queued_start_times()
+        if self._ramp_timer:
+            self._ramp_timer.cancel()
+        delay = max(0.0, start_times[0] - time.time()) + 0.001
+        self._ramp_timer = threading.Timer(delay, self._start_queued_ramps)
+        self._ramp_timer.daemon = True
+        self._ramp_timer.start()
+        return start_times[-1]
+
+    def _start_queued_ramps(self) -> None:
+        """
+        Start as many queued ramps as there are generators available for.
+        Runs in the timer thread.
+        """
+        with self._lock:
+            self._ramp_timer = None
+            while self._ramp_queue:
+                request = self._ramp_queue[0]
+                if not self._allocate_generators(request.channels):
+                    break
+                self._ramp_queue.popleft()
+                try:
+                    self._start_ramp(request)
+                except Exception:
+                    LOG.exception(f'Queued ramp of channels '
+                                  f'{request.channels} failed')
+            if self._ramp_queue:
+                self._schedule_queued_ramps()
+
+    def _start_ramp(self, request: _RampRequest) -> None:
+        """
+        Program and start a ramp. All channels must have a generator.
+        The generators are released if the ramp cannot be started, else
+        queued ramps would wait for them forever.
+        """
+        try:
+            self._program_ramp(request)
+        except BaseException:
+            for chan in request.channels:
+                self._assigned_fgs[chan].t_end = 0
+            raise
+
+    def _program_ramp(self, request: _RampRequest) -> None:
+        slow_chans = request.slow_chans
+        fast_chans = request.fast_chans
+        channellist = request.channels
+        v_endlist = [*request.slow_vend, *request.fast_vend]
+        no_channels = len(channellist)
+
+        # Get start voltages if not provided
+        slow_vstart = request.slow_vstart or self._get_voltages(slow_chans)
+        fast_vstart = request.fast_vstart or self._get_voltages(fast_chans)
         v_startlist = [*slow_vstart, *fast_vstart]
-        if no_channels != len(v_startlist):
-            raise ValueError(
-                'Number of start voltages do not match number of channels!')
 
-        # Find trigger not aleady uses (avoid starting other
-        # channels/function generators)
+        # Find a trigger that does not start other function generators. The
+        # generators of this ramp are reprogrammed, so their triggers are free.
         if no_channels == 1:
             trigger = 0
         else:
-            trigger = int(min(self._trigs.difference(
-                                    set(self._assigned_triggers.values()))))
-
-        # Make sure any sync outputs are configured
+            ramp_fgs = {self._assigned_fgs[ch].fg for ch in channellist}
+            used_triggers = {trig for fg, trig
+                             in self._assigned_triggers.items()
+                             if fg not in ramp_fgs}
+            trigger = int(min(self._trigs.difference(used_triggers)))
+
+        # Make sure any sync outputs are configured, in the same message
+        # as the channel amplitudes and function generators
+        commands = []
         for chan in channellist:
             if chan in self._syncoutputs:
                 sync = self._syncoutputs[chan]
                 sync_duration = int(
                                 1000*self.channels[chan-1].sync_duration.get())
                 sync_delay = int(1000*self.channels[chan-1].sync_delay.get())
-                self.write('syn {} {} {} {}'.format(
+                commands.append('syn {} {} {} {}'.format(
                                             sync, self._assigned_fgs[chan].fg,
                                             sync_delay, sync_duration))
 
         # Now program the channel amplitudes and function generators
-        msg = ''
+        step_length_ms = request.step_length_ms
+        slow_steps = request.slow_steps
+        fast_steps = request.fast_steps
         for i in range(no_channels):
             amplitude = v_endlist[i]-v_startlist[i]
             # TODO: if amplitute is too large, then split into two parts.
@@ -1119,20 +1432,22 @@ class QDac(VisaInstrument):
             fg = self._assigned_fgs[ch].fg
             if trigger > 0:  # Trigger 0 is not a trigger
                 self._assigned_triggers[fg] = trigger
-            msg += f"wav {ch} {fg} {amplitude} {v_startlist[i]}"
+            else:
+                self._assigned_triggers.pop(fg, None)
+            commands.append(f"wav {ch} {fg} {amplitude} {v_startlist[i]}")
             # using staircase = function 4
             nsteps = slow_steps if ch in slow_chans else fast_steps
             repetitions = slow_steps if ch in fast_chans else 1
 
             delay = step_length_ms \
                 if ch in fast_chans else fast_steps*step_length_ms
-            msg += ';fun {} {} {} {} {} {};'.format(
+            commands.append('fun {} {} {} {} {} {}'.format(
                         fg, Waveform.staircase, delay, int(nsteps),
-                        repetitions, trigger)
+                        repetitions, trigger))
             # Update latest values to ramp end values
             # (actually not necessary when called from _set_voltage)
             self.channels[ch-1].v.cache.set(v_endlist[i])
-        self.write(msg[:-1])  # last semicolon is stripped
+        self.write(';'.join(commands))
 
         # Fire trigger to start generators simultaneously, saving communication
         # time by not using triggers for single channel ramping
@@ -1140,8 +1455,6 @@ class QDac(VisaInstrument):
             self.write(f'trig {trigger}')
 
         # Update fgs dict so that we know when the ramp is supposed to end
-        time_ramp = slow_steps * fast_steps * step_length_ms / 1000
-        time_end = time_ramp + time.time()
+        time_end = request.duration + time.time()
         for chan in channellist:
             self._assigned_fgs[chan].t_end = time_end
-        return time_ramp
@@ -1,12 +1,16 @@
 import numpy as np
 import itertools
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import uuid
 from time import sleep as sleep_s
 from qcodes.instrument.channel import InstrumentChannel, ChannelList
 from qcodes.instrument.visa import VisaInstrument
 from pyvisa.errors import VisaIOError
 from qcodes.utils import validators
-from typing import NewType, Tuple, Sequence, List, Dict, Optional
+from typing import NewType, Tuple, Sequence, List, Dict, Optional, Callable
 from packaging.version import parse
 import abc
 
@@ -62,6 +66,7 @@ import abc
 # Virtual_Sweep_Context
 # Arrangement_Context
 # QDac2Trigger_Context
+# Batch_Context
 #
 # Calling close() on any context manager will clean up any triggers or
 # markers that were set up by the context.  Use with-statements to
@@ -114,6 +119,18 @@ There are four 3V3 non-isolated triggers on the back (1, 2, 3, 4).
 """
 ExternalInput = NewType('ExternalInput', int)
 
+"""Upload progress callback
+
+Called with the number of values sent so far and the total number of values.
+"""
+UploadProgress = Callable[[int, int], None]
+
+"""Number of values sent per chunk by streaming uploads"""
+UPLOAD_CHUNK_SIZE = 16384
+
+"""SCPI commands that change the DC list of a channel"""
+_DC_LIST_COMMAND = re.compile(r'sour(?:ce)?(\d+):list:volt', re.IGNORECASE)
+
 
 class QDac2Trigger_Context:
     """Internal Triggers with automatic deallocation
@@ -507,13 +524,16 @@ class Sweep_Context(_Dc_Context):
 
 class List_Context(_Dc_Context):
 
-    def __init__(self, channel: 'QDac2Channel', voltages: Sequence[float],
+    def __init__(self, channel: 'QDac2Channel',
+                 voltages: Optional[Sequence[float]],
                  repetitions: int, dwell_s: float, delay_s: float,
                  backwards: bool, stepped: bool):
         super().__init__(channel)
         self._repetitions = repetitions
         self._write_channel('sour{0}:volt:mode list')
-        self._set_voltages(voltages)
+        # No voltages means keeping the list already on the instrument
+        if voltages is not None:
+            self._set_voltages(voltages)
         self._set_trigger_mode(stepped)
         self._write_channel(f'sour{"{0}"}:list:dwel {dwell_s}')
         super()._set_delay(delay_s)
@@ -523,6 +543,7 @@ class List_Context(_Dc_Context):
 
     def _set_voltages(self, voltages: Sequence[float]) -> None:
         self._write_channel_floats('sour{0}:list:volt ', voltages)
+        self._channel._dc_list_V = np.array(voltages, dtype=float)
 
     def _set_trigger_mode(self, stepped: bool) -> None:
         if stepped:
@@ -545,14 +566,49 @@ class List_Context(_Dc_Context):
         """
         self._start('DC list')
 
-    def append(self, voltages: Sequence[float]) -> None:
+    def append(self, voltages: Sequence[float],
+               chunk_size: int = UPLOAD_CHUNK_SIZE,
+               progress: Optional[UploadProgress] = None,
+               background: bool = False) -> Optional[Future]:
         """Append voltages to the existing list
 
+        The voltages are streamed to the instrument as 32-bit floats in
+        chunks, so long numpy arrays are never converted to lists.
+
         Arguments:
-            voltages (Sequence[float]): Sequence of voltages
+            voltages (Sequence[float]): Sequence or array of voltages
+            chunk_size (int, optional): Number of values per chunk
+            progress (UploadProgress, optional): Called after each chunk
+            background (bool, optional): Upload from a background thread
+
+        Returns:
+            Optional[Future]: Finishes when the upload is done, if in background
         """
-        self._write_channel_floats('sour{0}:list:volt:app ', voltages)
-        self._make_ready_to_start()
+        if background:
+            # The caller may reuse its buffer while the upload runs
+            values = np.array(voltages, dtype=float, copy=True)
+        else:
+            values = np.asarray(voltages, dtype=float)
+        qdac = self._channel._parent
+
+        def upload() -> None:
+            uploaded = self._channel._dc_list_V
+            try:
+                qdac.stream_floats(
+                    self._channel_message('sour{0}:list:volt:app '),
+                    values, chunk_size, progress)
+            except BaseException:
+                # Unknown how much of the list made it to the instrument
+                self._channel._dc_list_V = None
+                raise
+            if uploaded is not None:
+                self._channel._dc_list_V = np.concatenate((uploaded, values))
+            self._make_ready_to_start()
+
+        if background:
+            return qdac.upload_in_background(upload)
+        upload()
+        return None
 
     def points(self) -> int:
         """
@@ -1545,6 +1601,8 @@ class QDac2Channel(InstrumentChannel):
             name='abort',
             call_cmd=f'sour{channum}:all:abor'
         )
+        # Voltages last uploaded to the DC list, if known
+        self._dc_list_V: Optional[np.ndarray] = None
 
     @property
     def number(self) -> int:
@@ -1830,11 +1888,25 @@ class Trace_Context:
         """Name of trace"""
         return self._name
 
-    def waveform(self, values: Sequence[float]) -> None:
+    def waveform(self, values: Sequence[float],
+                 chunk_size: int = UPLOAD_CHUNK_SIZE,
+                 progress: Optional[UploadProgress] = None,
+                 background: bool = False) -> Optional[Future]:
         """Fill values into trace
 
+        The values are streamed to the instrument as 32-bit floats in
+        chunks, so long numpy arrays are never converted to lists.  Uploads
+        in the background are queued, so uploads to several traces can be
+        started one after the other while the next values are calculated.
+
         Args:
-            values (Sequence[float]): Sequence of values
+            values (Sequence[float]): Sequence or array of values
+            chunk_size (int, optional): Number of values per chunk
+            progress (UploadProgress, optional): Called after each chunk
+            background (bool, optional): Upload from a background thread
+
+        Returns:
+            Optional[Future]: Finishes when the upload is done, if in background
 
         Raises:
             ValueError: size mismatch
@@ -1842,7 +1914,92 @@ class Trace_Context:
         if len(values) != self.size:
             raise ValueError(f'trace length {len(values)} does not match '
                              f'allocated length {self.size}')
-        self._parent.write_floats(f'trac:data "{self.name}",', values)
+        cmd = f'trac:data "{self.name}",'
+        if background:
+            # The caller may reuse its buffer while the upload runs
+            snapshot = np.array(values, dtype=float, copy=True)
+            return self._parent.upload_in_background(
+                lambda: self._parent.stream_floats(cmd, snapshot, chunk_size,
+                                                   progress))
+        self._parent.stream_floats(cmd, values, chunk_size, progress)
+        return None
+
+
+class Batch_Context:
+    """Combine SCPI commands into as few messages as possible
+
+    Commands written while the context is active are joined by semicolons
+    into messages of at most max_message_bytes.  A message is sent when it
+    is full, before any query, and when the context exits.  The error queue
+    is only checked when the context exits.
+
+    Nested batches are merged into the outermost batch.  A batch only
+    collects the commands of the thread that opened it, so uploads running
+    in the background are never mixed into it.
+    """
+
+    def __init__(self, parent: 'QDac2', max_message_bytes: int):
+        self._parent = parent
+        self._max_message_bytes = max_message_bytes
+        self._commands: List[str] = list()
+        self._n_bytes = 0
+        self._outermost = False
+        self._thread: Optional[int] = None
+
+    def __enter__(self):
+        if self._parent._batch is None:
+            self._parent._batch = self
+            self._outermost = True
+            self._thread = threading.get_ident()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._outermost:
+            return False
+        self._parent._batch = None
+        self._outermost = False
+        try:
+            self.flush()
+            if exc_type is None:
+                errors = self._parent.errors()
+                if not errors.startswith('0,'):
+                    raise ValueError(f'Error: {errors} after executing batch')
+        except BaseException:
+            self._parent._forget_dc_lists()
+            raise
+        if exc_type is not None:
+            # Unknown which of the commands were sent
+            self._parent._forget_dc_lists()
+        # Propagate exceptions
+        return False
+
+    def write(self, cmd: str) -> None:
+        """Add a SCPI command to the batch
+
+        Args:
+            cmd (str): SCPI command
+        """
+        if cmd.startswith('*'):
+            separated = f';{cmd}'
+        else:
+            separated = f';:{cmd}'
+        if self._commands and \
+                self._n_bytes + len(separated) > self._max_message_bytes:
+            self.flush()
+        if not self._commands:
+            separated = cmd
+        self._commands.append(separated)
+        self._n_bytes += len(separated)
+
+    def flush(self) -> None:
+        """Send all collected commands to the instrument
+        """
+        if not self._commands:
+            return
+        message = ''.join(self._commands)
+        self._commands = list()
+        self._n_bytes = 0
+        self._parent._write_message(message)
 
 
 class Virtual_Sweep_Context:
@@ -1932,8 +2089,12 @@ class Virtual_Sweep_Context:
 
     def _send_list_to_qdac(self, contact_index, voltages):
         channel = self._get_channel(contact_index)
-        dc_list = channel.dc_list(voltages=voltages, dwell_s=self._step_time_s,
-                                  repetitions=self._repetitions)
+        # When a sweep is re-run, only upload the lists that changed
+        if channel._dc_list_V is not None and \
+                np.array_equal(channel._dc_list_V, voltages):
+            voltages = None
+        dc_list = List_Context(channel, voltages, self._repetitions,
+                               self._step_time_s, 0, False, False)
         trigger = self._arrangement.get_trigger_by_name(self._start_trigger_name)
         dc_list.start_on(trigger)
 
@@ -1944,6 +2105,9 @@ class Virtual_Sweep_Context:
 
 
 class Arrangement_Context:
+    # Number of compiled sweeps kept for re-use
+    max_compiled_sweeps = 16
+
     def __init__(self, qdac: 'QDac2', contacts: Dict[str, int],
                  output_triggers: Optional[Dict[str, int]],
                  internal_triggers: Optional[Sequence[str]],
@@ -1954,6 +2118,7 @@ class Arrangement_Context:
         self._outer_trigger_channel = outer_trigger_channel
         self._outer_trigger_context: Optional[Sine_Context] = None
         self._correction = np.identity(self.shape)
+        self._compiled_sweeps: 'OrderedDict[tuple, np.ndarray]' = OrderedDict()
 
     def __enter__(self):
         return self
@@ -2124,6 +2289,21 @@ class Arrangement_Context:
             print(f'Internal triggers: {list(self._internal_triggers.keys())}')
             raise
 
+    def available_currents_A(self, out: Optional[np.ndarray] = None
+                             ) -> np.ndarray:
+        """Retrieve the available current measurements of all contacts
+
+        The available measurements will be removed from the measurement
+        queues.
+
+        Args:
+            out (np.ndarray, optional): Preallocated array with a row per contact
+
+        Returns:
+            np.ndarray: (contacts x samples) array of currents, padded with NaN for contacts with fewer measurements
+        """
+        return self._qdac.available_currents_A(self.channel_numbers, out)
+
     def _all_channels_as_suffix(self) -> str:
         channels_str = ints_to_comma_separated_list(self.channel_numbers)
         return f'(@{channels_str})'
@@ -2171,14 +2351,79 @@ class Arrangement_Context:
 
     def _calculate_1d_values(self, contact: str, voltages: Sequence[float]
                              ) -> np.ndarray:
-        original_voltage = self.virtual_voltage(contact)
-        index = self._contact_index(contact)
-        sweep = list()
-        for v in voltages:
-            self._virtual_voltages[index] = v
-            sweep.append(self.actual_voltages())
-        self._virtual_voltages[index] = original_voltage
-        return np.array(sweep)
+        return self._calculate_nd_values([contact], [voltages])
+
+    def virtual_sweep_nd(self, contacts: Sequence[str],
+                         voltages: Sequence[Sequence[float]],
+                         start_sweep_trigger: Optional[str] = None,
+                         step_time_s: float = 1e-5,
+                         step_trigger: Optional[str] = None,
+                         repetitions: int = 1) -> Virtual_Sweep_Context:
+        """Sweep any number of contacts over a grid of virtual voltages
+
+        The first contact changes slowest and the last contact fastest, so
+        virtual_sweep2d(inner, ..., outer, ...) corresponds to
+        virtual_sweep_nd([outer, inner], ...).
+
+        Args:
+            contacts (Sequence[str]): Names of sweeping contacts, slowest first
+            voltages (Sequence[Sequence[float]]): Virtual voltages per contact
+            start_sweep_trigger (None, optional): Trigger that starts sweep
+            step_time_s (float, optional): Delay between voltage changes
+            step_trigger (None, optional): Trigger that marks each step
+            repetitions (int, Optional): Number of back-and-forth sweeps, or -1 for infinite
+
+        Returns:
+            Virtual_Sweep_Context: context manager
+        """
+        if len(contacts) != len(voltages):
+            raise ValueError(f'There must be exactly one list of voltages per contact: {contacts}')
+        sweep = self._calculate_nd_values(contacts, voltages)
+        return Virtual_Sweep_Context(self, sweep, start_sweep_trigger,
+                                     step_time_s, step_trigger, repetitions)
+
+    def _calculate_nd_values(self, contacts: Sequence[str],
+                             voltages: Sequence[Sequence[float]]
+                             ) -> np.ndarray:
+        grids = np.meshgrid(*[np.asarray(v, dtype=float) for v in voltages],
+                            indexing='ij')
+        values = np.stack([grid.ravel() for grid in grids], axis=1)
+        return self._compile_sweep(contacts, values)
+
+    def _compile_sweep(self, contacts: Sequence[str], values: np.ndarray
+                       ) -> np.ndarray:
+        """Corrected voltages of all contacts for a virtual sweep
+
+        Contacts not in the sweep keep their current virtual voltage, and all
+        steps are corrected in one matrix multiplication.  Compiled sweeps are
+        cached, keyed by the correction matrix and the sweep.
+
+        Args:
+            contacts (Sequence[str]): Names of sweeping contacts
+            values (np.ndarray): Virtual voltages (steps x contacts)
+
+        Returns:
+            np.ndarray: Read-only corrected voltages (steps x all contacts)
+        """
+        indices = [self._contact_index(contact) for contact in contacts]
+        values = np.asarray(values, dtype=float)
+        key = (self._correction.tobytes(), self._virtual_voltages.tobytes(),
+               self._qdac._round_off, tuple(indices), values.shape,
+               values.tobytes())
+        sweep = self._compiled_sweeps.get(key)
+        if sweep is not None:
+            self._compiled_sweeps.move_to_end(key)
+            return sweep
+        virtual = np.tile(self._virtual_voltages, (values.shape[0], 1))
+        virtual[:, indices] = values
+        sweep = np.matmul(virtual, self._correction.T)
+        if self._qdac._round_off:
+            sweep = np.round(sweep, self._qdac._round_off)
+        sweep.flags.writeable = False
+        self._compiled_sweeps[key] = sweep
+        if len(self._compiled_sweeps) > self.max_compiled_sweeps:
+            self._compiled_sweeps.popitem(last=False)
+        return sweep
 
     def virtual_sweep2d(self, inner_contact: str, inner_voltages: Sequence[float],
                         outer_contact: str, outer_voltages: Sequence[float],
@@ -2236,19 +2481,8 @@ class Arrangement_Context:
                              inner_voltages: Sequence[float],
                              outer_contact: str,
                              outer_voltages: Sequence[float]) -> np.ndarray:
-        original_fast_voltage = self.virtual_voltage(inner_contact)
-        original_slow_voltage = self.virtual_voltage(outer_contact)
-        outer_index = self._contact_index(outer_contact)
-        inner_index = self._contact_index(inner_contact)
-        sweep = list()
-        for slow_V in outer_voltages:
-            self._virtual_voltages[outer_index] = slow_V
-            for fast_V in inner_voltages:
-                self._virtual_voltages[inner_index] = fast_V
-                sweep.append(self.actual_voltages())
-        self._virtual_voltages[inner_index] = original_fast_voltage
-        self._virtual_voltages[outer_index] = original_slow_voltage
-        return np.array(sweep)
+        return self._calculate_nd_values([outer_contact, inner_contact],
+                                         [outer_voltages, inner_voltages])
 
     def virtual_detune(self, contacts: Sequence[str], start_V: Sequence[float],
                        end_V: Sequence[float], steps: int,
@@ -2283,17 +2517,9 @@ class Arrangement_Context:
 
     def _calculate_detune_values(self, contacts: Sequence[str], start_V: Sequence[float],
                                  end_V: Sequence[float], steps: int):
-        original_voltages = [self.virtual_voltage(contact) for contact in contacts]
-        indices = [self._contact_index(contact) for contact in contacts]
-        sweep = list()
-        forward_V = [forward_and_back(start_V[i], end_V[i], steps) for i in range(len(contacts))]
-        for voltages in zip(*forward_V):
-            for index, voltage in zip(indices, voltages):
-                self._virtual_voltages[index] = voltage
-            sweep.append(self.actual_voltages())
-        for index, voltage in zip(indices, original_voltages):
-            self._virtual_voltages[index] = voltage
-        return np.array(sweep)
+        values = np.stack([np.fromiter(forward_and_back(start, end, steps), float)
+                           for start, end in zip(start_V, end_V)], axis=1)
+        return self._compile_sweep(contacts, values)
 
     def leakage(self, modulation_V: float, nplc: int = 2) -> np.ndarray:
         """Run a simple leakage test between the contacts
@@ -2535,6 +2761,32 @@ class QDac2(VisaInstrument):
         """
         return Trace_Context(self, name, size)
 
+    def batch(self, max_message_bytes: int = 1024) -> Batch_Context:
+        """Send SCPI commands in as few messages as possible
+
+        All commands written inside the context are joined into messages of
+        at most max_message_bytes, and the error queue is checked once when
+        the context exits, so that for example setting up generators on
+        many channels does not need a round trip per command:
+
+            with qdac.batch():
+                for channel in qdac.channels:
+                    channel.dc_sweep(start_V=-1, stop_V=1, points=11)
+
+        Queries inside the context are answered immediately, after sending
+        the commands collected so far.
+
+        Args:
+            max_message_bytes (int, optional): Maximum length of a message (default 1024)
+
+        Returns:
+            Batch_Context: context manager
+
+        Raises:
+            ValueError: the instrument reported errors when the context exits
+        """
+        return Batch_Context(self, max_message_bytes)
+
     def mac(self) -> str:
         """
         Returns:
@@ -2576,6 +2828,68 @@ class QDac2(VisaInstrument):
         return Arrangement_Context(self, contacts, output_triggers,
                                    internal_triggers, outer_trigger_channel)
 
+    def available_currents_A(self, channels: Optional[Sequence[int]] = None,
+                             out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Retrieve the available current measurements of several channels
+
+        The available measurements will be removed from the measurement
+        queues.  All channels are read with two queries, independent of the
+        number of channels.
+
+        Args:
+            channels (Sequence[int], optional): Channel numbers (default all)
+            out (np.ndarray, optional): Preallocated array with a row per channel
+
+        Returns:
+            np.ndarray: (channels x samples) array of currents, padded with NaN for channels with fewer measurements
+
+        Raises:
+            ValueError: out has too few rows or columns
+        """
+        if channels is None:
+            channels = range(1, self.n_channels() + 1)
+        counts = [int(answer[0]) for answer in
+                  self.ask_floats([f'sens{ch}:data:poin?' for ch in channels])]
+        n_samples = max(counts, default=0)
+        if out is None:
+            out = np.empty((len(channels), n_samples))
+        elif out.shape[0] != len(channels) or out.shape[1] < n_samples:
+            raise ValueError(f'out has shape {out.shape}, needs {len(channels)} '
+                             f'rows and at least {n_samples} columns')
+        out = out[:, :n_samples]
+        out.fill(np.nan)
+        # Bug circumvention: only retrieve from channels with measurements
+        nonempty = [index for index, count in enumerate(counts) if count]
+        if not nonempty:
+            return out
+        answers = self.ask_floats(
+            [f'sens{channels[index]}:data:rem?' for index in nonempty])
+        for index, values in zip(nonempty, answers):
+            # Measurements could have arrived after counting
+            values = values[:n_samples]
+            out[index, :len(values)] = values
+        return out
+
+    def last_voltages_V(self, channels: Optional[Sequence[int]] = None,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Retrieve the output voltages of several channels with one query
+
+        Args:
+            channels (Sequence[int], optional): Channel numbers (default all)
+            out (np.ndarray, optional): Preallocated array with an element per channel
+
+        Returns:
+            np.ndarray: last voltage output on each channel
+        """
+        if channels is None:
+            channels = range(1, self.n_channels() + 1)
+        if out is None:
+            out = np.empty(len(channels))
+        answers = self.ask_floats([f'sour{ch}:volt:last?' for ch in channels])
+        for index, values in enumerate(answers):
+            out[index] = values[0]
+        return out
+
     # -----------------------------------------------------------------------
     # Instrument-wide functions
     # -----------------------------------------------------------------------
@@ -2634,12 +2948,49 @@ class QDac2(VisaInstrument):
     def write(self, cmd: str) -> None:
         """Send SCPI command to instrument
 
+        Inside a batch() context, the command is added to the batch instead.
+
         Args:
             cmd (str): SCPI command
         """
-        if self._record_commands:
-            self._scpi_sent.append(cmd)
-        super().write(cmd)
+        self._forget_dc_lists(cmd)
+        batch = self._active_batch()
+        if batch:
+            return batch.write(cmd)
+        self._write_message(cmd)
+
+    def _forget_dc_lists(self, cmd: Optional[str] = None) -> None:
+        """Forget the copies of DC lists that a command might change
+
+        The copies are only used to skip uploading a list that is already on
+        the instrument, so when in doubt they are forgotten.
+
+        Args:
+            cmd (str, optional): SCPI command, or None to forget all copies
+        """
+        # No channels yet while the instrument is being set up
+        all_channels = self.submodules.get('channels', [])
+        if cmd is None or '*rst' in cmd.lower():
+            channels = list(all_channels)
+        else:
+            numbers = {int(n) for n in _DC_LIST_COMMAND.findall(cmd)}
+            channels = [channel for n, channel in
+                        enumerate(all_channels, start=1) if n in numbers]
+        for channel in channels:
+            channel._dc_list_V = None
+
+    def _active_batch(self) -> Optional[Batch_Context]:
+        """The batch opened by the calling thread, if any"""
+        batch = self._batch
+        if batch is not None and batch._thread == threading.get_ident():
+            return batch
+        return None
+
+    def _write_message(self, message: str) -> None:
+        with self._io_lock:
+            if self._record_commands:
+                self._scpi_sent.append(message)
+            super().write(message)
 
     def ask(self, cmd: str) -> str:
         """Send SCPI query to instrument
@@ -2650,9 +3001,13 @@ class QDac2(VisaInstrument):
         Returns:
             str: SCPI answer
         """
-        if self._record_commands:
-            self._scpi_sent.append(cmd)
-        answer = super().ask(cmd)
+        with self._io_lock:
+            batch = self._active_batch()
+            if batch:
+                batch.flush()
+            if self._record_commands:
+                self._scpi_sent.append(cmd)
+            answer = super().ask(cmd)
         return answer
 
     def write_floats(self, cmd: str, values: Sequence[float]) -> None:
@@ -2662,14 +3017,135 @@ class QDac2(VisaInstrument):
 
         Remember to include separating space in command if needed.
         """
+        self._forget_dc_lists(cmd)
         if self._no_binary_values:
             compiled = f'{cmd}{floats_to_comma_separated_list(values)}'
+            batch = self._active_batch()
+            if batch:
+                return batch.write(compiled)
+            return self._write_message(compiled)
+        with self._io_lock:
+            batch = self._active_batch()
+            if batch:
+                batch.flush()
+            if self._record_commands:
+                self._scpi_sent.append(f'{cmd}{floats_to_comma_separated_list(values)}')
+            self.visa_handle.write_binary_values(cmd, values)
+
+    def stream_floats(self, cmd: str, values: Sequence[float],
+                      chunk_size: int = UPLOAD_CHUNK_SIZE,
+                      progress: Optional[UploadProgress] = None) -> None:
+        """Append many values to a SCPI command, sent in chunks
+
+        The values are sent as one IEEE binary block of 32-bit floats, but
+        converted and written chunk by chunk, so memory use stays low and
+        progress can be reported while a long trace is uploaded.  The
+        communication with the instrument is locked during the upload.
+
+        Remember to include separating space in command if needed.
+
+        Args:
+            cmd (str): SCPI command
+            values (Sequence[float]): Sequence or array of numbers
+            chunk_size (int, optional): Number of values per chunk
+            progress (UploadProgress, optional): Called after each chunk
+
+        Raises:
+            ValueError: non-positive chunk size
+        """
+        if chunk_size < 1:
+            raise ValueError(f'Chunk size must be positive: {chunk_size}')
+        self._forget_dc_lists(cmd)
+        data = np.asarray(values)
+        total = len(data)
+        if self._no_binary_values:
+            self.write_floats(cmd, data)
+            if progress:
+                progress(total, total)
+            return
+        n_bytes = 4 * total
+        header = f'{cmd}#{len(str(n_bytes))}{n_bytes}'.encode()
+        termination = self.visa_handle.write_termination.encode()
+        with self._io_lock:
+            batch = self._active_batch()
+            if batch:
+                batch.flush()
+            if self._record_commands:
+                self._scpi_sent.append(f'{cmd}{floats_to_comma_separated_list(data)}')
+            send_end = self.visa_handle.send_end
+            self.visa_handle.send_end = False
+            try:
+                self.visa_handle.write_raw(header)
+                for start in range(0, total, chunk_size):
+                    chunk = data[start:start + chunk_size].astype('<f4', copy=False)
+                    self.visa_handle.write_raw(chunk.tobytes())
+                    if progress:
+                        progress(min(start + chunk_size, total), total)
+                self.visa_handle.send_end = send_end
+                self.visa_handle.write_raw(termination)
+            finally:
+                self.visa_handle.send_end = send_end
+
+    def upload_in_background(self, upload: Callable[[], None]) -> Future:
+        """Run an upload from a background thread
+
+        Uploads are run one at a time in the order they were started.
+
+        Args:
+            upload (Callable[[], None]): Function doing the upload
+
+        Returns:
+            Future: Finishes when the upload is done
+        """
+        if self._uploader is None:
+            self._uploader = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'{self.name}_upload')
+        return self._uploader.submit(upload)
+
+    def close(self) -> None:
+        if self._uploader is not None:
+            self._uploader.shutdown(wait=True)
+            self._uploader = None
+        super().close()
+
+    def ask_floats(self, queries: Sequence[str]) -> List[np.ndarray]:
+        """Send several SCPI queries in one message and read the answers
+
+        Answers in IEEE binary blocks of 32-bit floats are read as such,
+        other answers are parsed as comma separated values.
+
+        Args:
+            queries (Sequence[str]): SCPI queries
+
+        Returns:
+            List[np.ndarray]: the answer to each query
+        """
+        message = ';:'.join(queries)
+        with self._io_lock:
+            batch = self._active_batch()
+            if batch:
+                batch.flush()
             if self._record_commands:
-                self._scpi_sent.append(compiled)
-            return super().write(compiled)
-        if self._record_commands:
-            self._scpi_sent.append(f'{cmd}{floats_to_comma_separated_list(values)}')
-        self.visa_handle.write_binary_values(cmd, values)
+                self._scpi_sent.append(message)
+            self.visa_handle.write(message)
+            answers: List[np.ndarray] = list()
+            while len(answers) < len(queries):
+                first = self.visa_handle.read_bytes(1)
+                if first == b'#':
+                    answers.append(self._read_binary_block())
+                    # Skip separator or terminator
+                    self.visa_handle.read_bytes(1)
+                    continue
+                line = '' if first == b'\n' else first.decode() + self.visa_handle.read()
+                for answer in line.split(';'):
+                    answers.append(np.array(comma_sequence_to_list_of_floats(answer)))
+        return answers
+
+    def _read_binary_block(self) -> np.ndarray:
+        n_digits = int(self.visa_handle.read_bytes(1))
+        n_bytes = int(self.visa_handle.read_bytes(n_digits))
+        block = self.visa_handle.read_bytes(n_bytes)
+        return np.frombuffer(block, dtype='<f4').astype(np.float64)
 
     # -----------------------------------------------------------------------
 
@@ -2679,6 +3155,9 @@ class QDac2(VisaInstrument):
         self._message_flush_timeout_ms = 1
         self._round_off = None
         self._no_binary_values = False
+        self._batch: Optional[Batch_Context] = None
+        self._io_lock = threading.RLock()
+        self._uploader: Optional[ThreadPoolExecutor] = None
 
     def _set_up_serial(self) -> None:
         # No harm in setting the speed even if the connection is not serial.
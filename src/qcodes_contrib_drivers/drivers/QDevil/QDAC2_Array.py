@@ -1,17 +1,24 @@
 from .QDAC2 import QDac2, QDac2Channel, QDac2ExternalTrigger, \
     QDac2Trigger_Context, Arrangement_Context, ExternalInput, \
     comma_sequence_to_list_of_floats, diff_matrix
-from typing import Tuple, Dict, Sequence, List, FrozenSet, Optional
+from typing import Tuple, Dict, Sequence, List, FrozenSet, Optional, \
+    Callable, TypeVar
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait
 import numpy as np
 from time import sleep as sleep_s
 
-# Version 0.1.1
+# Version 0.2.0
 #
 # Guiding principles for this driver for multiple QDevil QDAC-IIs
 # ---------------------------------------------------------------
 #
 # 1. Use the underlying QDAC2.py driver as much as possible.
 #
+# 2. Operations that involve several instruments are dispatched to all of
+#    them simultaneously, one worker thread per instrument, so that an array
+#    of N instruments does not take N times as long as a single instrument.
+#
 
 
 #
@@ -22,6 +29,9 @@ from time import sleep as sleep_s
 #   (which the indiviual arrangements on each instrument does).
 
 
+T = TypeVar('T')
+
+
 def _check_for_reserved_outputs(triggers: Dict[str, int]) -> None:
     for trigger in triggers.values():
         if trigger in (4, 5):
@@ -99,13 +109,16 @@ class Array_Arrangement_Context:
         return arrangement.virtual_voltage(contact)
 
     def set_virtual_voltages(self, contacts_to_voltages: Dict[str, float]) -> None:
-        for qdac in self.qdac_names():
-            qdac_voltages: Dict[str, float] = dict()
-            for contact, voltage in contacts_to_voltages.items():
-                if self._get_qdac_for(contact) == qdac:
-                    qdac_voltages[contact] = voltage
-            arrangement = self._arrangements[qdac]
-            arrangement.set_virtual_voltages(qdac_voltages)
+        qdac_voltages: Dict[str, Dict[str, float]] = {
+            qdac: dict() for qdac in self.qdac_names()}
+        for contact, voltage in contacts_to_voltages.items():
+            qdac_voltages[self._get_qdac_for(contact)][contact] = voltage
+
+        def set_voltages(qdac: QDac2) -> None:
+            arrangement = self._arrangements[qdac.full_name]
+            arrangement.set_virtual_voltages(qdac_voltages[qdac.full_name])
+
+        self._qdacs._dispatch(set_voltages)
 
     def currents_A(self, nplc: int = 1, current_range: str = "low") -> Sequence[float]:
         """Measure currents on all contacts
@@ -116,27 +129,23 @@ class Array_Arrangement_Context:
             nplc (int, optional): Number of powerline cycles to average over
             current_range (str, optional): Current range (default low)
         """
-        # Setup current measurement on all instruments
-        for qdac in self.qdac_names():
-            arrangement = self._arrangements[qdac]
-            channels_suffix = arrangement._all_channels_as_suffix()
-            arrangement._qdac.write(f'sens:rang {current_range},{channels_suffix}')
-        for qdac in self.qdac_names():
-            arrangement = self._arrangements[qdac]
-            channels_suffix = arrangement._all_channels_as_suffix()
+        def set_up(qdac: QDac2) -> None:
+            channels_suffix = self._arrangements[qdac.full_name]._all_channels_as_suffix()
+            qdac.write(f'sens:rang {current_range},{channels_suffix}')
             # Wait for relays to finish switching by doing a query
-            arrangement._qdac.ask(f'*stb?')
-            arrangement._qdac.write(f'sens:nplc {nplc},{channels_suffix}')
+            qdac.ask('*stb?')
+            qdac.write(f'sens:nplc {nplc},{channels_suffix}')
+
+        def read(qdac: QDac2) -> List[float]:
+            channels_suffix = self._arrangements[qdac.full_name]._all_channels_as_suffix()
+            return comma_sequence_to_list_of_floats(qdac.ask(f'read? {channels_suffix}'))
+
+        # Setup current measurement on all instruments
+        self._qdacs._dispatch(set_up)
         # Wait for the current sensors to stabilize and then read
         slowest_line_freq_Hz = 50
         sleep_s((nplc + 1) / slowest_line_freq_Hz)
-        values: List[float] = list()
-        for qdac in self.qdac_names():
-            arrangement = self._arrangements[qdac]
-            channels_suffix = arrangement._all_channels_as_suffix()
-            currents = arrangement._qdac.ask(f'read? {channels_suffix}')
-            values += comma_sequence_to_list_of_floats(currents)
-        return values
+        return list(itertools.chain.from_iterable(self._qdacs._dispatch(read)))
 
     def leakage(self, modulation_V: float, nplc: int = 2) -> np.ndarray:
         """Run a simple leakage test between the contacts
@@ -187,12 +196,26 @@ class QDac2_Array:
     cables must be left in place after sync, so that the clock is
     continuously distributed, and the Controller can trigger all Listerners
     by sending pulses from Ext Out 4 to all Ext In 3 simultaneously.
+
+    Commands and queries for several instruments are sent to all of them
+    simultaneously from one worker thread per instrument, unless parallel
+    is False.  Call close() to stop the worker threads.
     """
 
-    def __init__(self, controller: QDac2, listeners: Sequence[QDac2]):
+    def __init__(self, controller: QDac2, listeners: Sequence[QDac2],
+                 parallel: bool = True):
         self._controller = controller
         self._qdacs = [controller, *listeners]  # Order is important
         self._check_unique_names()
+        self._parallel = parallel
+        self._workers: Dict[str, ThreadPoolExecutor] = dict()
+
+    def close(self) -> None:
+        """Stop the worker threads
+        """
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+        self._workers.clear()
 
     @property
     def trigger_out(self) -> int:
@@ -287,11 +310,41 @@ class QDac2_Array:
             self._controller.write(command)
 
     def _listeners_write(self, commands: List[str]) -> None:
-        listeners = self._qdacs[1:]
-        for listener in listeners:
+        def write(listener: QDac2) -> None:
             for command in commands:
                 listener.write(command)
 
+        self._dispatch(write, self._qdacs[1:])
+
+    def _dispatch(self, job: Callable[[QDac2], T],
+                  qdacs: Optional[Sequence[QDac2]] = None) -> List[T]:
+        """Run a job on several instruments simultaneously
+
+        Each instrument has its own worker thread, so jobs for the same
+        instrument are run in the order they were dispatched.
+
+        Args:
+            job (Callable[[QDac2], T]): Function doing the communication
+            qdacs (Sequence[QDac2], optional): Instruments (default all)
+
+        Returns:
+            List[T]: Results in the same order as the instruments
+        """
+        if qdacs is None:
+            qdacs = self._qdacs
+        if not self._parallel or len(qdacs) < 2:
+            return [job(qdac) for qdac in qdacs]
+        futures = [self._worker(qdac).submit(job, qdac) for qdac in qdacs]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def _worker(self, qdac: QDac2) -> ThreadPoolExecutor:
+        name = qdac.full_name
+        if name not in self._workers:
+            self._workers[name] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=name)
+        return self._workers[name]
+
     def _check_unique_names(self) -> None:
         self._controller_name = self._controller.full_name
         self._qdac_names = frozenset([qdac.full_name for qdac in self._qdacs])
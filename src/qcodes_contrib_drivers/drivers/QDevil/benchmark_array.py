@@ -0,0 +1,106 @@
+"""
+Benchmark of operations on a QDac2_Array.
+
+The benchmark measures the wall time of array operations for 2 to 8
+QDAC-IIs, dispatched one instrument after the other and in parallel.  The
+instruments are simulated with sims/QDAC2.yaml, which answers instantly, so
+a fixed latency is added to every write and read to mimic the round trip to
+a real instrument:
+
+    python -m qcodes_contrib_drivers.drivers.QDevil.benchmark_array
+"""
+import time
+import uuid
+from typing import Callable, Dict, List, Sequence
+
+from qcodes_contrib_drivers.drivers.QDevil.QDAC2 import QDac2
+from qcodes_contrib_drivers.drivers.QDevil.QDAC2_Array import QDac2_Array
+import qcodes_contrib_drivers.sims as sims
+
+visalib = sims.__file__.replace('__init__.py', 'QDAC2.yaml@sim')
+
+
+def _add_latency(qdac: QDac2, latency_s: float) -> None:
+    """ Delay every write and read on the VISA session of an instrument """
+    handle = qdac.visa_handle
+    for method in ('write_raw', 'read_raw', 'read_bytes'):
+        original = getattr(handle, method)
+
+        def delayed(*args, _original=original, **kwargs):
+            time.sleep(latency_s)
+            return _original(*args, **kwargs)
+        setattr(handle, method, delayed)
+
+
+def _operations(qdacs: QDac2_Array, names: Sequence[str]
+                ) -> Dict[str, Callable[[], object]]:
+    """ Return a function performing every benchmarked array operation """
+    contacts = {name: {f'{name}_gate{i}': i for i in range(1, 4)}
+                for name in names}
+    arrangement = qdacs.arrange(contacts)
+    voltages = {contact: 0.1 for qdac in contacts.values() for contact in qdac}
+    return {
+        'sync': qdacs.sync,
+        'set_virtual_voltages': lambda: arrangement.set_virtual_voltages(voltages),
+        'currents_A': lambda: arrangement.currents_A(nplc=1),
+    }
+
+
+def _wall_time(operation: Callable[[], object], repetitions: int) -> float:
+    operation()  # warm up worker threads
+    t0 = time.perf_counter()
+    for _ in range(repetitions):
+        operation()
+    return (time.perf_counter() - t0) / repetitions
+
+
+def benchmark_array(qdacs: List[QDac2], repetitions: int = 5
+                    ) -> Dict[str, Dict[str, float]]:
+    """ Benchmark the array operations on a set of instruments
+
+    Args:
+        qdacs: the instruments, the first one is the Controller
+        repetitions: number of repetitions per measurement
+    Returns:
+        dictionary with for every operation the wall time in s when run
+        one instrument after the other ('serial') and in parallel ('parallel')
+    """
+    names = [qdac.full_name for qdac in qdacs]
+    results: Dict[str, Dict[str, float]] = dict()
+    for mode in ('serial', 'parallel'):
+        array = QDac2_Array(qdacs[0], qdacs[1:], parallel=(mode == 'parallel'))
+        try:
+            for qdac in qdacs:
+                qdac.free_all_triggers()
+            for name, operation in _operations(array, names).items():
+                results.setdefault(name, dict())[mode] = \
+                    _wall_time(operation, repetitions)
+        finally:
+            array.close()
+    return results
+
+
+def main(latency_s: float = 1e-3):
+    from qcodes_contrib_drivers.drivers.QDevil import QDAC2_Array
+    QDAC2_Array.sleep_s = lambda s: None  # Don't wait for current sensors
+
+    qdacs: List[QDac2] = list()
+    try:
+        for n in range(2, 9):
+            while len(qdacs) < n:
+                name = ('dac' + str(uuid.uuid4())).replace('-', '')
+                qdac = QDac2(name, address='GPIB::1::INSTR', visalib=visalib)
+                _add_latency(qdac, latency_s)
+                qdacs.append(qdac)
+            print(f'{n} instruments')
+            for name, result in benchmark_array(qdacs).items():
+                print(f'  {name:25s} serial {1e3 * result["serial"]:8.1f} ms '
+                      f'parallel {1e3 * result["parallel"]:8.1f} ms '
+                      f'speed-up {result["serial"] / result["parallel"]:5.1f}')
+    finally:
+        for qdac in qdacs:
+            qdac.close()
+
+
+if __name__ == '__main__':
+    main()
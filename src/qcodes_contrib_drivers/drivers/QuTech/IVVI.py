@@ -131,6 +131,19 @@ class IVVI(VisaInstrument):
                                       'value. Change to a lower value for '
                                       'a shorter minimum time to wait.'))
 
+        # Maximum number of set DAC descriptors sent in one write by set_dacs
+        self.add_parameter('dac_batch_size',
+                           get_cmd=None, set_cmd=None,
+                           initial_value=1,
+                           label='DAC batch size',
+                           vals=vals.Ints(1),
+                           docstring=('Maximum number of set DAC commands '
+                                      'that set_dacs sends to the IVVI in a '
+                                      'single write before reading the '
+                                      'replies. The default of 1 sends one '
+                                      'command per write, set it to e.g. '
+                                      'the number of dacs to batch them.'))
+
         self.add_parameter('dac_voltages',
                            label='DAC voltages',
                            unit='mV',
@@ -207,8 +220,105 @@ class IVVI(VisaInstrument):
         return self.snapshot(update=True)
 
     def set_dacs_zero(self):
-        for i in range(self._numdacs):
-            self.parameters['dac{}'.format(i + 1)](0)
+        self.set_dacs({i + 1: 0 for i in range(self._numdacs)})
+
+    def set_dacs(self, mvoltages):
+        '''
+        Sets several dacs at once.
+
+        The set DAC commands are sent in writes of at most dac_batch_size
+        commands, so with a batch size larger than 1 the dacs are updated
+        without a round trip per dac. Dacs whose 16-bit value does not
+        change with respect to the last known value are skipped.
+
+        The dacs are ramped in lockstep: the number of steps is determined
+        by the dac that needs most steps of its parameter's step size, all
+        dacs are moved in that many equal steps and the longest inter_delay
+        of the dacs is waited between the steps.
+
+        Args:
+            mvoltages (dict): voltages in mV per dac. Dacs are given by
+                their 1 based index or their name, e.g. {1: 10, 'dac2': -5}
+        '''
+        channels = {}
+        for dac, mvoltage in mvoltages.items():
+            channel = int(dac[3:]) if isinstance(dac, str) else int(dac)
+            if not 1 <= channel <= self._numdacs:
+                raise ValueError('dac must be in 1-{}, not {}'.format(
+                    self._numdacs, dac))
+            self.parameters['dac{}'.format(channel)].validate(mvoltage)
+            channels[channel] = mvoltage
+        if not channels:
+            return
+
+        if getattr(self, '_mvoltages', None) is None:
+            self._get_dacs()
+        start = {ch: self._mvoltages[ch - 1] for ch in channels}
+
+        n_steps = 1
+        delay = 0
+        for ch, mvoltage in channels.items():
+            parameter = self.parameters['dac{}'.format(ch)]
+            if parameter.step:
+                n_steps = max(n_steps, math.ceil(
+                    abs(mvoltage - start[ch]) / parameter.step))
+            delay = max(delay, parameter.inter_delay)
+
+        sent = {ch: self._dac_code(ch, start[ch]) for ch in channels}
+        for step in range(1, n_steps + 1):
+            if step > 1 and delay > 0:
+                time.sleep(delay)
+            codes = {}
+            for ch, mvoltage in channels.items():
+                if step < n_steps:
+                    mvoltage = start[ch] + (mvoltage - start[ch]) * step / n_steps
+                code = self._dac_code(ch, mvoltage)
+                if code != sent[ch]:
+                    codes[ch] = code
+            self._set_dac_codes(codes)
+            sent.update(codes)
+
+        for ch, mvoltage in channels.items():
+            self.parameters['dac{}'.format(ch)].cache.set(mvoltage)
+
+    def _dac_code(self, channel, mvoltage):
+        ''' Returns the 16-bit DAC value of a voltage in mV '''
+        polarity_corrected = mvoltage - self.pol_num[channel - 1]
+        return int(round(polarity_corrected / self.full_range * self.dacsteps))
+
+    def _dac_mvoltage(self, channel, dacstep):
+        ''' Returns the voltage in mV of a 16-bit DAC value '''
+        return (dacstep / float(self.dacsteps) *
+                self.full_range) + self.pol_num[channel - 1]
+
+    def _set_dac_codes(self, codes):
+        '''
+        Sends one set DAC command per dac in writes of at most
+        dac_batch_size commands and reads the replies of each write at once.
+
+        Input:
+            codes (dict) : 16-bit DAC value per 1 based dac index
+        '''
+        items = list(codes.items())
+        batch_size = self.dac_batch_size()
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i + batch_size]
+            messages = [bytes([2, 1, ch]) + self._dacstep_to_bytes(code)
+                        for ch, code in batch]
+            replies = self.ask_multiple(messages)
+            for (ch, code), reply in zip(batch, replies):
+                if reply[1] != 0:
+                    raise Exception('IVVI rack exception {} when setting '
+                                    'dac{}'.format(reply[1], ch))
+                self._update_mvoltage(ch, code)
+                self.parameters['dac{}'.format(ch)].cache.set(
+                    self._dac_mvoltage(ch, code))
+        self._time_last_update = 0  # ensures get command will update
+
+    def _update_mvoltage(self, channel, dacstep):
+        ''' Updates the last known voltage of a dac after a set command '''
+        if getattr(self, '_mvoltages', None) is not None:
+            self._mvoltages[channel - 1] = self._dac_mvoltage(channel, dacstep)
 
     def linspace(self, start: float, end: float, samples: int, polarity: str):
         """
@@ -384,6 +494,7 @@ class IVVI(VisaInstrument):
             message = bytes([2, 1, channel]) + byte_val
 
             reply = self.ask(message)
+            self._update_mvoltage(channel, int(dacstep))
             self._time_last_update = 0  # ensures get command will update
 
             return reply
@@ -442,6 +553,7 @@ class IVVI(VisaInstrument):
             message = bytes([2, 1, channel]) + byte_val
 
             reply = self.ask(message)
+            self._update_mvoltage(channel, int.from_bytes(byte_val, 'big'))
             self._time_last_update = 0  # ensures get command will update
 
             return reply
@@ -525,6 +637,40 @@ class IVVI(VisaInstrument):
 
         return reply
 
+    def ask_multiple(self, messages):
+        '''
+        Send several <messages> to the device in a single write and read
+        all answers at once.
+        Returns a list with the answer to every message
+        '''
+        if self.lock:
+            max_tries = 10
+            for i in range(max_tries):
+                if self.lock.acquire(timeout=.05):
+                    break
+                else:
+                    logging.warning('IVVI: cannot acquire the lock')
+            if i + 1 == max_tries:
+                raise Exception('IVVI: lock is stuck')
+        try:
+            # every message is prefixed by its descriptor size and error code
+            data = b''.join(bytes([len(message) + 2, 0]) + message
+                            for message in messages)
+            lengths = [message[0] for message in messages]
+            self.write(data, raw=True)
+            reply = self.read(message_len=sum(lengths),
+                              timeout=len(messages))
+        finally:
+            if self.lock:
+                self.lock.release()
+
+        replies = []
+        offset = 0
+        for length in lengths:
+            replies.append(reply[offset:offset + length])
+            offset += length
+        return replies
+
     def _read_raw_bytes_direct(self, size):
         """ Read raw data using the visa lib """
         with(self.visa_handle.ignore_warning(pyvisa.constants.VI_SUCCESS_MAX_CNT)):
@@ -563,11 +709,10 @@ class IVVI(VisaInstrument):
         ret = b''.join(ret)
         return ret
 
-    def read(self, message_len=None):
+    def read(self, message_len=None, timeout=1):
         # because protocol has no termination chars the read reads the number
         # of bytes in the buffer
         bytes_in_buffer = 0
-        timeout = 1
         t0 = time.time()
         bytes_in_buffer = 0
         if message_len is None:
@@ -1,15 +1,17 @@
 import logging
 
 from qcodes import VisaInstrument
-from qcodes import ChannelList, InstrumentChannel
-from qcodes.utils import validators as vals
-import numpy as np
-from qcodes import MultiParameter, ArrayParameter
-import time
+
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import (
+    FrequencySweep,
+    SpectrumAnalyzerMixin,
+    TraceReader,
+)
+
 log = logging.getLogger(__name__)
 
 
-class FSW(VisaInstrument):
+class FSW(SpectrumAnalyzerMixin, VisaInstrument):
     """
     qcodes driver for the Rohde & Schwarz ZNB8 and ZNB20
     virtual network analyser. It can probably be extended to ZNB4 and 40
@@ -36,18 +38,7 @@ class FSW(VisaInstrument):
 
         model = self.get_idn()['model'].split('-')[0]
         
-        self.add_parameter(name='start',
-                           get_cmd='SENS:FREQ:START?',
-                           set_cmd=self._set_start,
-                           get_parser=float)
-        self.add_parameter(name='stop',
-                           get_cmd='SENS:FREQ:STOP?',
-                           set_cmd=self._set_stop,
-                           get_parser=float)
-        self.add_parameter(name='center',
-                   get_cmd='SENS:FREQ:CENT?',
-                   set_cmd=self._set_center,
-                   get_parser=float)
+        self._add_sweep_parameters()
         self.add_parameter(name='video_bandwidth',
                    get_cmd='SENS:BWID:VID?',
                    set_cmd=self._set_video_bandwidth,
@@ -66,10 +57,14 @@ class FSW(VisaInstrument):
                    get_cmd='CALC:MARK:FUNC:POW:RES? ACP',
                    get_parser=float)
 
-        self.add_parameter(name='span',
-                   get_cmd='SENS:FREQ:SPAN?',
-                   set_cmd=self._set_span,
-                   get_parser=float)
+        self.trace_reader = TraceReader(self)
+
+        self.add_parameter(
+            name="trace",
+            channel=1,
+            parameter_class=FrequencySweep,
+        )
+
         
    
         self.add_function('reset', call_cmd='*RST')
@@ -101,50 +96,8 @@ class FSW(VisaInstrument):
         "Strip newline and quotes from instrument reply"
         return var.rstrip()[1:-1]
 
-    def _set_start(self, val):
-        self.write('SENS:FREQ:START {:.7f}'.format(val))
-        stop = self.stop()
-        if val >= stop:
-            raise ValueError(
-                "Stop frequency must be larger than start frequency.")
-        # we get start as the vna may not be able to set it to the exact value provided
-        start = self.start()
-        if val != start:
-            log.warning(
-                "Could not set start to {} setting it to {}".format(val, start))
-        #self._update_traces()
-
-    def _set_stop(self, val):
-        start = self.start()
-        if val <= start:
-            raise ValueError(
-                "Stop frequency must be larger than start frequency.")
-        self.write('SENS:FREQ:STOP {:.7f}'.format(val))
-        # we get stop as the vna may not be able to set it to the exact value provided
-        stop = self.stop()
-        if val != stop:
-            log.warning(
-                "Could not set stop to {} setting it to {}".format(val, stop))
-        #self._update_traces()
-
-    def _set_npts(self, val):
-        self.write('SENS:SWE:POIN {:.7f}'.format(val))
-        #self._update_traces()
-
-    def _set_span(self, val):
-        self.write('SENS:FREQ:SPAN {:.7f}'.format(val))
-        #self._update_traces()
-
-    def _set_center(self, val):
-        self.write('SENS:FREQ:CENT {:.7f}'.format(val))
-        #time.sleep(0.01)
-        #self._update_traces()
-
     def _set_video_bandwidth(self, val):
         self.write('SENS:BWID:VID {:.7f}'.format(val))
     
     def _set_resolution_bandwidth(self, val):
         self.write('SENS:BWID:RES {:.7f}'.format(val))
-
-    def _set_span(self,val):
-        self.write('SENS:FREQ:SPAN {:.7f}'.format(val))
\ No newline at end of file
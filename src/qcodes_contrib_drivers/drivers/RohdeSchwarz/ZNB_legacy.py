@@ -1,4 +1,5 @@
 import logging
+from contextlib import ExitStack
 from functools import partial
 from typing import Optional
 
@@ -8,6 +9,8 @@ from qcodes.utils import validators as vals
 import numpy as np
 from qcodes import MultiParameter, ArrayParameter
 
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import TraceReader, split_traces
+
 log = logging.getLogger(__name__)
 
 
@@ -407,10 +410,9 @@ class ZNBChannel(InstrumentChannel):
                         self.write(f'INIT{self._instrument_channel}:IMM; *WAI')
                     self.write(f"CALC{self._instrument_channel}:PAR:SEL "
                                f"'{self._tracename}'")
-                    data_str = self.ask(
+                    data = self.root_instrument.trace_reader.read(
                         f'CALC{self._instrument_channel}:DATA?'
                         f' {data_format_command}')
-                data = np.array(data_str.rstrip().split(',')).astype('float64')
                 if self.format() in ['Polar', 'Complex',
                                      'Smith', 'Inverse Smith']:
                     data = data[0::2] + 1j * data[1::2]
@@ -493,6 +495,9 @@ class ZNB(VisaInstrument):
                           call_cmd='DISP:LAY GRID;:DISP:LAY:GRID 2,1')
         self.add_function('rf_off', call_cmd='OUTP1 OFF')
         self.add_function('rf_on', call_cmd='OUTP1 ON')
+        # sweep data is transferred as 64 bit floats, set
+        # trace_reader.binary to False to use ASCII transfers
+        self.trace_reader = TraceReader(self, datatype='d')
         if reset_channels:
             self.reset()
             self.clear_channels()
@@ -535,6 +540,68 @@ class ZNB(VisaInstrument):
         self.write(f'TRIG{i_channel}:SEQ:SOUR IMM')
         self.write(f'SENS{i_channel}:AVER:STAT ON')
 
+    def get_all_traces(self, force_polar: bool = False) -> np.ndarray:
+        """
+        Measure all channels and read the traces of all channels at once.
+
+        All channels are swept together and the data of all traces is read
+        with a single CALC:DATA:DALL? query, instead of a sweep and a read
+        per channel. This requires that every trace on the VNA belongs to a
+        channel, and that the traces were created in the order of the
+        channels.
+
+        Args:
+            force_polar: if True, all traces are read as complex numbers,
+                independent of the format of the channels.
+
+        Returns:
+            structured array of length npts with a field per channel, named
+            after the channel. Fields of channels with a complex format are
+            complex.
+        """
+        channels = list(self.channels)
+        if not channels:
+            raise RuntimeError("There are no channels to read")
+        npts = {channel.npts.cache() for channel in channels}
+        if len(npts) != 1:
+            raise RuntimeError("All channels must have the same number of "
+                               f"points for a bulk read, got {npts}")
+        if not self.rf_power():
+            log.warning("RF output is off when getting sweep data")
+
+        fields = []
+        for channel in channels:
+            is_complex = force_polar or channel.format.cache() in [
+                'Polar', 'Complex', 'Smith', 'Inverse Smith']
+            fields.append((channel.short_name,
+                           np.complex128 if is_complex else np.float64))
+
+        # a single query for the sweep time and averages of all channels
+        numbers = [channel._instrument_channel for channel in channels]
+        replies = self.ask(';:'.join(f'SENS{n}:SWE:TIME?;:SENS{n}:AVER:COUN?'
+                                     for n in numbers)).split(';')
+        sweep_time = sum(float(reply) for reply in replies[0::2])
+        averages = max(int(reply) for reply in replies[1::2])
+        self.write(';:'.join(f'SENS{n}:AVER:STAT ON;:SENS{n}:AVER:CLE'
+                             for n in numbers))
+
+        data_format_command = 'SDAT' if force_polar else 'FDAT'
+        with ExitStack() as stack:
+            for channel in channels:
+                stack.enter_context(channel.status.set_to(1))
+            self.cont_meas_off()
+            try:
+                timeout = (averages * sweep_time
+                           + channels[0]._additional_wait)
+                with self.timeout.set_to(timeout):
+                    for _ in range(averages):
+                        self.write('INIT:ALL; *WAI')
+                    data = self.trace_reader.read(
+                        f'CALC:DATA:DALL? {data_format_command}')
+            finally:
+                self.cont_meas_on()
+        return split_traces(data, fields, npts.pop())
+
     def clear_channels(self):
         """
         Remove all channels from the instrument and channel list and
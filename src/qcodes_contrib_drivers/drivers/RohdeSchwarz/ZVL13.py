@@ -9,6 +9,8 @@ from qcodes.utils.validators import Enum, Strings, Ints
 from qcodes import VisaInstrument, Instrument
 from qcodes import MultiParameter, ArrayParameter
 
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import TraceReader, split_traces
+
 
 log = logging.getLogger(__name__)
 
@@ -173,6 +175,10 @@ class ZVL13(VisaInstrument):
         self.timeout_sweep = 40
         self.timeout_sa = 40
 
+        # sweep data is transferred as 64 bit floats, set
+        # trace_reader.binary to False to use ASCII transfers
+        self.trace_reader = TraceReader(self, datatype='d')
+
         self.add_parameter('start',
                            get_cmd='FREQ:STAR?',
                            get_parser=float,
@@ -481,6 +487,12 @@ class ZVL13(VisaInstrument):
         else:
             self.write('SOUR:POW ' + str(int(val)))
 
+    def _sweep(self) -> None:
+        self.write('SENS:SWEEP:COUNT '+ str(self.avg()))
+        self.write('INIT:IMMEDIATE:SCOPE:SINGLE')
+        self.write('INIT:CONT OFF')
+        self.write('INIT:IMM; *WAI')
+
     def _get_sweep_data(self, force_polar: bool = False):
         if force_polar:
             data_format_command = 'SDAT'
@@ -495,18 +507,42 @@ class ZVL13(VisaInstrument):
             self.root_instrument.cont_meas_off()
             try:
                 with self.root_instrument.timeout.set_to(self.timeout_sweep):
-                    self.write('SENS:SWEEP:COUNT '+ str(self.avg()))
-                    self.write('INIT:IMMEDIATE:SCOPE:SINGLE')                        
-                    self.write('INIT:CONT OFF')
-                    self.write('INIT:IMM; *WAI')
-                    self.write("CALC:PAR:SEL '{self._tracename}'")
-                    data_str = self.ask(f'CALC:DATA? {data_format_command}')
-
-                data = np.array(data_str.rstrip().split(',')).astype('float64')
+                    self._sweep()
+                    self.write(f"CALC:PAR:SEL '{self._tracename}'")
+                    data = self.trace_reader.read(f'CALC:DATA? {data_format_command}')
             finally:
                 self.root_instrument.cont_meas_on()
         return data
 
+    def get_all_s_parameters(self) -> np.ndarray:
+        """
+        Measure all S-parameters in a single sweep and read them at once.
+
+        The S-parameters are read with a single CALC:DATA:CALL? query, which
+        requires a full calibration of all ports.
+
+        Returns:
+            structured array of length npts with the complex fields S11,
+            S12, S21 and S22, in the order returned by the instrument.
+        """
+        num_ports = self.num_ports.cache()
+        fields = [(f'S{i}{j}', np.complex128)
+                  for i in range(1, num_ports + 1)
+                  for j in range(1, num_ports + 1)]
+
+        self.write('SENS:AVER:STAT ON')
+        self.write('SENS:AVER:CLE')
+
+        with self.status.set_to(1):
+            self.root_instrument.cont_meas_off()
+            try:
+                with self.root_instrument.timeout.set_to(self.timeout_sweep):
+                    self._sweep()
+                    data = self.trace_reader.read('CALC:DATA:CALL? SDAT')
+            finally:
+                self.root_instrument.cont_meas_on()
+        return split_traces(data, fields, self.npts.cache())
+
     def _get_sweep_data_SA(self):
         self.write('SENS:AVER:STAT ON')
         self.write('SENS:AVER:CLE')
@@ -514,13 +550,8 @@ class ZVL13(VisaInstrument):
         self.root_instrument.cont_meas_off()
         try:
             with self.root_instrument.timeout.set_to(self.timeout_sa):
-                self.write('SENS:SWEEP:COUNT '+ str(self.avg()))
-                self.write('INIT:IMMEDIATE:SCOPE:SINGLE')                        
-                self.write('INIT:CONT OFF')
-                self.write('INIT:IMM; *WAI')
-                data_str = self.ask('FORM ASC;TRAC? TRACE1')
-
-            data = np.array(data_str.rstrip().split(',')).astype('float64')
+                self._sweep()
+                data = self.trace_reader.read('TRAC? TRACE1')
         finally:
             self.root_instrument.cont_meas_on()
         return data
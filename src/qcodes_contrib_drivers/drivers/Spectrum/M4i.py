@@ -13,15 +13,21 @@
 # %%
 import os
 import sys
+import mmap
+import queue
 import logging
+import threading
 import numpy as np
 import ctypes as ct
+from collections import OrderedDict
 from functools import partial
-from typing import Union, Type
+from typing import Any, Callable, Generator, List, Optional, Tuple, Union, Type
 
 from qcodes.utils.validators import Enum, Numbers, Anything, Ints
 from qcodes.instrument.base import Instrument
 
+from .reduction import SegmentReducer
+
 log = logging.getLogger(__name__)
 
 try:
@@ -67,6 +73,95 @@ _errormsg_dict = {
         for name in dir(py_header.spcerr) if name.startswith('ERR_')
         }
 
+# %% DMA buffers
+
+
+class BufferPool:
+    """ Pool of page-aligned buffers that are reused between DMA transfers
+
+    Allocating a fresh buffer for every transfer zero-fills and faults in
+    the complete buffer each time. Buffers leased from the pool are
+    allocated once per (dtype, size) and handed out again after they are
+    released.
+
+    At most max_free_bytes are kept in released buffers. When more are
+    released, the buffers of the least recently used (dtype, size) are
+    dropped first, so buffers of sizes that are no longer acquired, e.g.
+    after changing the memory size, don't stay allocated.
+
+    Example:
+        buffer = pool.lease(np.int16, 2**20)
+        ...  # transfer into and process buffer
+        pool.release(buffer)
+
+    Args:
+        max_free_bytes: maximum number of bytes held by released buffers
+    """
+
+    def __init__(self, max_free_bytes: int = 2**30):
+        self.max_free_bytes = max_free_bytes
+        self._free: 'OrderedDict[Tuple[np.dtype, int], List[np.ndarray]]' = OrderedDict()
+        self._free_bytes = 0
+        self._leased = {}
+        self._lock = threading.Lock()
+
+    def lease(self, dtype, size: int) -> np.ndarray:
+        """ Lease a 1D buffer with the given dtype and number of elements
+
+        The content of the buffer is undefined. The buffer must be returned
+        with release() when it is no longer used.
+        """
+        key = (np.dtype(dtype), int(size))
+        with self._lock:
+            free = self._free.get(key)
+            buffer = free.pop() if free else None
+            if buffer is not None:
+                self._free_bytes -= buffer.nbytes
+                if not free:
+                    del self._free[key]
+        if buffer is None:
+            # anonymous memory maps are aligned to the page size
+            memory = mmap.mmap(-1, max(1, key[0].itemsize * key[1]))
+            buffer = np.frombuffer(memory, dtype=key[0], count=key[1])
+        with self._lock:
+            self._leased[id(buffer)] = (key, buffer)
+        return buffer
+
+    def release(self, buffer: np.ndarray) -> None:
+        """ Return a leased buffer to the pool """
+        with self._lock:
+            try:
+                key, _ = self._leased.pop(id(buffer))
+            except KeyError:
+                raise ValueError('buffer was not leased from this pool') from None
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self._free_bytes += buffer.nbytes
+            while self._free_bytes > self.max_free_bytes:
+                oldest_key, buffers = next(iter(self._free.items()))
+                self._free_bytes -= buffers.pop().nbytes
+                if not buffers:
+                    del self._free[oldest_key]
+
+    def clear(self) -> None:
+        """ Drop all buffers that are not leased """
+        with self._lock:
+            self._free.clear()
+            self._free_bytes = 0
+
+    @property
+    def free_bytes(self) -> int:
+        """ Number of bytes held by buffers that are not leased """
+        with self._lock:
+            return self._free_bytes
+
+    @property
+    def leased_bytes(self) -> int:
+        """ Number of bytes held by leased buffers """
+        with self._lock:
+            return sum(b.nbytes for _, b in self._leased.values())
+
+
 # %% Main driver class
 
 
@@ -619,6 +714,9 @@ class M4i(Instrument):
         # memsize used for simple channel read-out
         self._channel_memsize = 2**12
 
+        # buffers for DMA transfers, reused between acquisitions
+        self.buffer_pool = BufferPool()
+
     # checks if requirements for the compensation get and set functions are met
     def _get_compensation(self, i):
         # if HF enabled
@@ -664,10 +762,45 @@ class M4i(Instrument):
         """
         self.general_command(pyspcm.M2CMD_CARD_RESET)
 
-    def convert_to_voltage(self, data, input_range):
-        """convert an array of numbers to an array of voltages."""
+    def convert_to_voltage(self, data, input_range, out=None):
+        """convert an array of numbers to an array of voltages.
+
+        Args:
+            data (array): ADC values
+            input_range (float): input range in V
+            out (array or None): optional array to write the result into
+        """
         resolution = self.ADC_to_voltage.cache()
-        return data * (input_range / resolution)
+        return np.multiply(data, input_range / resolution, out=out)
+
+    def convert_to_channel_voltages(self, raw_data, channels, divisor=1,
+                                    out=None, dtype=np.float64):
+        """ Convert interleaved ADC values to voltages per channel
+
+        The interleaved buffer is reshaped once and every channel is scaled
+        with its own input range in a single broadcasted operation, so no
+        intermediate arrays are allocated.
+
+        Args:
+            raw_data (array): interleaved int16 or int32 ADC values
+            channels (list): indices of the channels in the data
+            divisor (int): additional divisor, e.g. the number of averages
+            out (array or None): optional array of shape
+                (len(channels), samples) to write the voltages into
+            dtype: data type of the returned array if out is None
+        Returns:
+            2D array with voltages per channel in V.
+        """
+        numch = len(channels)
+        resolution = self.ADC_to_voltage.cache()
+        mV_ranges = [self.parameters[f'range_channel_{ch}']() for ch in channels]
+        scale = np.array(mV_ranges, dtype=np.float64) / (1000 * resolution * divisor)
+
+        samples = raw_data.reshape(-1, numch).T
+        if out is None:
+            out = np.empty(samples.shape, dtype=dtype)
+        np.multiply(samples, scale[:, np.newaxis], out=out, casting='same_kind')
+        return out
 
     def initialize_channels(self, channels=None, mV_range=1000, input_path=0,
                             termination=0, coupling=0, compensation=None,
@@ -844,12 +977,18 @@ class M4i(Instrument):
         self.general_command(pyspcm.M2CMD_CARD_START
                              | pyspcm.M2CMD_CARD_ENABLETRIGGER)
 
-    def get_data(self):
+    def get_data(self, out=None, dtype=np.float64):
         """ Reads measurement data from the digitizer.
 
         The data acquisition must have been started by start_acquisition() or
         start_triggered().
 
+        Args:
+            out (array or None): optional array of shape (channels, samples)
+                to write the voltages into
+            dtype: data type of the returned array if out is None, e.g.
+                np.float32 to halve the memory use
+
         Returns:
             2D array with voltages per channel in V.
         """
@@ -873,11 +1012,11 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        resolution = self.ADC_to_voltage.cache()
-        voltages = np.zeros((numch, len(raw_data)//numch))
-        for i,ch in enumerate(active_channels):
-            mV_range = self.parameters[f'range_channel_{ch}']()
-            voltages[i,:] = raw_data[i::numch] * (mV_range / 1000 / resolution / box_averages)
+        try:
+            voltages = self.convert_to_channel_voltages(raw_data, active_channels, divisor=box_averages,
+                                                        out=out, dtype=dtype)
+        finally:
+            self.buffer_pool.release(raw_data)
         return voltages
 
 
@@ -891,9 +1030,108 @@ class M4i(Instrument):
 
         self.general_command(pyspcm.M2CMD_CARD_STOP)
 
-    # TODO: if multiple channels are used at the same time, the voltage conversion needs to be updated
-    # TODO: the data also needs to be organized nicely (currently it
-    # interleaves the data)
+    def setup_fifo_recording(self, segment_size, posttrigger_size=None,
+                             n_segments=0, multi=True):
+        """ Setup FIFO recording.
+
+        Triggering must have been configured separately. The data is streamed
+        with the generator returned by fifo_acquisition().
+
+        Args:
+            segment_size (int): number of samples per channel in a segment
+            posttrigger_size (int or None): size of data trace after
+                triggering. If None, then all but 16 samples of the segment
+                are recorded after the trigger.
+            n_segments (int): total number of segments to acquire. 0 makes
+                the card run until the acquisition is stopped.
+            multi (bool): if True use SPC_REC_FIFO_MULTI (one segment per
+                trigger), otherwise use SPC_REC_FIFO_SINGLE (continuous
+                recording after a single trigger)
+
+        Example:
+            digitizer.setup_fifo_recording(seg_size, n_segments=0)
+            for block in digitizer.fifo_acquisition(segments_per_block=32):
+                process(block)
+        """
+        if multi:
+            self.card_mode(pyspcm.SPC_REC_FIFO_MULTI)
+        else:
+            self.card_mode(pyspcm.SPC_REC_FIFO_SINGLE)
+
+        segment_size = self._hw_memsize(segment_size)
+        if posttrigger_size is None:
+            posttrigger_size = segment_size - 16
+        self.segment_size(segment_size)
+        self.posttrigger_memory_size(self._hw_memsize(posttrigger_size))
+        self.total_segments(n_segments)
+
+    def fifo_acquisition(self, segments_per_block=1, buffer_blocks=16,
+                         n_blocks=None) -> Generator[np.ndarray, None, None]:
+        """ Stream data from the card using the FIFO mode
+
+        The card transfers data into a page-aligned ring buffer of
+        buffer_blocks blocks, leased from buffer_pool. Each block holds
+        segments_per_block segments. The generator yields every block as soon
+        as the card reports it available, and hands the block back to the
+        card when the generator is resumed.
+
+        The card must have been configured with setup_fifo_recording().
+        The acquisition is stopped when the generator is exhausted, closed or
+        garbage collected.
+
+        Args:
+            segments_per_block (int): number of segments per yielded block.
+                The size of a block in bytes must be a multiple of 4096.
+            buffer_blocks (int): number of blocks in the ring buffer
+            n_blocks (int or None): number of blocks to acquire. If None,
+                then stream until the generator is closed.
+        Yields:
+            int16 array of shape (segments_per_block, segment_size, numch)
+            with the raw ADC values. The array is a view on the ring buffer
+            and is only valid until the next block is requested; copy it to
+            keep the data.
+        """
+        segment_size = self.segment_size.cache()
+        numch = self._num_channels()
+        block_samples = segments_per_block * segment_size * numch
+        block_bytes = 2 * block_samples
+        if block_bytes % 4096:
+            raise ValueError(f'block size of {block_bytes} bytes is not a '
+                             'multiple of 4096 bytes')
+        buffer_bytes = block_bytes * buffer_blocks
+
+        data = self.buffer_pool.lease(np.int16, buffer_bytes // 2)
+        data_pointer = ct.c_void_p(data.ctypes.data)
+        block_shape = (segments_per_block, segment_size, numch)
+
+        self._def_transfer64bit(pyspcm.SPCM_BUF_DATA, pyspcm.SPCM_DIR_CARDTOPC,
+                                block_bytes, data_pointer, 0, buffer_bytes)
+        self.general_command(pyspcm.M2CMD_CARD_START
+                             | pyspcm.M2CMD_CARD_ENABLETRIGGER
+                             | pyspcm.M2CMD_DATA_STARTDMA)
+        blocks_done = 0
+        try:
+            while n_blocks is None or blocks_done < n_blocks:
+                self.general_command(pyspcm.M2CMD_DATA_WAITDMA)
+                if self._last_set_result == pyspcm.ERR_TIMEOUT:
+                    raise Exception('Timeout waiting for FIFO data '
+                                    f'(timeout: {self.timeout.cache()} ms)')
+                if self._param32bit(pyspcm.SPC_M2STATUS) & pyspcm.M2STAT_DATA_OVERRUN:
+                    raise Exception('FIFO overrun: data was not read fast enough')
+
+                available = self._param64bit(pyspcm.SPC_DATA_AVAIL_USER_LEN)
+                position = self._param64bit(pyspcm.SPC_DATA_AVAIL_USER_POS)
+                while available >= block_bytes and (n_blocks is None or blocks_done < n_blocks):
+                    start = position // 2
+                    yield data[start:start + block_samples].reshape(block_shape)
+                    self.card_available_length(block_bytes)
+                    position = (position + block_bytes) % buffer_bytes
+                    available -= block_bytes
+                    blocks_done += 1
+        finally:
+            self._stop_acquisition()
+            self.buffer_pool.release(data)
+
     def multiple_trigger_acquisition(self, mV_range, memsize, seg_size, posttrigger_size):
         """ Acquire traces with the SPC_REC_STD_MULTI mode
 
@@ -924,10 +1162,186 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(output, mV_range / 1000)
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
+    def segment_reducer(self, segment_size, averages=1, **kwargs) -> SegmentReducer:
+        """ Create a SegmentReducer for the enabled channels
+
+        The conversion to voltages uses the current input ranges of the
+        enabled channels and the exact sample rate of the card.
+
+        Args:
+            segment_size (int): number of samples per channel in a segment
+            averages (int): number of averages summed on the card, e.g. when
+                the card runs in SPC_REC_STD_AVERAGE mode
+            kwargs: passed to SegmentReducer
+        """
+        resolution = self.ADC_to_voltage.cache()
+        channel_scale = [self.parameters[f'range_channel_{ch}']() / (1000 * resolution * averages)
+                         for ch in self.active_channels()]
+        return SegmentReducer(channel_scale, segment_size, self.exact_sample_rate(), **kwargs)
+
+    def reduced_multiple_trigger_acquisition(self, reducer: SegmentReducer, memsize, seg_size,
+                                             posttrigger_size) -> SegmentReducer:
+        """ Acquire traces with the SPC_REC_STD_MULTI mode and reduce them
+
+        The raw data is passed to the reducer and the transfer buffer is
+        returned to the pool directly afterwards, so no voltage array of the
+        full acquisition is created.
+
+        This method does not update the triggering properties.
+
+        Args:
+            reducer: reducer to add the segments to, see segment_reducer()
+            memsize (int): Size of total buffer to acquire
+            seg_size (int): Size of segments to record
+            posttrigger_size (int): Size of the if post trigger buffer
+        Returns:
+            The reducer
+        """
+        self.card_mode(pyspcm.SPC_REC_STD_MULTI)
+
+        self.data_memory_size(memsize)
+        self.segment_size(seg_size)
+        self.posttrigger_memory_size(posttrigger_size)
+        numch = self._num_channels()
+
+        self.general_command(pyspcm.M2CMD_CARD_START | pyspcm.M2CMD_CARD_ENABLETRIGGER)
+        self.wait_ready()
+
+        try:
+            raw_data = self._transfer_buffer_numpy(memsize, numch)
+        finally:
+            self._stop_acquisition()
+
+        try:
+            reducer.update(raw_data)
+        finally:
+            self.buffer_pool.release(raw_data)
+        return reducer
+
+    def pipelined_multiple_trigger_acquisition(
+            self, mV_range, memsize, seg_size, posttrigger_size,
+            n_batches: Optional[int] = None,
+            process: Optional[Callable[[np.ndarray], Any]] = None,
+            queue_size: int = 2) -> Generator[Any, None, None]:
+        """ Acquire batches of traces with the SPC_REC_STD_MULTI mode in a pipeline
+
+        The card is operated from an acquisition thread that re-arms the card
+        directly after the data of the previous batch has been transferred.
+        Conversion to voltages and the optional post-processing run on a
+        worker thread, so they overlap with the acquisition of the next
+        batch. Results are passed through bounded queues of size queue_size;
+        when the consumer falls behind the acquisition pauses.
+
+        This method does not update the triggering properties.
+
+        Args:
+            mV_range (float): Input range used for coversion to voltage
+            memsize (int): Size of total buffer to acquire per batch
+            seg_size (int): Size of segments to record
+            posttrigger_size (int): Size of the if post trigger buffer
+            n_batches (int or None): number of batches to acquire. If None,
+                then acquire until the generator is closed.
+            process (callable or None): function applied to the voltages of
+                every batch on the worker thread
+            queue_size (int): maximum number of batches waiting for
+                conversion and maximum number of results waiting to be read
+        Yields:
+            Array with measured voltages, or the result of process, for
+            every batch in acquisition order
+        """
+        self.card_mode(pyspcm.SPC_REC_STD_MULTI)
+
+        self.data_memory_size(memsize)
+        self.segment_size(seg_size)
+        self.posttrigger_memory_size(posttrigger_size)
+        numch = self._num_channels()
+        # read on this thread, the worker thread only uses the cached value
+        self.ADC_to_voltage.cache()
+
+        raw_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        result_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        end_of_data = object()
+
+        def put(target: queue.Queue, item) -> bool:
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def acquire():
+            batch = 0
+            try:
+                while n_batches is None or batch < n_batches:
+                    self.general_command(pyspcm.M2CMD_CARD_START | pyspcm.M2CMD_CARD_ENABLETRIGGER)
+                    self.wait_ready()
+                    try:
+                        raw_data = self._transfer_buffer_numpy(memsize, numch)
+                    finally:
+                        self._stop_acquisition()
+                    if not put(raw_queue, raw_data):
+                        self.buffer_pool.release(raw_data)
+                        return
+                    batch += 1
+            except Exception as ex:
+                put(raw_queue, ex)
+            else:
+                put(raw_queue, end_of_data)
+
+        def convert():
+            while not stop.is_set():
+                try:
+                    item = raw_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is end_of_data or isinstance(item, Exception):
+                    put(result_queue, item)
+                    return
+                try:
+                    try:
+                        voltages = self.convert_to_voltage(item, mV_range / 1000)
+                    finally:
+                        self.buffer_pool.release(item)
+                    put(result_queue, voltages if process is None else process(voltages))
+                except Exception as ex:
+                    put(result_queue, ex)
+                    return
+
+        threads = [threading.Thread(target=acquire, name=f'{self.name}_acquire', daemon=True),
+                   threading.Thread(target=convert, name=f'{self.name}_convert', daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = result_queue.get()
+                if item is end_of_data:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            # batches acquired but not converted before the stop
+            while True:
+                try:
+                    item = raw_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, np.ndarray):
+                    self.buffer_pool.release(item)
+
     def start_acquisition(self, mV_range, memsize, posttrigger_size=None, verbose=0):
         """ Start data acquisition of a single data trace
 
@@ -958,6 +1372,9 @@ class M4i(Instrument):
     def _transfer_buffer_numpy(self, memsize: int, numch: int, bytes_per_sample=2) -> np.ndarray:
         """ Transfer buffer to numpy array
 
+        The returned array is leased from buffer_pool and must be released
+        when the data has been converted.
+
         Args:
             memsize (int): number of samples to transfer
             numch (int): number of channels
@@ -975,23 +1392,20 @@ class M4i(Instrument):
         else:
             raise ValueError('bytes_per_sample should be 2 or 4')
 
-        ctype_buffer_type = sample_ctype * memsize * numch
-        data_buffer = (ctype_buffer_type)()
-        data_pointer = ct.cast(data_buffer, ct.c_void_p)
-
-        # data acquisition
-        self._def_transfer64bit(
-            pyspcm.SPCM_BUF_DATA, pyspcm.SPCM_DIR_CARDTOPC, 0, data_pointer, 0, bytes_per_sample * memsize * numch)
-        self.general_command(pyspcm.M2CMD_DATA_STARTDMA | pyspcm.M2CMD_DATA_WAITDMA)
-        if self._last_set_result != pyspcm.ERR_OK:
-            res = self._last_set_result
-            raise Exception(f'Error transferring data: {_errormsg_dict[res]} (0x{res:04x})')
-
-        # convert buffer to numpy array
-        # this does not typecheck with numpy 1.22 should be updated
-        # by someone with access to test on the real data.
-        # for some reason this does type check with 3.12 but not earlier
-        output = np.frombuffer(data_buffer, dtype=sample_ctype) # type: ignore[call-overload,unused-ignore]
+        output = self.buffer_pool.lease(sample_ctype, memsize * numch)
+        try:
+            data_pointer = ct.c_void_p(output.ctypes.data)
+
+            # data acquisition
+            self._def_transfer64bit(
+                pyspcm.SPCM_BUF_DATA, pyspcm.SPCM_DIR_CARDTOPC, 0, data_pointer, 0, bytes_per_sample * memsize * numch)
+            self.general_command(pyspcm.M2CMD_DATA_STARTDMA | pyspcm.M2CMD_DATA_WAITDMA)
+            if self._last_set_result != pyspcm.ERR_OK:
+                res = self._last_set_result
+                raise Exception(f'Error transferring data: {_errormsg_dict[res]} (0x{res:04x})')
+        except BaseException:
+            self.buffer_pool.release(output)
+            raise
 
         return output
 
@@ -1016,7 +1430,10 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(output, mV_range / 1000)
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
@@ -1047,7 +1464,10 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(output, mV_range / 1000)
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
@@ -1073,7 +1493,10 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(output, mV_range / 1000)
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
@@ -1103,8 +1526,11 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(
-            output, mV_range / 1000) / self.box_averages()
+        try:
+            voltages = self.convert_to_voltage(
+                output, mV_range / 1000) / self.box_averages()
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
@@ -1134,7 +1560,10 @@ class M4i(Instrument):
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(output, mV_range / 1000)
+        finally:
+            self.buffer_pool.release(output)
 
         return voltages
 
@@ -1213,11 +1642,14 @@ class M4i(Instrument):
         self.wait_ready()
 
         try:
-            output = self._transfer_buffer_numpy(memsize, numch, bytes_per_sample=4) / nr_averages
+            raw_data = self._transfer_buffer_numpy(memsize, numch, bytes_per_sample=4)
         finally:
             self._stop_acquisition()
 
-        voltages = self.convert_to_voltage(output, mV_range / 1000)
+        try:
+            voltages = self.convert_to_voltage(raw_data, mV_range / 1000 / nr_averages)
+        finally:
+            self.buffer_pool.release(raw_data)
 
         return voltages
 
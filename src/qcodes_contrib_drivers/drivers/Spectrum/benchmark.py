@@ -0,0 +1,113 @@
+"""
+Benchmark of the M4i acquisition methods.
+
+The benchmark measures for every acquisition method the overhead per shot,
+using a small acquisition, and the throughput in MB/s of raw card data,
+using a large acquisition. Without hardware the simulated pyspcm module is
+used, so the numbers show the cost of the driver itself:
+
+    python -m qcodes_contrib_drivers.drivers.Spectrum.benchmark
+"""
+import time
+from typing import Callable, Dict, Sequence
+
+
+def _acquisitions(m4i, memsize: int) -> Dict[str, Callable[[], object]]:
+    """ Return a function performing a single shot for every acquisition method """
+    segment_size = min(memsize, 4096)
+    posttrigger_size = segment_size - 16
+
+    def fifo():
+        m4i.setup_fifo_recording(segment_size)
+        segments_per_block = memsize // segment_size
+        for _ in m4i.fifo_acquisition(segments_per_block=segments_per_block, n_blocks=1):
+            pass
+
+    def blockavg():
+        m4i.data_memory_size(memsize)
+        return m4i.blockavg_hardware_trigger_acquisition(1000, nr_averages=4)
+
+    def reduced():
+        reducer = m4i.segment_reducer(segment_size)
+        return m4i.reduced_multiple_trigger_acquisition(reducer, memsize, segment_size, posttrigger_size)
+
+    def pipelined():
+        return list(m4i.pipelined_multiple_trigger_acquisition(
+            1000, memsize, segment_size, posttrigger_size, n_batches=1))
+
+    return {
+        'single_trigger_acquisition':
+            lambda: m4i.single_trigger_acquisition(1000, memsize, memsize - 16),
+        'single_software_trigger_acquisition':
+            lambda: m4i.single_software_trigger_acquisition(1000, memsize, memsize - 16),
+        'single_software_trigger_acquisition_boxcar':
+            lambda: m4i.single_software_trigger_acquisition_boxcar(1000, memsize, memsize - 16),
+        'gated_trigger_acquisition':
+            lambda: m4i.gated_trigger_acquisition(1000, memsize, 16, memsize - 16),
+        'multiple_trigger_acquisition':
+            lambda: m4i.multiple_trigger_acquisition(1000, memsize, segment_size, posttrigger_size),
+        'blockavg_hardware_trigger_acquisition': blockavg,
+        'reduced_multiple_trigger_acquisition': reduced,
+        'pipelined_multiple_trigger_acquisition': pipelined,
+        'fifo_acquisition': fifo,
+    }
+
+
+def _time_per_shot(shot: Callable[[], object], n_shots: int) -> float:
+    shot()  # warm up buffers and caches
+    t0 = time.perf_counter()
+    for _ in range(n_shots):
+        shot()
+    return (time.perf_counter() - t0) / n_shots
+
+
+def benchmark_acquisitions(m4i, channels: Sequence[int] = (0,), small_memsize: int = 4096,
+                           large_memsize: int = 2**22, n_shots: int = 10) -> Dict[str, Dict[str, float]]:
+    """ Benchmark the acquisition methods of an M4i
+
+    Args:
+        m4i: the digitizer, normally using the simulated pyspcm module
+        channels: channels to enable
+        small_memsize: memory size in samples per channel used to measure
+            the overhead per shot
+        large_memsize: memory size in samples per channel used to measure
+            the throughput
+        n_shots: number of shots per measurement
+    Returns:
+        dictionary with for every method the overhead per shot in s
+        ('overhead') and the throughput of raw data in MB/s ('throughput')
+    """
+    m4i.enable_channels(m4i._channel_mask(channels))
+    m4i.box_averages(2)
+    bytes_per_sample = 2 * len(channels)
+
+    results = {}
+    small = _acquisitions(m4i, small_memsize)
+    large = _acquisitions(m4i, large_memsize)
+    for name in small:
+        overhead = _time_per_shot(small[name], n_shots)
+        duration = _time_per_shot(large[name], n_shots)
+        results[name] = {'overhead': overhead,
+                         'throughput': large_memsize * bytes_per_sample / duration / 1e6}
+    return results
+
+
+def main():
+    from qcodes_contrib_drivers.drivers.Spectrum import pyspcm_sim
+    pyspcm_sim.install()
+    from qcodes_contrib_drivers.drivers.Spectrum.M4i import M4i
+
+    m4i = M4i('m4i_benchmark')
+    try:
+        for channels in [(0,), (0, 1, 2, 3)]:
+            print(f'channels {channels}')
+            results = benchmark_acquisitions(m4i, channels)
+            for name, result in results.items():
+                print(f'  {name:45s} {1e3 * result["overhead"]:8.3f} ms/shot '
+                      f'{result["throughput"]:10.1f} MB/s')
+    finally:
+        m4i.close()
+
+
+if __name__ == '__main__':
+    main()
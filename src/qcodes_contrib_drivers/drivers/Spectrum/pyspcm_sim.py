@@ -0,0 +1,277 @@
+"""
+Simulated replacement for the pyspcm module.
+
+The module implements the parts of the Spectrum driver API that are used by
+the M4i driver: register access, DMA transfer definitions and the M2CMD
+commands for the standard and FIFO acquisition modes. Acquired data is
+synthesized, so the complete acquisition path of the M4i driver can be run
+and profiled without hardware.
+
+Example:
+
+    from qcodes_contrib_drivers.drivers.Spectrum import pyspcm_sim
+    pyspcm_sim.install()
+
+    from qcodes_contrib_drivers.drivers.Spectrum.M4i import M4i
+    m4i = M4i('m4i')
+    card = pyspcm_sim.cards[m4i.hCard]
+    card.waveform = 'ramp'
+"""
+import sys
+import time
+import ctypes
+import itertools
+from ctypes import c_int8, c_int16, c_int32, c_int64, c_uint8, c_uint16, c_uint32, c_uint64, c_void_p, POINTER
+from typing import Dict, Optional
+
+import numpy as np
+
+from .py_header.regs import *  # noqa: F401,F403
+from .py_header.spcerr import *  # noqa: F401,F403
+from .py_header import regs, spcerr
+
+SPCM_DIR_PCTOCARD = 0
+SPCM_DIR_CARDTOPC = 1
+
+SPCM_BUF_DATA = 1000  # main data buffer for acquired or generated samples
+SPCM_BUF_ABA = 2000  # buffer for ABA data, holds the A-DATA (slow samples)
+SPCM_BUF_TIMESTAMP = 3000  # buffer for timestamps
+
+int8 = c_int8
+int16 = c_int16
+int32 = c_int32
+int64 = c_int64
+
+uint8 = c_uint8
+uint16 = c_uint16
+uint32 = c_uint32
+uint64 = c_uint64
+
+drv_handle = c_void_p
+
+# pyspcm exports the ctypes functions, the driver calls pyspcm.byref
+byref = ctypes.byref
+
+_FIFO_MODES = (regs.SPC_REC_FIFO_SINGLE, regs.SPC_REC_FIFO_MULTI, regs.SPC_REC_FIFO_GATE)
+_SUMMING_MODES = (regs.SPC_REC_STD_AVERAGE, regs.SPC_REC_STD_BOXCAR)
+
+
+class SimulatedCard:
+    """ State of a simulated M4i card
+
+    Attributes:
+        registers: register values by register number
+        waveform: 'sine' for a sine per channel that restarts at every
+            segment, or 'ramp' for a running int16 counter over all samples
+        signal_frequencies: frequency of the sine per channel in Hz
+        trigger_rate: if not None, then starting an acquisition takes the
+            time to record all segments at this trigger rate in Hz
+        transfer_rate: if not None, then the DMA transfer is limited to this
+            rate in bytes per second
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.registers: Dict[int, int] = {
+            regs.SPC_PCITYP: regs.TYP_M4IEXPSERIES | 0x4451,
+            regs.SPC_PCIMEMSIZE: 2**32,
+            regs.SPC_PCISAMPLERATE: 500_000_000,
+            regs.SPC_SAMPLERATE: 500_000_000,
+            regs.SPC_MIINST_BITSPERSAMPLE: 14,
+            regs.SPC_MIINST_MAXADCVALUE: 8191,
+            regs.SPC_CHENABLE: regs.CHANNEL0,
+            regs.SPC_CARDMODE: regs.SPC_REC_STD_SINGLE,
+            regs.SPC_MEMSIZE: 4096,
+            regs.SPC_SEGMENTSIZE: 4096,
+            regs.SPC_POSTTRIGGER: 4080,
+            regs.SPC_PRETRIGGER: 16,
+            regs.SPC_AVERAGES: 1,
+            regs.SPC_BOX_AVERAGES: 2,
+            regs.SPC_TIMEOUT: 0,
+        }
+        for channel in range(4):
+            self.registers[getattr(regs, f'SPC_AMP{channel}')] = 1000
+        self.waveform = 'sine'
+        self.signal_frequencies = [10e6, 20e6, 30e6, 40e6]
+        self.trigger_rate: Optional[float] = None
+        self.transfer_rate: Optional[float] = None
+
+        self.running = False
+        self.transfer: Dict[str, int] = {}
+        self.user_len = 0
+        self.user_pos = 0
+        self.stream_offset = 0
+        self.commands = 0
+        self._patterns: Dict[tuple, np.ndarray] = {}
+
+    @property
+    def numch(self) -> int:
+        return bin(self.registers[regs.SPC_CHENABLE]).count('1')
+
+    def get(self, register: int) -> int:
+        if register == regs.SPC_DATA_AVAIL_USER_LEN:
+            return self.user_len
+        if register == regs.SPC_DATA_AVAIL_USER_POS:
+            return self.user_pos
+        if register == regs.SPC_M2STATUS:
+            return regs.M2STAT_DATA_BLOCKREADY if self.user_len else 0
+        return self.registers.get(register, 0)
+
+    def set(self, register: int, value: int) -> int:
+        if register == regs.SPC_M2CMD:
+            return self.command(value)
+        if register == regs.SPC_DATA_AVAIL_CARD_LEN:
+            if value > self.user_len:
+                return spcerr.ERR_VALUE
+            self.user_len -= value
+            self.user_pos = (self.user_pos + value) % self.transfer['length']
+            return spcerr.ERR_OK
+        self.registers[register] = value
+        return spcerr.ERR_OK
+
+    def command(self, value: int) -> int:
+        self.commands += 1
+        mode = self.registers[regs.SPC_CARDMODE]
+        if value & regs.M2CMD_CARD_START:
+            self.running = True
+            self.user_len = self.user_pos = self.stream_offset = 0
+            if self.trigger_rate and mode not in _FIFO_MODES:
+                segment_size = self.registers[regs.SPC_SEGMENTSIZE]
+                n_segments = max(1, self.registers[regs.SPC_MEMSIZE] // max(segment_size, 1))
+                time.sleep(n_segments / self.trigger_rate)
+        if value & regs.M2CMD_DATA_STARTDMA:
+            if mode not in _FIFO_MODES:
+                self._fill(self.transfer['pointer'], self.transfer['length'], 0)
+        if value & regs.M2CMD_DATA_WAITDMA and mode in _FIFO_MODES:
+            if self.user_len + self.transfer['notify'] > self.transfer['length']:
+                return spcerr.ERR_TIMEOUT
+            card_pos = (self.user_pos + self.user_len) % self.transfer['length']
+            self._fill(self.transfer['pointer'] + card_pos, self.transfer['notify'], self.stream_offset)
+            self.user_len += self.transfer['notify']
+        if value & (regs.M2CMD_CARD_STOP | regs.M2CMD_DATA_STOPDMA):
+            self.running = False
+        return spcerr.ERR_OK
+
+    def define_transfer(self, notify: int, pointer: int, length: int) -> int:
+        self.transfer = {'notify': notify, 'pointer': pointer, 'length': length}
+        return spcerr.ERR_OK
+
+    def _sample_dtype(self):
+        if self.registers[regs.SPC_CARDMODE] in _SUMMING_MODES:
+            return np.int32
+        return np.int16
+
+    def _pattern(self, dtype) -> np.ndarray:
+        """ Interleaved samples of one segment """
+        mode = self.registers[regs.SPC_CARDMODE]
+        segment_size = self.registers[regs.SPC_SEGMENTSIZE]
+        if mode == regs.SPC_REC_STD_SINGLE:
+            segment_size = self.registers[regs.SPC_MEMSIZE]
+        channels = [ch for ch in range(4) if self.registers[regs.SPC_CHENABLE] & (1 << ch)]
+        key = (dtype, segment_size, tuple(channels), mode, self.registers[regs.SPC_SAMPLERATE])
+        if key not in self._patterns:
+            t = np.arange(segment_size) / self.registers[regs.SPC_SAMPLERATE]
+            amplitude = self.registers[regs.SPC_MIINST_MAXADCVALUE] / 2
+            if mode == regs.SPC_REC_STD_AVERAGE:
+                amplitude *= self.registers[regs.SPC_AVERAGES]
+            elif mode == regs.SPC_REC_STD_BOXCAR:
+                amplitude *= self.registers[regs.SPC_BOX_AVERAGES]
+            signals = [amplitude * np.sin(2 * np.pi * self.signal_frequencies[ch] * t) for ch in channels]
+            self._patterns[key] = np.round(np.stack(signals, axis=1)).astype(dtype).ravel()
+        return self._patterns[key]
+
+    def _fill(self, pointer: int, nbytes: int, offset: int) -> None:
+        """ Write nbytes of samples at pointer, starting at sample offset in the stream """
+        dtype = self._sample_dtype()
+        itemsize = np.dtype(dtype).itemsize
+        size = nbytes // itemsize
+        if size == 0:
+            return
+        ctype = ctypes.c_int32 if itemsize == 4 else ctypes.c_int16
+        destination = np.ctypeslib.as_array(ctypes.cast(pointer, POINTER(ctype)), shape=(size,))
+
+        if self.waveform == 'ramp':
+            np.add(np.arange(size, dtype=np.int64), offset, out=destination, casting='unsafe')
+        else:
+            pattern = self._pattern(dtype)
+            period = pattern.size
+            start = offset % period
+            first = min(size, period - start)
+            destination[:first] = pattern[start:start + first]
+            rest = destination[first:]
+            repeats = rest.size // period
+            rest[:repeats * period].reshape(repeats, period)[:] = pattern
+            rest[repeats * period:] = pattern[:rest.size - repeats * period]
+        self.stream_offset = offset + size
+
+        if self.transfer_rate:
+            time.sleep(nbytes / self.transfer_rate)
+
+
+cards: Dict[int, SimulatedCard] = {}
+""" Simulated cards by handle """
+
+_handles = itertools.count(1)
+
+
+def spcm_hOpen(name):
+    handle = next(_handles)
+    if isinstance(name, bytes):
+        name = name.decode()
+    cards[handle] = SimulatedCard(str(name))
+    return handle
+
+
+def spcm_vClose(handle):
+    cards.pop(handle, None)
+
+
+def spcm_dwGetErrorInfo_i32(handle, error_register, error_value, text):
+    error_register._obj.value = 0
+    error_value._obj.value = 0
+    if text is not None:
+        ctypes.memset(text, 0, ERRORTEXTLEN)  # noqa: F405
+    return spcerr.ERR_OK
+
+
+def spcm_dwGetParam_i32(handle, register, value):
+    value._obj.value = cards[handle].get(register)
+    return spcerr.ERR_OK
+
+
+spcm_dwGetParam_i64 = spcm_dwGetParam_i32
+
+
+def spcm_dwSetParam_i32(handle, register, value):
+    return cards[handle].set(register, int(value))
+
+
+spcm_dwSetParam_i64 = spcm_dwSetParam_i32
+
+
+def spcm_dwSetParam_i64m(handle, register, value_high, value_low):
+    return cards[handle].set(register, (int(value_high) << 32) | (int(value_low) & 0xFFFFFFFF))
+
+
+def spcm_dwDefTransfer_i64(handle, buffer_type, direction, notify, pointer, offset, length):
+    if isinstance(pointer, c_void_p):
+        pointer = pointer.value
+    return cards[handle].define_transfer(int(notify), int(pointer) + int(offset), int(length))
+
+
+def spcm_dwInvalidateBuf(handle, buffer_type):
+    cards[handle].transfer = {}
+    return spcerr.ERR_OK
+
+
+def spcm_dwGetContBuf_i64(handle, buffer_type, data, length):
+    length._obj.value = 0
+    return spcerr.ERR_OK
+
+
+def install():
+    """ Register this module as pyspcm, so the M4i driver uses the simulation
+
+    Must be called before the M4i driver is imported.
+    """
+    sys.modules['pyspcm'] = sys.modules[__name__]
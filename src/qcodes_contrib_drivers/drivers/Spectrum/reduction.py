@@ -0,0 +1,125 @@
+"""
+Reduction of multi-record digitizer data.
+
+Multi-record acquisitions with the M4i return the samples of all segments
+and channels interleaved in one buffer. The SegmentReducer reduces this
+data in chunks of segments to running averages, integrals over windows,
+demodulated IQ values and histograms, so only the reduced data has to be
+kept.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def segments_view(raw_data: np.ndarray, numch: int, segment_size: int) -> np.ndarray:
+    """ Return a (segments, channels, samples) view on interleaved data
+
+    Args:
+        raw_data: interleaved samples as returned by the card
+        numch: number of enabled channels
+        segment_size: number of samples per channel in a segment
+    Returns:
+        view on raw_data, no data is copied
+    """
+    return raw_data.reshape(-1, segment_size, numch).transpose(0, 2, 1)
+
+
+class SegmentReducer:
+    """ Reduce multi-record data per segment and channel
+
+    The reducer is fed with raw ADC data by update(). The data is processed
+    in chunks of chunk_size segments; only one chunk is converted to
+    voltages at a time.
+
+    Args:
+        channel_scale: conversion factor from ADC value to V per channel
+        segment_size: number of samples per channel in a segment
+        sample_rate: sample rate in Hz
+        windows: list of (start, stop) sample indices. For every window the
+            integral of the signal in Vs is computed per segment and channel.
+        demodulation_frequency: if not None, then every segment is
+            demodulated with this frequency in Hz
+        histogram_bins: if not None, then the integrals of every window are
+            histogrammed with these bin edges
+        chunk_size: number of segments processed at once
+
+    Example:
+        reducer = m4i.segment_reducer(seg_size, windows=[(100, 900)],
+                                      demodulation_frequency=50e6)
+        m4i.reduced_multiple_trigger_acquisition(reducer, memsize, seg_size, posttrigger_size)
+        iq = reducer.demodulated
+    """
+
+    def __init__(self, channel_scale: Sequence[float], segment_size: int,
+                 sample_rate: float,
+                 windows: Optional[Sequence[Tuple[int, int]]] = None,
+                 demodulation_frequency: Optional[float] = None,
+                 histogram_bins: Optional[np.ndarray] = None,
+                 chunk_size: int = 256):
+        self.channel_scale = np.asarray(channel_scale, dtype=np.float64)
+        self.numch = len(self.channel_scale)
+        self.segment_size = segment_size
+        self.sample_rate = sample_rate
+        self.windows = list(windows) if windows is not None else []
+        self.demodulation_frequency = demodulation_frequency
+        self.histogram_bins = histogram_bins
+        self.chunk_size = chunk_size
+
+        if histogram_bins is not None and not self.windows:
+            raise ValueError('histogram_bins requires integration windows')
+
+        if demodulation_frequency is not None:
+            t = np.arange(segment_size) / sample_rate
+            self._reference = np.exp(-2j * np.pi * demodulation_frequency * t) * (2 / segment_size)
+        self.reset()
+
+    def reset(self) -> None:
+        """ Discard all reduced data """
+        self.n_segments = 0
+        self._sum = np.zeros((self.numch, self.segment_size))
+        self._integrals: List[np.ndarray] = []
+        self._demodulated: List[np.ndarray] = []
+        if self.histogram_bins is not None:
+            self.histogram = np.zeros((len(self.windows), self.numch, len(self.histogram_bins) - 1),
+                                      dtype=np.int64)
+
+    def update(self, raw_data: np.ndarray) -> None:
+        """ Add the segments in a buffer of interleaved raw data """
+        segments = segments_view(raw_data, self.numch, self.segment_size)
+        scale = self.channel_scale[:, np.newaxis]
+        for start in range(0, segments.shape[0], self.chunk_size):
+            chunk = segments[start:start + self.chunk_size] * scale
+            self._sum += chunk.sum(axis=0)
+            self.n_segments += chunk.shape[0]
+
+            if self.windows:
+                integrals = np.stack([chunk[..., a:b].sum(axis=-1) for a, b in self.windows],
+                                     axis=1) / self.sample_rate
+                self._integrals.append(integrals)
+                if self.histogram_bins is not None:
+                    for w in range(len(self.windows)):
+                        for ch in range(self.numch):
+                            self.histogram[w, ch] += np.histogram(integrals[:, w, ch],
+                                                                  bins=self.histogram_bins)[0]
+            if self.demodulation_frequency is not None:
+                self._demodulated.append(chunk @ self._reference)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """ Average over all segments in V with shape (channels, samples) """
+        return self._sum / max(self.n_segments, 1)
+
+    @property
+    def integrals(self) -> np.ndarray:
+        """ Integrals in Vs with shape (segments, windows, channels) """
+        if not self._integrals:
+            return np.zeros((0, len(self.windows), self.numch))
+        return np.concatenate(self._integrals)
+
+    @property
+    def demodulated(self) -> np.ndarray:
+        """ Complex amplitude in V with shape (segments, channels) """
+        if not self._demodulated:
+            return np.zeros((0, self.numch), dtype=np.complex128)
+        return np.concatenate(self._demodulated)
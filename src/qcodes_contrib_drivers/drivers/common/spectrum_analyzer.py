@@ -0,0 +1,474 @@
+"""
+Shared functionality for the spectrum analyzer drivers.
+
+The TraceReader fetches traces as IEEE 488.2 definite length blocks of
+32 bit floats, which is about three times less data than the ASCII format
+and is converted without parsing text. Instruments that do not support the
+binary format fall back to ASCII transfers.
+
+The SpectrumAnalyzerMixin provides the sweep parameters and keeps the sweep
+geometry in a local cache, which is only invalidated by the setters, so
+fetching a FrequencySweep trace does not query the sweep configuration.
+"""
+import functools
+import logging
+import socket
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+from pyvisa.errors import VisaIOError
+from qcodes.instrument import IPInstrument, VisaInstrument
+from qcodes.parameters import ArrayParameter, ParamRawDataType
+
+log = logging.getLogger(__name__)
+
+
+def _recv_exactly(sock: socket.socket, nbytes: int) -> bytearray:
+    """ Receive exactly nbytes from a socket """
+    data = bytearray(nbytes)
+    view = memoryview(data)
+    received = 0
+    while received < nbytes:
+        n = sock.recv_into(view[received:], nbytes - received)
+        if n == 0:
+            raise ConnectionError('Connection closed while reading data')
+        received += n
+    return data
+
+
+def _recv_line(sock: socket.socket, first: bytes = b'') -> bytes:
+    """ Receive bytes from a socket up to and including a newline """
+    chunks = [first]
+    while not chunks[-1].endswith(b'\n'):
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('Connection closed while reading data')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def read_response(sock: socket.socket) -> Tuple[bool, Union[bytes, bytearray]]:
+    """ Read a response from a socket
+
+    If the response is an IEEE 488.2 definite length block, then the
+    payload is read with a single preallocated buffer and the trailing
+    newline is consumed. Otherwise the response is read up to the newline.
+
+    Returns:
+        whether the response is a block, and the payload of the block or the
+        complete response including the newline
+    """
+    start = _recv_exactly(sock, 1)
+    if start != b'#':
+        return False, _recv_line(sock, bytes(start))
+    n_digits = int(_recv_exactly(sock, 1))
+    if n_digits == 0:
+        # indefinite length block, terminated by a newline
+        return True, _recv_line(sock)[:-1]
+    nbytes = int(_recv_exactly(sock, n_digits))
+    payload = _recv_exactly(sock, nbytes)
+    _recv_exactly(sock, 1)
+    return True, payload
+
+
+def read_blocks(recv: Callable[[int], Union[bytes, bytearray]],
+                count: int) -> List[Union[bytes, bytearray]]:
+    """ Read the definite length blocks of a response to several queries
+
+    The blocks of a response message are separated by semicolons and the
+    message is terminated by a newline.
+
+    Args:
+        recv: receives exactly the given number of bytes
+        count: number of blocks in the response
+    Returns:
+        the payload of every block
+    """
+    blocks = []
+    for i in range(count):
+        start = bytes(recv(1))
+        if start != b'#':
+            raise ValueError(f'expected a binary block, got {start!r}')
+        n_digits = int(recv(1))
+        if n_digits == 0:
+            raise ValueError('indefinite length blocks cannot be followed by '
+                             'another response')
+        blocks.append(recv(int(recv(n_digits))))
+        separator = bytes(recv(1))
+        expected = b'\n' if i == count - 1 else b';'
+        if separator != expected:
+            raise ValueError(f'expected {expected!r} after block {i + 1}, '
+                             f'got {separator!r}')
+    return blocks
+
+
+def parse_ascii_trace(response: Union[str, bytes, bytearray],
+                      dtype: npt.DTypeLike = np.float32) -> np.ndarray:
+    """ Convert a comma separated trace, optionally in an IEEE block, to an array """
+    if isinstance(response, (bytes, bytearray)):
+        response = response.decode()
+    response = response.strip()
+    if response.startswith('#'):
+        n_digits = int(response[1])
+        response = response[2 + n_digits:]
+    return np.array(response.split(','), dtype=dtype)
+
+
+def split_traces(data: np.ndarray, fields: Sequence[Tuple[str, npt.DTypeLike]],
+                 npts: int) -> np.ndarray:
+    """ Split concatenated traces into a structured array
+
+    Args:
+        data: the traces one after another. Complex traces are stored as
+            interleaved real and imaginary parts.
+        fields: name and real or complex dtype of every trace
+        npts: number of points per trace
+    Returns:
+        structured array of length npts with a field per trace
+    """
+    traces = np.empty(npts, dtype=list(fields))
+    offset = 0
+    for name, dtype in fields:
+        is_complex = np.issubdtype(dtype, np.complexfloating)
+        size = 2 * npts if is_complex else npts
+        trace = data[offset:offset + size]
+        if trace.size != size:
+            raise ValueError(f'received {data.size} values, which is too few for '
+                             f'{len(fields)} traces of {npts} points')
+        traces[name] = trace.view(np.result_type(trace.dtype, 1j)) if is_complex else trace
+        offset += size
+    if offset != data.size:
+        raise ValueError(f'received {data.size} values, expected {offset}')
+    return traces
+
+
+class TraceReader:
+    """
+    Read traces of a spectrum analyzer in binary format with ASCII fallback
+
+    The format commands are sent in the same message as the trace query, so
+    the transfer format is correct even after the instrument was reset.
+
+    Args:
+        instrument: VISA or IP instrument to read the traces from
+        binary: use the binary REAL format. If a binary transfer fails,
+            the reader falls back to ASCII for all following transfers.
+        little_endian: byte order of the binary data
+        binary_format: command selecting the binary format. By default
+            'FORM REAL,32' or 'FORM REAL,64', depending on datatype, with the
+            byte order selected by FORM:BORD.
+        ascii_format: command selecting the ASCII format
+        datatype: 'f' to transfer 32 bit floats, 'd' for 64 bit floats
+    """
+
+    drain_time = 0.1
+    """ Time in s without data after which the rest of a failed response
+    of an IP instrument is considered discarded """
+
+    def __init__(self, instrument: Union[VisaInstrument, IPInstrument],
+                 binary: bool = True, little_endian: bool = True,
+                 binary_format: Optional[str] = None,
+                 ascii_format: str = 'FORM ASC', datatype: str = 'f'):
+        self._instrument = instrument
+        self.binary = binary
+        self.little_endian = little_endian
+        self.datatype = datatype
+        self.dtype = np.dtype(datatype)
+        if binary_format is None:
+            binary_format = (f'FORM REAL,{8 * self.dtype.itemsize};:FORM:BORD '
+                             + ('SWAP' if little_endian else 'NORM'))
+        self.binary_format = binary_format
+        self.ascii_format = ascii_format
+
+    def read(self, query: str) -> np.ndarray:
+        """ Query a trace and return it as array of the reader's datatype """
+        if self.binary:
+            try:
+                return self._read_binary(query)
+            except (ValueError, OSError, VisaIOError) as ex:
+                log.warning(f'{self._instrument.name}: binary trace transfer failed ({ex}), '
+                            'falling back to ASCII')
+                self.binary = False
+                self._clear()
+        return self._read_ascii(query)
+
+    def read_many(self, queries: Sequence[str]) -> List[np.ndarray]:
+        """ Query several traces in a single message and response
+
+        The instrument answers all queries in one response message, so the
+        traces are fetched with a single round trip.
+        """
+        if self.binary:
+            try:
+                return self._read_many_binary(queries)
+            except (ValueError, OSError, VisaIOError) as ex:
+                log.warning(f'{self._instrument.name}: binary trace transfer failed ({ex}), '
+                            'falling back to ASCII')
+                self.binary = False
+                self._clear()
+        return self._read_many_ascii(queries)
+
+    def _read_binary(self, query: str) -> np.ndarray:
+        message = f'{self.binary_format};:{query}'
+        if isinstance(self._instrument, VisaInstrument):
+            return self._instrument.visa_handle.query_binary_values(
+                message, datatype=self.datatype, is_big_endian=not self.little_endian,
+                container=np.array)
+        self._instrument._send(message)
+        is_block, payload = read_response(self._instrument._socket)
+        if not is_block:
+            raise ValueError(f'expected a binary block, got {bytes(payload[:20])!r}')
+        dtype = self.dtype.newbyteorder('<' if self.little_endian else '>')
+        if len(payload) % dtype.itemsize:
+            raise ValueError(f'binary block of {len(payload)} bytes is not a {self.dtype} array')
+        return np.frombuffer(payload, dtype=dtype).astype(self.dtype, copy=False)
+
+    def _read_ascii(self, query: str) -> np.ndarray:
+        message = f'{self.ascii_format};:{query}'
+        if isinstance(self._instrument, VisaInstrument):
+            return parse_ascii_trace(self._instrument.ask_raw(message), self.dtype)
+        self._instrument._send(message)
+        return parse_ascii_trace(read_response(self._instrument._socket)[1], self.dtype)
+
+    def _read_many_binary(self, queries: Sequence[str]) -> List[np.ndarray]:
+        message = ';:'.join([self.binary_format, *queries])
+        recv: Callable[[int], Union[bytes, bytearray]]
+        if isinstance(self._instrument, VisaInstrument):
+            self._instrument.write_raw(message)
+            recv = self._instrument.visa_handle.read_bytes
+        else:
+            self._instrument._send(message)
+            recv = functools.partial(_recv_exactly, self._instrument._socket)
+        dtype = self.dtype.newbyteorder('<' if self.little_endian else '>')
+        traces = []
+        for payload in read_blocks(recv, len(queries)):
+            if len(payload) % dtype.itemsize:
+                raise ValueError(f'binary block of {len(payload)} bytes is not a {self.dtype} array')
+            traces.append(np.frombuffer(payload, dtype=dtype).astype(self.dtype, copy=False))
+        return traces
+
+    def _read_many_ascii(self, queries: Sequence[str]) -> List[np.ndarray]:
+        message = ';:'.join([self.ascii_format, *queries])
+        if isinstance(self._instrument, VisaInstrument):
+            response: Union[str, bytes, bytearray] = self._instrument.ask_raw(message)
+        else:
+            self._instrument._send(message)
+            response = read_response(self._instrument._socket)[1]
+        if isinstance(response, (bytes, bytearray)):
+            response = response.decode()
+        responses = response.strip().split(';')
+        if len(responses) != len(queries):
+            raise ValueError(f'received {len(responses)} responses to {len(queries)} queries')
+        return [parse_ascii_trace(trace, self.dtype) for trace in responses]
+
+    def _clear(self) -> None:
+        """ Discard a partially read response after a failed transfer """
+        if isinstance(self._instrument, VisaInstrument):
+            self._instrument.device_clear()
+            return
+        sock = self._instrument._socket
+        if sock is None:
+            return
+        timeout = sock.gettimeout()
+        try:
+            sock.settimeout(self.drain_time)
+            try:
+                while sock.recv(65536):
+                    pass
+            finally:
+                sock.settimeout(timeout)
+        except socket.timeout:
+            # nothing received for drain_time, the response is discarded
+            return
+        except OSError:
+            pass
+        # the connection has been closed or is broken
+        log.warning(f'{self._instrument.name}: reconnecting after failed trace transfer')
+        self._instrument._connect()
+
+
+class SpectrumAnalyzerMixin:
+    """
+    Sweep configuration of a spectrum analyzer
+
+    Mixin for VisaInstrument and IPInstrument drivers. It adds the start,
+    stop, center, span and npts parameters and caches the sweep geometry
+    and the frequency setpoints until one of them is set.
+    """
+
+    _npts_command = 'SENS:SWE:POIN'
+    """ Command to set and get the number of points in a sweep """
+
+    _sweep_geometry: Optional[Tuple[float, float, int]] = None
+    _sweep_setpoints: Optional[np.ndarray] = None
+
+    def _add_sweep_parameters(self) -> None:
+        self.add_parameter(name='start',
+                           get_cmd='SENS:FREQ:START?',
+                           set_cmd=self._set_start,
+                           get_parser=float)
+        self.add_parameter(name='stop',
+                           get_cmd='SENS:FREQ:STOP?',
+                           set_cmd=self._set_stop,
+                           get_parser=float)
+        self.add_parameter(name='center',
+                           get_cmd='SENS:FREQ:CENT?',
+                           set_cmd=self._set_center,
+                           get_parser=float)
+        self.add_parameter(name='span',
+                           get_cmd='SENS:FREQ:SPAN?',
+                           set_cmd=self._set_span,
+                           get_parser=float)
+        self.add_parameter(name='npts',
+                           get_cmd=f'{self._npts_command}?',
+                           set_cmd=self._set_npts,
+                           get_parser=int)
+
+    def _send_command(self, cmd: str) -> None:
+        """ Send a command without waiting for a response """
+        if isinstance(self, IPInstrument):
+            self._send(cmd)
+        else:
+            self.write(cmd)
+
+    def sweep_geometry(self) -> Tuple[float, float, int]:
+        """ Return start, stop and number of points of the sweep
+
+        The values are queried once and cached until a sweep parameter is set.
+        """
+        if self._sweep_geometry is None:
+            self._sweep_geometry = (self.start(), self.stop(), self.npts())
+        return self._sweep_geometry
+
+    def sweep_setpoints(self) -> np.ndarray:
+        """ Return the read-only array of frequency setpoints of the sweep """
+        if self._sweep_setpoints is None:
+            start, stop, npts = self.sweep_geometry()
+            setpoints = np.linspace(int(start), int(stop), num=npts)
+            setpoints.flags.writeable = False
+            self._sweep_setpoints = setpoints
+        return self._sweep_setpoints
+
+    def _invalidate_sweep(self) -> None:
+        self._sweep_geometry = None
+        self._sweep_setpoints = None
+
+    def _set_start(self, val: float) -> None:
+        self._invalidate_sweep()
+        self._send_command('SENS:FREQ:START {:.7f}'.format(val))
+        stop = self.stop()
+        if val >= stop:
+            raise ValueError(
+                "Stop frequency must be larger than start frequency.")
+        # we get start as the instrument may not be able to set it to the exact value provided
+        start = self.start()
+        if val != start:
+            log.warning(
+                "Could not set start to {} setting it to {}".format(val, start))
+
+    def _set_stop(self, val: float) -> None:
+        self._invalidate_sweep()
+        start = self.start()
+        if val <= start:
+            raise ValueError(
+                "Stop frequency must be larger than start frequency.")
+        self._send_command('SENS:FREQ:STOP {:.7f}'.format(val))
+        # we get stop as the instrument may not be able to set it to the exact value provided
+        stop = self.stop()
+        if val != stop:
+            log.warning(
+                "Could not set stop to {} setting it to {}".format(val, stop))
+
+    def _set_npts(self, val: int) -> None:
+        self._invalidate_sweep()
+        self._send_command('{} {:.7f}'.format(self._npts_command, val))
+
+    def _set_span(self, val: float) -> None:
+        self._invalidate_sweep()
+        self._send_command('SENS:FREQ:SPAN {:.7f}'.format(val))
+
+    def _set_center(self, val: float) -> None:
+        self._invalidate_sweep()
+        self._send_command('SENS:FREQ:CENT {:.7f}'.format(val))
+
+
+class FrequencySweep(ArrayParameter):
+    """
+    Hardware controlled parameter for a spectrum analyzer trace
+
+    The shape and setpoints follow the cached sweep geometry of the
+    instrument, so getting the trace does not query the sweep configuration.
+
+    Args:
+        name: parameter name
+        instrument: instrument the parameter belongs to
+        channel: trace number
+        query: query returning the trace data
+
+    Methods:
+          get(): executes a sweep and returns the trace
+    """
+
+    def __init__(
+        self,
+        name: str,
+        instrument: SpectrumAnalyzerMixin,
+        channel: int = 1,
+        query: str = 'TRAC:DATA? TRACE1',
+        **kwargs: Any,
+    ) -> None:
+        start, stop, npts = instrument.sweep_geometry()
+        super().__init__(
+            name,
+            shape=(npts,),
+            instrument=instrument,
+            unit="dBm",
+            label=f"{instrument.short_name} magnitude",
+            setpoint_units=("Hz",),
+            setpoint_labels=(f"{instrument.short_name} frequency",),
+            setpoint_names=(f"{instrument.short_name}_frequency",),
+            **kwargs,
+        )
+        self._instrument_channel = channel
+        self._instrument = instrument
+        self._query = query
+        self._geometry: Optional[Tuple[float, float, int]] = None
+        self.update_sweep()
+
+    def update_sweep(self) -> None:
+        """ Update shape and setpoints if the sweep geometry has changed """
+        geometry = self._instrument.sweep_geometry()
+        if geometry != self._geometry:
+            self.setpoints = (self._instrument.sweep_setpoints(),)
+            self.shape = (geometry[2],)
+            self._geometry = geometry
+
+    def set_sweep(self, start: float, stop: float, npts: int) -> None:
+        """
+        sets the shapes and setpoint arrays of the parameter to
+        correspond with the sweep
+
+        Args:
+            start: Starting frequency of the sweep
+            stop: Stopping frequency of the sweep
+            npts: Number of points in the sweep
+
+        """
+        setpoints = np.linspace(int(start), int(stop), num=npts)
+        setpoints.flags.writeable = False
+        self.setpoints = (setpoints,)
+        self.shape = (npts,)
+        self._geometry = (start, stop, npts)
+
+    def get_raw(self) -> ParamRawDataType:
+        self.update_sweep()
+        return self._get_sweep_data()
+
+    def _get_sweep_data(self) -> np.ndarray:
+        instrument = self._instrument
+        instrument._send_command("INIT:CONT OFF")
+        instrument._send_command("INIT; *WAI")
+        trace = instrument.trace_reader.read(self._query)
+        instrument._send_command("INIT:CONT ON")
+        return trace
@@ -0,0 +1,262 @@
+import json
+import os
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from qcodes_contrib_drivers.drivers.BlueFors.BlueFors import (
+    BlueFors, _LogIndex, _LogTail)
+
+DAY = datetime(2020, 9, 18)
+
+
+def log_line(second, value):
+    return '18-09-20,12:{:02d}:{:02d},{}\n'.format(second // 60, second % 60,
+                                                   value)
+
+
+def write_log(path, seconds, mode='w'):
+    with open(path, mode) as f:
+        f.writelines(log_line(s, float(s)) for s in seconds)
+
+
+def make_index(tmp_path):
+    return _LogIndex(str(tmp_path / 'log.log'), str(tmp_path / 'index' / 'log'),
+                     lambda fields: [float(fields[2])], 1)
+
+
+def index_files(tmp_path):
+    return sorted(os.listdir(tmp_path / 'index'))
+
+
+@pytest.fixture
+def bluefors(tmp_path):
+    folder = tmp_path / 'logs' / '20-09-18'
+    folder.mkdir(parents=True)
+    write_log(folder / 'CH6 T 20-09-18.log', range(60))
+    instrument = BlueFors('bf', str(tmp_path / 'logs'),
+                          channel_vacuum_can=1, channel_pumping_line=2,
+                          channel_compressor_outlet=3, channel_compressor_inlet=4,
+                          channel_mixture_tank=5, channel_venting_line=6,
+                          channel_50k_plate=1, channel_4k_plate=2,
+                          channel_still=6, channel_mixing_chamber=5,
+                          index_folder_path=str(tmp_path / 'index'))
+    yield instrument
+    instrument.close()
+
+
+def set_today(mocker, day):
+    today = mocker.patch('qcodes_contrib_drivers.drivers.BlueFors.BlueFors.date')
+    today.today.return_value = day
+
+
+# -----------------------------------------------------------------------
+# _LogTail
+# -----------------------------------------------------------------------
+
+def test_tail_reads_last_lines_only(tmp_path, mocker):
+    mocker.patch.object(_LogTail, 'tail_size', 100)
+    write_log(tmp_path / 'log.log', range(60))
+    tail = _LogTail(str(tmp_path / 'log.log'))
+    # -----------------------------------------------------------------------
+    lines = tail.read_lines()
+    # -----------------------------------------------------------------------
+    # 100 bytes hold 4 lines of 23 bytes and the end of an incomplete line,
+    # which is skipped
+    assert lines == [log_line(s, float(s)).strip() for s in range(56, 60)]
+
+
+def test_tail_reads_appended_lines(tmp_path):
+    write_log(tmp_path / 'log.log', range(3))
+    tail = _LogTail(str(tmp_path / 'log.log'))
+    tail.read_lines()
+    write_log(tmp_path / 'log.log', range(3, 5), mode='a')
+    # -----------------------------------------------------------------------
+    lines = tail.read_lines()
+    # -----------------------------------------------------------------------
+    assert lines == [log_line(3, 3.0).strip(), log_line(4, 4.0).strip()]
+    assert tail.read_lines() == []
+
+
+def test_tail_leaves_partial_last_line(tmp_path):
+    write_log(tmp_path / 'log.log', range(3))
+    tail = _LogTail(str(tmp_path / 'log.log'))
+    tail.read_lines()
+    line = log_line(3, 3.0)
+    with open(tmp_path / 'log.log', 'a') as f:
+        f.write(line[:10])
+    # -----------------------------------------------------------------------
+    assert tail.read_lines() == []
+    with open(tmp_path / 'log.log', 'a') as f:
+        f.write(line[10:])
+    # -----------------------------------------------------------------------
+    assert tail.read_lines() == [line.strip()]
+
+
+def test_tail_of_replaced_file(tmp_path):
+    write_log(tmp_path / 'log.log', range(10))
+    tail = _LogTail(str(tmp_path / 'log.log'))
+    tail.read_lines()
+    write_log(tmp_path / 'log.log', range(40, 42))
+    # -----------------------------------------------------------------------
+    lines = tail.read_lines()
+    # -----------------------------------------------------------------------
+    assert lines == [log_line(40, 40.0).strip(), log_line(41, 41.0).strip()]
+
+
+def test_get_temperature_between_appends(bluefors, tmp_path, mocker):
+    set_today(mocker, date(2020, 9, 18))
+    log = tmp_path / 'logs' / '20-09-18' / 'CH6 T 20-09-18.log'
+    assert bluefors.temperature_still() == 59
+    write_log(log, [60], mode='a')
+    # -----------------------------------------------------------------------
+    assert bluefors.temperature_still() == 60
+    write_log(log, [61], mode='a')
+    # -----------------------------------------------------------------------
+    assert bluefors.temperature_still() == 61
+
+
+def test_get_temperature_day_rollover(bluefors, tmp_path, mocker):
+    set_today(mocker, date(2020, 9, 18))
+    assert bluefors.temperature_still() == 59
+    folder = tmp_path / 'logs' / '20-09-19'
+    folder.mkdir()
+    with open(folder / 'CH6 T 20-09-19.log', 'w') as f:
+        f.write('19-09-20,00:00:01,1.5\n')
+    set_today(mocker, date(2020, 9, 19))
+    # -----------------------------------------------------------------------
+    temperature = bluefors.temperature_still()
+    # -----------------------------------------------------------------------
+    assert temperature == 1.5
+    assert bluefors._log_tails['T6'].file_path == str(folder / 'CH6 T 20-09-19.log')
+
+
+# -----------------------------------------------------------------------
+# _LogIndex
+# -----------------------------------------------------------------------
+
+def test_index_is_persistent(tmp_path, mocker):
+    write_log(tmp_path / 'log.log', range(10))
+    make_index(tmp_path).load()
+    index = make_index(tmp_path)
+    parse = mocker.spy(index, '_parse')
+    # -----------------------------------------------------------------------
+    data = index.load()
+    # -----------------------------------------------------------------------
+    parse.assert_not_called()
+    assert list(data['values'][:, 0]) == list(range(10))
+    assert isinstance(data, np.memmap)
+
+
+def test_appended_lines_are_parsed_only(tmp_path, mocker):
+    write_log(tmp_path / 'log.log', range(10))
+    index = make_index(tmp_path)
+    index.load()
+    offset = os.path.getsize(tmp_path / 'log.log')
+    write_log(tmp_path / 'log.log', range(10, 12), mode='a')
+    parse = mocker.spy(index, '_parse')
+    # -----------------------------------------------------------------------
+    data = index.load()
+    # -----------------------------------------------------------------------
+    parse.assert_called_once_with(offset)
+    assert list(data['values'][:, 0]) == list(range(12))
+
+
+def test_index_is_written_when_doubled(tmp_path, mocker):
+    write_log(tmp_path / 'log.log', range(10))
+    index = make_index(tmp_path)
+    index.load()
+    write = mocker.spy(index, '_write_index')
+    # -----------------------------------------------------------------------
+    for s in range(10, 20):
+        write_log(tmp_path / 'log.log', [s], mode='a')
+        index.load()
+    # -----------------------------------------------------------------------
+    assert write.call_count == 1
+    assert len(make_index(tmp_path).load()) == 20
+
+
+def test_lines_after_last_write_are_parsed_by_next_index(tmp_path):
+    write_log(tmp_path / 'log.log', range(10))
+    make_index(tmp_path).load()
+    write_log(tmp_path / 'log.log', range(10, 12), mode='a')
+    make_index(tmp_path).load()
+    # -----------------------------------------------------------------------
+    data = make_index(tmp_path).load()
+    # -----------------------------------------------------------------------
+    assert list(data['values'][:, 0]) == list(range(12))
+
+
+def test_interrupted_write_keeps_previous_index(tmp_path, mocker):
+    write_log(tmp_path / 'log.log', range(10))
+    make_index(tmp_path).load()
+    write_log(tmp_path / 'log.log', range(10, 30), mode='a')
+    index = make_index(tmp_path)
+    mocker.patch('json.dump', side_effect=OSError('disk full'))
+    # -----------------------------------------------------------------------
+    data = index.load()
+    # -----------------------------------------------------------------------
+    assert len(data) == 30
+    mocker.stopall()
+    with open(tmp_path / 'index' / 'log.json') as f:
+        assert json.load(f)['size'] < os.path.getsize(tmp_path / 'log.log')
+    assert len(make_index(tmp_path).load()) == 30
+
+
+def test_shrunk_log_is_indexed_again(tmp_path):
+    write_log(tmp_path / 'log.log', range(10))
+    index = make_index(tmp_path)
+    index.load()
+    write_log(tmp_path / 'log.log', range(40, 43))
+    # -----------------------------------------------------------------------
+    data = index.load()
+    # -----------------------------------------------------------------------
+    assert list(data['values'][:, 0]) == [40, 41, 42]
+    assert list(make_index(tmp_path).load()['values'][:, 0]) == [40, 41, 42]
+
+
+def test_indexes_keep_files_of_each_other(tmp_path):
+    write_log(tmp_path / 'log.log', range(10))
+    first = make_index(tmp_path)
+    first.load()
+    second = make_index(tmp_path)
+    write_log(tmp_path / 'log.log', range(10, 30), mode='a')
+    second.load()
+    # -----------------------------------------------------------------------
+    write_log(tmp_path / 'log.log', range(30, 40), mode='a')
+    first.load()
+    # -----------------------------------------------------------------------
+    assert len([name for name in index_files(tmp_path)
+                if name.endswith('.npy')]) == 2
+    assert len(make_index(tmp_path).load()) == 40
+
+
+# -----------------------------------------------------------------------
+# history
+# -----------------------------------------------------------------------
+
+def test_history(bluefors):
+    times, values = bluefors.history('temperature_still',
+                                     DAY.replace(hour=12, second=10),
+                                     DAY.replace(hour=12, second=19))
+    assert list(values) == list(range(10, 20))
+    assert times[0] == np.datetime64('2020-09-18T12:00:10')
+
+
+def test_history_downsampling(bluefors):
+    times, values = bluefors.history('temperature_still', DAY,
+                                     DAY.replace(hour=13), max_points=7)
+    # 60 values are averaged in bins of 9 values
+    assert len(values) == 7
+    assert values[0] == 4
+    assert values[-1] == np.mean(range(54, 60))
+    assert times[0] == np.datetime64('2020-09-18T12:00:04')
+
+
+def test_history_missing_day(bluefors):
+    times, values = bluefors.history('temperature_still',
+                                     datetime(2020, 9, 17),
+                                     datetime(2020, 9, 17, 23))
+    assert len(times) == 0
+    assert len(values) == 0
@@ -0,0 +1,146 @@
+'''
+Test scheduling of the AWG upload thread:
+* priority ordering of tasks
+* submission order of tasks with equal priority
+* tasks with priority Task.LAST
+* look-ahead conversion of the next uploads
+* cancellation of uploads of released waveforms
+'''
+from qcodes_contrib_drivers.drivers.Keysight.SD_common.memory_manager import MemoryManager
+from qcodes_contrib_drivers.drivers.Keysight.SD_common.waveform_cache import WaveformCache
+from qcodes_contrib_drivers.drivers.Keysight.SD_common.upload_queue import (
+    Task, _StopTask, TaskQueue, Conversion, cancel_released_upload)
+
+import unittest
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+
+class _RecordingPool:
+    ''' Executor that records the submitted conversions '''
+    def __init__(self):
+        self.submitted = []
+        self._executor = ThreadPoolExecutor(1)
+
+    def submit(self, f, *args):
+        self.submitted.append(args[0])
+        return self._executor.submit(f, *args)
+
+
+class TestTaskScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.executed = []
+        self.uploader = SimpleNamespace(name='awg', _start_time=None,
+                                        record=self.executed.append)
+        self.queue = TaskQueue()
+
+    def submit(self, label, priority):
+        task = Task(lambda uploader: uploader.record(label), self.uploader)
+        self.queue.submit(task, priority)
+        return task
+
+    def run_tasks(self):
+        self.queue.submit(_StopTask(self.uploader), Task.LAST)
+        self.queue.run()
+
+    def test_priority(self):
+        self.submit('low', -1)
+        self.submit('default', 0)
+        self.submit('high', 10)
+
+        self.run_tasks()
+
+        self.assertEqual(self.executed, ['high', 'default', 'low'])
+
+    def test_equal_priority_in_submission_order(self):
+        for i in range(100):
+            self.submit(i, 0)
+
+        self.run_tasks()
+
+        self.assertEqual(self.executed, list(range(100)))
+
+    def test_last_runs_after_earlier_tasks(self):
+        self.submit('low', -1e9)
+        self.submit('last', Task.LAST)
+        self.submit('default', 0)
+
+        self.run_tasks()
+
+        self.assertEqual(self.executed, ['default', 'low', 'last'])
+
+    def test_stop_task_runs_after_earlier_tasks(self):
+        self.submit('last', Task.LAST)
+        self.queue.submit(_StopTask(self.uploader), Task.LAST)
+        self.submit('after stop', Task.LAST)
+
+        self.queue.run()
+
+        self.assertEqual(self.executed, ['last'])
+        self.assertEqual(self.queue.qsize(), 1)
+
+    def test_higher_priority_passes_prepared_tasks(self):
+        def first(uploader):
+            uploader.record('first')
+            self.submit('high', 10)
+        self.queue.submit(Task(first, self.uploader), 0)
+        self.submit('second', 0)
+        self.submit('third', 0)
+
+        self.run_tasks()
+
+        self.assertEqual(self.executed, ['first', 'high', 'second', 'third'])
+
+    def test_look_ahead_conversion(self):
+        pool = _RecordingPool()
+        started = []
+        for i in range(5):
+            conversion = Conversion(pool, lambda i: i, i)
+            task = Task(lambda uploader, c: started.append(list(pool.submitted)),
+                        self.uploader, conversion)
+            task.prepare = conversion.start
+            self.queue.submit(task, 0)
+
+        self.run_tasks()
+
+        # while a task runs only the conversions of the next 2 are started
+        self.assertEqual(started, [[1, 2], [1, 2, 3], [1, 2, 3, 4],
+                                   [1, 2, 3, 4], [1, 2, 3, 4]])
+
+    def test_conversion_not_started_runs_in_caller(self):
+        pool = _RecordingPool()
+        conversion = Conversion(pool, lambda x: 2 * x, 21)
+
+        self.assertEqual(conversion.result(), 42)
+        self.assertEqual(pool.submitted, [])
+
+    def test_released_upload_is_cancelled(self):
+        cache = WaveformCache(MemoryManager(logging))
+        cached_wave, upload = cache.acquire(WaveformCache.key([0.0] * 2000), 2000)
+        self.assertTrue(upload)
+        cache.release(cached_wave)
+        conversion = Conversion(_RecordingPool(), lambda: None)
+
+        cancelled = cancel_released_upload(cache, cached_wave, conversion)
+        conversion.start()
+
+        self.assertTrue(cancelled)
+        self.assertTrue(conversion.cancelled())
+        self.assertFalse(conversion.started())
+        self.assertTrue(cached_wave.uploaded.is_set())
+        self.assertEqual(cached_wave.upload_error, 'Upload cancelled')
+        self.assertEqual(cache.statistics()['entries'], 0)
+
+    def test_referenced_upload_is_not_cancelled(self):
+        cache = WaveformCache(MemoryManager(logging))
+        cached_wave, _ = cache.acquire(WaveformCache.key([0.0] * 2000), 2000)
+        conversion = Conversion(_RecordingPool(), lambda: None)
+
+        self.assertFalse(cancel_released_upload(cache, cached_wave, conversion))
+        self.assertFalse(conversion.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -94,3 +94,19 @@ class TestMemoryManager(unittest.TestCase):
         mm.set_waveform_limit(VERY_LARGE_SIZE)
         new_slots = mm.get_uninitialized_slots()
         self.assertEqual(len(new_slots), N_VERY_LARGE)
+
+
+
+    def test_statistics(self):
+        mm = MemoryManager(logging)
+        capacity = mm.statistics()['capacity']
+
+        slot = mm.allocate(80_000)
+
+        stats = mm.statistics()
+        self.assertEqual(stats['capacity'], capacity)
+        self.assertEqual(stats['reserved'], slot.size)
+        self.assertEqual(stats['used'], 80_000)
+        self.assertAlmostEqual(stats['internal_fragmentation'], 0.2)
+        slot.release()
+        self.assertEqual(mm.statistics()['reserved'], 0)
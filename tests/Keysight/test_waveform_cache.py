@@ -0,0 +1,116 @@
+'''
+Test AWG waveform cache:
+* hits / misses
+* eviction of least recently used waveforms
+* invalidation
+'''
+from qcodes_contrib_drivers.drivers.Keysight.SD_common.memory_manager import MemoryManager
+from qcodes_contrib_drivers.drivers.Keysight.SD_common.waveform_cache import WaveformCache
+
+import unittest
+import logging
+import numpy as np
+
+LARGE_SIZE = 500_000
+N_LARGE = 20
+
+
+class TestWaveformCache(unittest.TestCase):
+
+    def test_key(self):
+        self.assertEqual(WaveformCache.key([0, 1, 2]),
+                         WaveformCache.key(np.array([0.0, 1.0, 2.0])))
+        self.assertNotEqual(WaveformCache.key([0, 1, 2]),
+                            WaveformCache.key([0, 1, 2, 0]))
+
+
+    def test_hit_miss(self):
+        cache = WaveformCache(MemoryManager(logging))
+        key = WaveformCache.key(np.zeros(LARGE_SIZE))
+
+        entry, upload = cache.acquire(key, LARGE_SIZE)
+        self.assertTrue(upload)
+        cache.release(entry)
+
+        same_entry, upload = cache.acquire(key, LARGE_SIZE)
+        self.assertFalse(upload)
+        self.assertIs(same_entry, entry)
+
+        uncached, upload = cache.acquire(None, LARGE_SIZE)
+        self.assertTrue(upload)
+        self.assertIsNot(uncached, entry)
+
+        stats = cache.statistics()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1))
+        cache.release(same_entry)
+        cache.release(uncached)
+
+
+    def test_evict_least_recently_used(self):
+        cache = WaveformCache(MemoryManager(logging))
+        keys = [bytes([i]) for i in range(N_LARGE + 1)]
+
+        entries = [cache.acquire(key, LARGE_SIZE)[0] for key in keys[:N_LARGE]]
+        for entry in entries:
+            cache.release(entry)
+        # use first entry again
+        cache.release(cache.acquire(keys[0], LARGE_SIZE)[0])
+
+        entry, upload = cache.acquire(keys[N_LARGE], LARGE_SIZE)
+        self.assertTrue(upload)
+        self.assertEqual(entry.wave_number, entries[1].wave_number)
+        self.assertEqual(cache.statistics()['evictions'], 1)
+        self.assertFalse(cache.acquire(keys[0], LARGE_SIZE)[1])
+        self.assertTrue(cache.acquire(keys[1], LARGE_SIZE)[1])
+
+
+    def test_referenced_not_evicted(self):
+        cache = WaveformCache(MemoryManager(logging))
+        entries = [cache.acquire(bytes([i]), LARGE_SIZE)[0] for i in range(N_LARGE)]
+
+        with self.assertRaises(Exception):
+            cache.acquire(b'new', LARGE_SIZE)
+
+        cache.release(entries[5])
+        entry, upload = cache.acquire(b'new', LARGE_SIZE)
+        self.assertEqual(entry.wave_number, entries[5].wave_number)
+
+
+    def test_invalidate(self):
+        mm = MemoryManager(logging)
+        cache = WaveformCache(mm)
+        entry, _ = cache.acquire(b'failed', LARGE_SIZE)
+
+        cache.invalidate(entry)
+        self.assertTrue(cache.acquire(b'failed', LARGE_SIZE)[1])
+
+        cache.release(entry)
+        self.assertEqual(len(mm.allocation_state()['Allocated']), 1)
+
+
+    def test_discard_unreferenced(self):
+        mm = MemoryManager(logging)
+        cache = WaveformCache(mm)
+        entry, _ = cache.acquire(b'stale', LARGE_SIZE)
+
+        self.assertFalse(cache.discard_unreferenced(entry))
+        cache.release(entry)
+        self.assertTrue(cache.discard_unreferenced(entry))
+        self.assertEqual(len(mm.allocation_state()['Allocated']), 0)
+        self.assertTrue(cache.acquire(b'stale', LARGE_SIZE)[1])
+
+
+    def test_small_slots_not_evicted_for_large_waveform(self):
+        cache = WaveformCache(MemoryManager(logging))
+        for i in range(N_LARGE):
+            cache.acquire(bytes([i]), LARGE_SIZE)
+        small = [cache.acquire(b'small' + bytes([i]), 1000)[0] for i in range(10)]
+        for entry in small:
+            cache.release(entry)
+
+        with self.assertRaises(Exception):
+            cache.acquire(b'new', LARGE_SIZE)
+        self.assertEqual(cache.statistics()['evictions'], 0)
+        self.assertFalse(cache.acquire(b'small' + bytes([0]), 1000)[1])
+
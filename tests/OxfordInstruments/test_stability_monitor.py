@@ -0,0 +1,215 @@
+import math
+
+import numpy as np
+import pytest
+
+from qcodes_contrib_drivers.drivers.OxfordInstruments.stability_monitor import (
+    InterlockError, RingBuffer, StabilityMonitor, _WindowStatistics)
+
+
+class _Channel:
+    """ Returns the given readings one after the other """
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+
+    def __call__(self):
+        value = self.readings.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+@pytest.fixture
+def monitor():
+    # polled explicitly with _poll() instead of on the background thread
+    return StabilityMonitor({'T': _Channel([]), 'P': lambda: 1.0})
+
+
+def poll(monitor, *readings):
+    monitor.channels['T'].readings += readings
+    for _ in readings:
+        monitor._poll()
+
+
+def test_ring_buffer_keeps_last_readings():
+    buffer = RingBuffer(3)
+    for i in range(5):
+        buffer.append(float(i), 10.0 * i)
+    # -----------------------------------------------------------------------
+    times, values = buffer.last()
+    # -----------------------------------------------------------------------
+    assert buffer.count == 5
+    assert list(times) == [2, 3, 4]
+    assert list(values) == [20, 30, 40]
+    assert list(buffer.last(2)[1]) == [30, 40]
+
+
+def test_ring_buffer_not_full():
+    buffer = RingBuffer(3)
+    buffer.append(0.0, 1.0)
+    # -----------------------------------------------------------------------
+    times, values = buffer.last(10)
+    # -----------------------------------------------------------------------
+    assert list(values) == [1]
+
+
+def test_window_statistics():
+    statistics = _WindowStatistics(3)
+    for value in [5, 1, 2, 3]:
+        statistics.add(value)
+    # -----------------------------------------------------------------------
+    assert statistics.full
+    assert statistics.mean == pytest.approx(2)
+    assert statistics.std == pytest.approx(np.std([1, 2, 3]))
+
+
+def test_window_statistics_recover_from_failed_reading():
+    statistics = _WindowStatistics(5)
+    for value in [1, 1, math.nan, 1, 1]:
+        statistics.add(value)
+    assert math.isnan(statistics.mean)
+    # -----------------------------------------------------------------------
+    for _ in range(3):
+        statistics.add(1)
+    # -----------------------------------------------------------------------
+    assert statistics.mean == 1
+    assert statistics.std == 0
+
+
+def test_latest_and_history(monitor):
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.0, 2.0)
+    # -----------------------------------------------------------------------
+    assert monitor.latest() == {'T': 2.0, 'P': 1.0}
+    assert list(monitor.history('T')[1]) == [1.0, 2.0]
+
+
+def test_failed_reading_is_nan(monitor):
+    # -----------------------------------------------------------------------
+    poll(monitor, RuntimeError('VISA timeout'))
+    # -----------------------------------------------------------------------
+    assert math.isnan(monitor.latest()['T'])
+
+
+def test_wait_until(monitor):
+    future = monitor.wait_until(lambda values: values['T'] > 2,
+                                result_channel='T')
+    poll(monitor, 1.0, 2.0)
+    assert not future.done()
+    # -----------------------------------------------------------------------
+    poll(monitor, 3.0)
+    # -----------------------------------------------------------------------
+    assert future.result(timeout=0) == 3.0
+    assert monitor._waits == []
+
+
+def test_wait_until_returns_all_readings(monitor):
+    future = monitor.wait_until(lambda values: True)
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.0)
+    # -----------------------------------------------------------------------
+    assert future.result(timeout=0) == {'T': 1.0, 'P': 1.0}
+
+
+def test_wait_until_timeout(monitor):
+    future = monitor.wait_until(lambda values: False, timeout=0)
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.0)
+    # -----------------------------------------------------------------------
+    with pytest.raises(TimeoutError):
+        future.result(timeout=0)
+
+
+def test_failing_condition_fails_wait(monitor):
+    future = monitor.wait_until(lambda values: values['missing'] > 0)
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.0)
+    # -----------------------------------------------------------------------
+    with pytest.raises(KeyError):
+        future.result(timeout=0)
+
+
+def test_cancelled_wait_is_removed(monitor):
+    future = monitor.wait_until(lambda values: False)
+    # -----------------------------------------------------------------------
+    future.cancel()
+    poll(monitor, 1.0)
+    # -----------------------------------------------------------------------
+    assert monitor._waits == []
+
+
+def test_wait_until_stable(monitor):
+    future = monitor.wait_until_stable('T', target=1.0, max_deviation=0.1,
+                                       max_std=0.05, window=3)
+    poll(monitor, 5.0, 1.0, 1.0)
+    assert not future.done()
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.01)
+    # -----------------------------------------------------------------------
+    assert future.result(timeout=0) == 1.01
+
+
+def test_wait_until_stable_after_failed_reading(monitor):
+    monitor.channels['T'].readings += [1.0, RuntimeError('VISA timeout')]
+    future = monitor.wait_until_stable('T', target=1.0, max_deviation=0.1,
+                                       window=3)
+    monitor._poll()
+    monitor._poll()
+    poll(monitor, 1.0, 1.0)
+    assert not future.done()
+    # -----------------------------------------------------------------------
+    poll(monitor, 1.0)
+    # -----------------------------------------------------------------------
+    assert future.result(timeout=0) == 1.0
+
+
+def test_interlock_trip(monitor):
+    actions = []
+    monitor.add_interlock('T too high', lambda values: values['T'] > 10,
+                          action=actions.append)
+    future = monitor.wait_until(lambda values: False)
+    poll(monitor, 1.0)
+    assert not actions
+    # -----------------------------------------------------------------------
+    poll(monitor, 11.0)
+    # -----------------------------------------------------------------------
+    assert actions == [{'T': 11.0, 'P': 1.0}]
+    with pytest.raises(InterlockError, match='T too high'):
+        future.result(timeout=0)
+    assert monitor._interlocks == []
+    assert monitor._waits == []
+
+
+def test_remove_interlock(monitor):
+    actions = []
+    monitor.add_interlock('T too high', lambda values: values['T'] > 10,
+                          action=actions.append)
+    # -----------------------------------------------------------------------
+    monitor.remove_interlock('T too high')
+    poll(monitor, 11.0)
+    # -----------------------------------------------------------------------
+    assert not actions
+
+
+def test_stop_cancels_waits():
+    monitor = StabilityMonitor({'T': lambda: 1.0}, interval=0.01)
+    monitor.start()
+    future = monitor.wait_until(lambda values: False)
+    # -----------------------------------------------------------------------
+    monitor.stop(timeout=5)
+    # -----------------------------------------------------------------------
+    assert not monitor.running
+    assert future.cancelled()
+
+
+def test_background_polling():
+    monitor = StabilityMonitor({'T': lambda: 1.0}, interval=0.01)
+    monitor.start()
+    try:
+        # -------------------------------------------------------------------
+        result = monitor.wait_until(lambda values: True, result_channel='T')
+        # -------------------------------------------------------------------
+        assert result.result(timeout=5) == 1.0
+    finally:
+        monitor.stop(timeout=5)
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from qcodes_contrib_drivers.drivers.OxfordInstruments.Triton import (
+    Triton, _VCLReader)
+
+COLUMNS = ['Time(secs)', 'PT1 Plate T(K)', 'PT2 Plate T(K)', 'Still T(K)',
+           '100mK Plate T(K)', 'MC cernox T(K)', 'MC RuO2 T(K)',
+           'P2 Condense (Bar)', 'P1 Tank (Bar)', 'P5 ForepumpBack (Bar)']
+
+
+def write_vcl(path, names, rows):
+    """ Synthetic vcl file with the layout expected by _VCLReader """
+    header = bytearray(_VCLReader.header_size)
+    offset = 0x100
+    for name in names:
+        record = name.encode().ljust(_VCLReader.name_size, b'\0')
+        header[offset:offset + _VCLReader.name_size] = record
+        offset += _VCLReader.name_size
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        f.write(np.asarray(rows, dtype='<f8').tobytes())
+
+
+def append_rows(path, rows):
+    with open(path, 'ab') as f:
+        f.write(np.asarray(rows, dtype='<f8').tobytes())
+
+
+def row(time, temperature):
+    return [time] + [temperature] * (len(COLUMNS) - 1)
+
+
+@pytest.fixture
+def vcl(tmp_path):
+    path = tmp_path / 'log.vcl'
+    write_vcl(path, COLUMNS, [row(1, 10), row(2, 20)])
+    return path
+
+
+@pytest.fixture
+def converter(tmp_path):
+    """ Converter whose csv output is already there, so it is not run """
+    (tmp_path / 'log.txt').write_text(
+        '\t'.join(COLUMNS) + '\n' + '\t'.join(['3'] + ['0.5'] * 9) + '\n')
+    path = tmp_path / 'converter.exe'
+    path.write_bytes(b'')
+    return path
+
+
+@pytest.fixture(autouse=True)
+def close_instruments():
+    yield
+    Triton.close_all()
+
+
+def test_reader_reads_appended_rows(vcl):
+    reader = _VCLReader(str(vcl))
+    assert len(reader.read_new_rows()) == 2
+    append_rows(vcl, [row(3, 30)])
+    # -----------------------------------------------------------------------
+    rows = reader.read_new_rows()
+    # -----------------------------------------------------------------------
+    assert rows.tolist() == [row(3, 30)]
+    assert reader.last_row['PT1 Plate T(K)'] == 30
+    assert reader.rows_read == 3
+
+
+def test_reader_leaves_partial_record(vcl):
+    reader = _VCLReader(str(vcl))
+    reader.read_new_rows()
+    record = np.asarray(row(3, 30), dtype='<f8').tobytes()
+    with open(vcl, 'ab') as f:
+        f.write(record[:20])
+    # -----------------------------------------------------------------------
+    assert len(reader.read_new_rows()) == 0
+    with open(vcl, 'ab') as f:
+        f.write(record[20:])
+    # -----------------------------------------------------------------------
+    assert reader.read_new_rows().tolist() == [row(3, 30)]
+
+
+def test_reader_rejects_time_going_back_between_reads(vcl):
+    reader = _VCLReader(str(vcl))
+    reader.read_new_rows()
+    append_rows(vcl, [row(1.5, 30)])
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError, match='not a time'):
+        reader.read_new_rows()
+    # -----------------------------------------------------------------------
+
+
+def test_converter_is_the_default(vcl, converter):
+    triton = Triton('triton', str(vcl), str(converter), conversion_timer=1e6)
+    # -----------------------------------------------------------------------
+    temperature = triton.temperature_50k_plate()
+    # -----------------------------------------------------------------------
+    assert temperature == 0.5
+
+
+def test_converter_required_without_native_reader(vcl):
+    with pytest.raises(ValueError, match='converter_path'):
+        Triton('triton', str(vcl))
+
+
+def test_native_reader(vcl):
+    triton = Triton('triton', str(vcl), native_reader=True)
+    # -----------------------------------------------------------------------
+    assert triton.temperature_50k_plate() == 20
+    append_rows(vcl, [row(3, 30)])
+    # -----------------------------------------------------------------------
+    assert triton.pressure_mixture_tank() == 30
+
+
+def test_native_reader_falls_back_on_missing_column(tmp_path, converter):
+    vcl = tmp_path / 'log.vcl'
+    write_vcl(vcl, COLUMNS[:-1], [row(1, 10)[:-1]])
+    triton = Triton('triton', str(vcl), str(converter), conversion_timer=1e6,
+                    native_reader=True)
+    # -----------------------------------------------------------------------
+    temperature = triton.temperature_50k_plate()
+    # -----------------------------------------------------------------------
+    assert temperature == 0.5
+
+
+def test_native_reader_falls_back_on_unexpected_layout(tmp_path, converter):
+    vcl = tmp_path / 'log.vcl'
+    vcl.write_bytes(b'\1' * 100)
+    triton = Triton('triton', str(vcl), str(converter), conversion_timer=1e6,
+                    native_reader=True)
+    # -----------------------------------------------------------------------
+    pressure = triton.pressure_condensation_line()
+    # -----------------------------------------------------------------------
+    assert pressure == 0.5
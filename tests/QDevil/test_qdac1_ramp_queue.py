@@ -0,0 +1,207 @@
+import re
+import threading
+import time
+
+import pytest
+from qcodes.instrument import Instrument
+from qcodes.parameters import Parameter
+
+from qcodes_contrib_drivers.drivers.QDevil.QDAC1 import QDac
+
+
+class _Channel:
+
+    def __init__(self, chan: int):
+        self.v = Parameter(f'ch{chan:02}_v', set_cmd=None, initial_value=0)
+        self.sync_delay = Parameter('sync_delay', set_cmd=None, initial_value=0)
+        self.sync_duration = Parameter('sync_duration', set_cmd=None,
+                                       initial_value=0.01)
+
+
+class _RecordingQDac(QDac):
+    """QDAC-I with only the ramp book keeping, recording the commands sent"""
+
+    def __init__(self, num_chans: int = 24):
+        # No VISA connection
+        Instrument.__init__(self, 'qdac1')
+        self._lock = threading.RLock()
+        self._ramp_timer = None
+        self.num_chans = num_chans
+        self._reset_bookkeeping()
+        self.channels = [_Channel(chan) for chan in range(1, num_chans + 1)]
+        self.commands = []
+        self.failing_voltage_reads = 0
+
+    def write(self, cmd: str) -> None:
+        self.commands.append(cmd)
+
+    def _get_voltages(self, chans):
+        if self.failing_voltage_reads:
+            self.failing_voltage_reads -= 1
+            raise RuntimeError('VISA timeout')
+        return [0.0] * len(chans)
+
+    def close(self) -> None:
+        if self._ramp_timer:
+            self._ramp_timer.cancel()
+        Instrument.close(self)
+
+    def started(self):
+        """(channel, generator) of every ramp programmed, in order"""
+        return [(int(ch), int(fg)) for cmd in self.commands
+                for ch, fg in re.findall(r'wav (\d+) (\d+) \S+ \S+', cmd)
+                if fg != '0']
+
+    def wait_for(self, condition, timeout: float = 5) -> None:
+        deadline = time.time() + timeout
+        while not condition():
+            assert time.time() < deadline, 'timeout'
+            time.sleep(0.005)
+
+
+@pytest.fixture
+def qdac():
+    instrument = _RecordingQDac()
+    yield instrument
+    instrument.close()
+
+
+def test_ramps_start_immediately_while_generators_are_free(qdac):
+    # -----------------------------------------------------------------------
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    assert qdac.started() == [(chan, chan) for chan in range(1, 9)]
+    assert not qdac._ramp_queue
+
+
+def test_ramp_beyond_eight_generators_is_queued(qdac):
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 0.05 + 0.01 * chan)
+    # -----------------------------------------------------------------------
+    expected_end = qdac.ramp_voltages([9], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    assert expected_end > 0.1
+    assert len(qdac.started()) == 8
+    qdac.wait_for(lambda: len(qdac.started()) == 9)
+    # The generator of the ramp that finished first is reused and its
+    # channel put back in DC mode
+    assert qdac.started()[-1] == (9, 1)
+    assert 'set 1 1.000000;wav 1 0 0 0' in qdac.commands
+    assert 1 not in qdac._assigned_fgs
+
+
+def test_queued_ramps_start_in_request_order(qdac):
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 0.05 if chan == 1 else 0.2)
+    # -----------------------------------------------------------------------
+    qdac.ramp_voltages([9, 10], [0, 0], [1, 1], 0.05)
+    qdac.ramp_voltages([11], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    # A generator is free after 0.05 s, but the two channel ramp was
+    # requested first and must wait for a second one
+    time.sleep(0.1)
+    assert len(qdac.started()) == 8
+    qdac.wait_for(lambda: len(qdac.started()) == 11)
+    assert [ch for ch, _ in qdac.started()[8:]] == [9, 10, 11]
+
+
+def test_multi_channel_ramps_get_unused_triggers(qdac):
+    # -----------------------------------------------------------------------
+    qdac.ramp_voltages([1, 2], [0, 0], [1, 1], 1)
+    qdac.ramp_voltages([3, 4], [0, 0], [1, 1], 1)
+    qdac.ramp_voltages([5], [0], [1], 1)
+    # -----------------------------------------------------------------------
+    assert [cmd for cmd in qdac.commands if cmd.startswith('trig')] == \
+        ['trig 1', 'trig 2']
+    assert qdac._assigned_triggers == {1: 1, 2: 1, 3: 2, 4: 2}
+    # Single channel ramps start without trigger
+    assert qdac.commands[-1].endswith(' 0')
+
+
+def test_reprogrammed_generators_free_their_trigger(qdac):
+    qdac.ramp_voltages([1, 2], [0, 0], [1, 1], 1)
+    # -----------------------------------------------------------------------
+    qdac.ramp_voltages([1, 2], [1, 1], [0, 0], 1)
+    # -----------------------------------------------------------------------
+    assert [cmd for cmd in qdac.commands if cmd.startswith('trig')] == \
+        ['trig 1', 'trig 1']
+
+
+def test_failed_ramp_releases_generators(qdac):
+    qdac.failing_voltage_reads = 1
+    # -----------------------------------------------------------------------
+    with pytest.raises(RuntimeError):
+        qdac.ramp_voltages([1, 2], [], [1, 1], 1)
+    # -----------------------------------------------------------------------
+    assert qdac._assigned_fgs[1].t_end == 0
+    assert qdac._assigned_fgs[2].t_end == 0
+
+
+def test_failed_queued_ramp_does_not_stall_queue(qdac):
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 0.05)
+    qdac.failing_voltage_reads = 1
+    # -----------------------------------------------------------------------
+    qdac.ramp_voltages([9], [], [1], 0.05)
+    qdac.ramp_voltages([10], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    qdac.wait_for(lambda: 10 in dict(qdac.started()))
+    assert 9 not in dict(qdac.started())
+    # The generator allocated for the failed ramp is reused first
+    assert dict(qdac.started())[10] == 1
+    assert 9 not in qdac._assigned_fgs
+    assert not qdac._ramp_queue
+
+
+def test_long_ramp_waits_for_queued_first_half(qdac, mocker):
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 1)
+    qdac._slopes[9] = 100
+    sleep = mocker.patch('qcodes_contrib_drivers.drivers.QDevil.QDAC1.time.sleep')
+    # -----------------------------------------------------------------------
+    qdac._set_voltage(9, 15)
+    # -----------------------------------------------------------------------
+    # The first half (75 ms) is queued behind the running ramps (1 s)
+    assert sleep.call_args.args[0] > 0.9
+
+
+def fill_generators(qdac):
+    for chan in range(1, 9):
+        qdac.ramp_voltages([chan], [0], [1], 0.05)
+
+
+def test_direct_set_cancels_queued_ramp(qdac):
+    fill_generators(qdac)
+    qdac.ramp_voltages([9], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    qdac._set_voltage(9, 0.5)
+    # -----------------------------------------------------------------------
+    assert not qdac._ramp_queue
+    assert qdac._ramp_timer is None
+    time.sleep(0.1)
+    assert 9 not in dict(qdac.started())
+
+
+def test_cancel_keeps_ramps_of_other_channels(qdac):
+    fill_generators(qdac)
+    qdac.ramp_voltages([9], [0], [1], 0.05)
+    qdac.ramp_voltages([10, 11], [0, 0], [1, 1], 0.05)
+    # -----------------------------------------------------------------------
+    n_cancelled = qdac.cancel_queued_ramps([11])
+    # -----------------------------------------------------------------------
+    assert n_cancelled == 1
+    qdac.wait_for(lambda: 9 in dict(qdac.started()))
+    time.sleep(0.1)
+    assert 10 not in dict(qdac.started())
+
+
+def test_cancel_all_queued_ramps(qdac):
+    fill_generators(qdac)
+    qdac.ramp_voltages([9], [0], [1], 0.05)
+    qdac.ramp_voltages([10], [0], [1], 0.05)
+    # -----------------------------------------------------------------------
+    n_cancelled = qdac.cancel_queued_ramps()
+    # -----------------------------------------------------------------------
+    assert n_cancelled == 2
+    assert qdac._ramp_timer is None
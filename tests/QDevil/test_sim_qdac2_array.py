@@ -302,3 +302,40 @@ def test_frees_internal_triggers_on_exit(qdac, qdac2):  # noqa
         pass
     # -----------------------------------------------------------------------
     assert qdac.n_triggers() == len(qdac._internal_triggers)
+
+
+def test_dispatch_gathers_results_in_order(qdac, qdac2):  # noqa
+    qdacs, controller, listener = two_qdacs(qdac, qdac2)
+    # -----------------------------------------------------------------------
+    names = qdacs._dispatch(lambda instrument: instrument.full_name)
+    # -----------------------------------------------------------------------
+    qdacs.close()
+    assert names == [controller, listener]
+
+
+def test_dispatch_raises_errors_from_workers(qdac, qdac2):  # noqa
+    qdacs, controller, listener = two_qdacs(qdac, qdac2)
+
+    def fail_on_listener(instrument):
+        if instrument.full_name == listener:
+            raise ValueError('listener failed')
+
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError) as error:
+        qdacs._dispatch(fail_on_listener)
+    # -----------------------------------------------------------------------
+    qdacs.close()
+    assert 'listener failed' in repr(error)
+
+
+def test_serial_dispatch_measures_the_same(qdac, qdac2, mocker):  # noqa
+    mocker.patch('qcodes_contrib_drivers.drivers.QDevil.QDAC2_Array.sleep_s')  # Don't sleep
+    qdac.free_all_triggers()
+    qdacs = QDac2_Array(qdac, [qdac2], parallel=False)
+    contacts = {qdac.full_name: {'A': 2, 'B': 1}, qdac2.full_name: {'C': 3}}
+    arrangement = qdacs.arrange(contacts)
+    # -----------------------------------------------------------------------
+    currents_A = arrangement.currents_A(nplc=2)
+    # -----------------------------------------------------------------------
+    assert currents_A == [0.2, 0.1, 0.3]  # Hard-coded in simulation
+    assert not qdacs._workers
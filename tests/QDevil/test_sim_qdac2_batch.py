@@ -0,0 +1,67 @@
+import pytest
+from .sim_qdac2_fixtures import qdac  # noqa
+
+
+def test_batch_joins_commands(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with qdac.batch():
+        qdac.start_all()
+        qdac.remove_traces()
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        '*trg;:trac:rem:all',
+        'syst:err:all?',
+    ]
+
+
+def test_batch_splits_long_messages(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with qdac.batch(max_message_bytes=10):
+        qdac.abort()
+        qdac.start_all()
+        qdac.remove_traces()
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'abor;*trg',
+        'trac:rem:all',
+        'syst:err:all?',
+    ]
+
+
+def test_batch_sends_commands_before_query(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with qdac.batch():
+        qdac.remove_traces()
+        qdac.traces()
+        qdac.start_all()
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'trac:rem:all',
+        'trac:cat?',
+        '*trg',
+        'syst:err:all?',
+    ]
+
+
+def test_nested_batches_are_merged(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with qdac.batch():
+        qdac.start_all()
+        with qdac.batch():
+            qdac.remove_traces()
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        '*trg;:trac:rem:all',
+        'syst:err:all?',
+    ]
+
+
+def test_batch_reports_errors(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError) as error:
+        with qdac.batch():
+            qdac.write('nonsense')
+            qdac.start_all()
+    # -----------------------------------------------------------------------
+    assert 'Undefined header' in repr(error)
+    qdac.clear_read_queue()
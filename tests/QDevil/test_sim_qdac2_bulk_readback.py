@@ -0,0 +1,57 @@
+import pytest
+import numpy as np
+from .sim_qdac2_fixtures import qdac  # noqa
+
+
+def test_available_currents(qdac):  # noqa
+    # The Simulated instrument returns two measurements per channel.
+    # -----------------------------------------------------------------------
+    currents = qdac.available_currents_A([1, 2, 3])
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'sens1:data:poin?;:sens2:data:poin?;:sens3:data:poin?',
+        'sens1:data:rem?;:sens2:data:rem?;:sens3:data:rem?',
+    ]
+    assert currents.shape == (3, 2)
+    assert np.all(currents == [0.01, 0.02])
+
+
+def test_available_currents_into_preallocated_array(qdac):  # noqa
+    out = np.zeros((24, 5))
+    # -----------------------------------------------------------------------
+    currents = qdac.available_currents_A(out=out)
+    # -----------------------------------------------------------------------
+    assert currents.shape == (24, 2)
+    assert np.shares_memory(currents, out)
+    assert np.all(out[:, :2] == [0.01, 0.02])
+
+
+def test_available_currents_checks_preallocated_array(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError) as error:
+        qdac.available_currents_A([1, 2], out=np.zeros((2, 1)))
+    # -----------------------------------------------------------------------
+    assert 'at least 2 columns' in repr(error)
+
+
+def test_arrangement_available_currents(qdac):  # noqa
+    arrangement = qdac.arrange(contacts={'plunger': 2, 'gate': 5})
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    currents = arrangement.available_currents_A()
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'sens2:data:poin?;:sens5:data:poin?',
+        'sens2:data:rem?;:sens5:data:rem?',
+    ]
+    assert currents.shape == (2, 2)
+
+
+def test_last_voltages(qdac):  # noqa
+    # -----------------------------------------------------------------------
+    voltages = qdac.last_voltages_V([4, 7])
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'sour4:volt:last?;:sour7:volt:last?',
+    ]
+    assert np.all(voltages == [0, 0])
@@ -0,0 +1,111 @@
+import pytest
+import numpy
+from .sim_qdac2_fixtures import qdac  # noqa
+
+
+def test_trace_upload_reports_progress(qdac):  # noqa
+    trace = qdac.allocate_trace('streamed', 6)
+    progress = []
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    trace.waveform(numpy.linspace(0, 1, 6), progress=lambda *p: progress.append(p))
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'trac:data "streamed",0,0.2,0.4,0.6,0.8,1']
+    assert progress == [(6, 6)]
+
+
+def test_trace_upload_binary_chunks(qdac, mocker):  # noqa
+    trace = qdac.allocate_trace('chunked', 5)
+    mocker.patch.object(qdac, '_no_binary_values', False)
+    write_raw = mocker.patch.object(qdac.visa_handle, 'write_raw')
+    send_end = qdac.visa_handle.send_end
+    values = numpy.linspace(0, 1, 5, dtype=numpy.float32)
+    progress = []
+    # -----------------------------------------------------------------------
+    trace.waveform(values, chunk_size=2, progress=lambda *p: progress.append(p))
+    # -----------------------------------------------------------------------
+    chunks = [c.args[0] for c in write_raw.call_args_list]
+    assert chunks == [b'trac:data "chunked",#220',
+                      values[:2].tobytes(), values[2:4].tobytes(),
+                      values[4:].tobytes(), b'\n']
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    assert qdac.visa_handle.send_end == send_end
+
+
+def test_upload_chunk_size_must_be_positive(qdac):  # noqa
+    trace = qdac.allocate_trace('no_chunks', 2)
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError) as error:
+        trace.waveform([1, 2], chunk_size=0)
+    # -----------------------------------------------------------------------
+    assert 'Chunk size must be positive' in repr(error)
+
+
+def test_trace_upload_in_background(qdac):  # noqa
+    first = qdac.allocate_trace('first', 3)
+    second = qdac.allocate_trace('second', 3)
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    uploads = [first.waveform(numpy.array([1, 2, 3]), background=True),
+               second.waveform(numpy.array([4, 5, 6]), background=True)]
+    for upload in uploads:
+        upload.result(timeout=10)
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'trac:data "first",1,2,3',
+        'trac:data "second",4,5,6']
+
+
+def test_list_append_in_background(qdac):  # noqa
+    dc_list = qdac.ch01.dc_list(voltages=range(1, 5))
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    dc_list.append(numpy.array([5, 6]), background=True).result(timeout=10)
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'sour1:list:volt:app 5,6',
+        'sour1:dc:init:cont on',
+    ]
+
+
+def test_background_upload_uses_snapshot_of_values(qdac):  # noqa
+    trace = qdac.allocate_trace('snapshot', 3)
+    values = numpy.array([1.0, 2.0, 3.0])
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    with qdac._io_lock:  # hold the upload back until the buffer is reused
+        upload = trace.waveform(values, background=True)
+        values[:] = 0
+    upload.result(timeout=10)
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == ['trac:data "snapshot",1,2,3']
+
+
+def test_background_append_uses_snapshot_of_voltages(qdac):  # noqa
+    dc_list = qdac.ch01.dc_list(voltages=range(1, 3))
+    voltages = numpy.array([3.0, 4.0])
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    with qdac._io_lock:
+        upload = dc_list.append(voltages, background=True)
+        voltages[:] = 0
+    upload.result(timeout=10)
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands()[0] == 'sour1:list:volt:app 3,4'
+
+
+def test_background_upload_bypasses_batch(qdac):  # noqa
+    dc_list = qdac.ch01.dc_list(voltages=range(1, 3))
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    with qdac.batch():
+        qdac.start_all()
+        dc_list.append(numpy.array([3, 4]), background=True).result(timeout=10)
+    # -----------------------------------------------------------------------
+    assert qdac.get_recorded_scpi_commands() == [
+        'sour1:list:volt:app 3,4',
+        'sour1:dc:init:cont on',
+        '*trg',
+        'syst:err:all?',
+    ]
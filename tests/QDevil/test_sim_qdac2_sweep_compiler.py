@@ -0,0 +1,132 @@
+import pytest
+from .sim_qdac2_fixtures import qdac  # noqa
+import numpy as np
+
+
+def test_nd_sweep_slowest_contact_first(qdac):  # noqa
+    arrangement = qdac.arrange(contacts={'gate1': 1, 'gate2': 2, 'gate3': 3})
+    # -----------------------------------------------------------------------
+    sweep = arrangement.virtual_sweep_nd(
+        contacts=('gate1', 'gate2', 'gate3'),
+        voltages=([0.1, 0.2], [1, 2, 3], [-1, 1]))
+    # -----------------------------------------------------------------------
+    assert np.allclose(sweep.actual_values_V('gate1'), np.repeat([0.1, 0.2], 6))
+    assert np.allclose(sweep.actual_values_V('gate2'),
+                       np.tile(np.repeat([1, 2, 3], 2), 2))
+    assert np.allclose(sweep.actual_values_V('gate3'), np.tile([-1, 1], 6))
+
+
+def test_nd_sweep_needs_voltages_per_contact(qdac):  # noqa
+    arrangement = qdac.arrange(contacts={'gate1': 1, 'gate2': 2})
+    # -----------------------------------------------------------------------
+    with pytest.raises(ValueError) as error:
+        arrangement.virtual_sweep_nd(contacts=('gate1', 'gate2'),
+                                     voltages=([0.1, 0.2],))
+    # -----------------------------------------------------------------------
+    assert 'exactly one list of voltages per contact' in repr(error)
+
+
+def test_nd_sweep_corrects_all_steps(qdac):  # noqa
+    arrangement = qdac.arrange(contacts={'gate1': 1, 'gate2': 2, 'gate3': 3})
+    arrangement.initiate_correction('gate1', [1.0, 0.5, -0.5])
+    arrangement.initiate_correction('gate2', [-0.5, 1.0, 0.5])
+    arrangement.set_virtual_voltage('gate3', 0.3)
+    # -----------------------------------------------------------------------
+    sweep = arrangement.virtual_sweep2d(
+        inner_contact='gate1', inner_voltages=np.linspace(-0.2, 0.6, 5),
+        outer_contact='gate2', outer_voltages=np.linspace(-0.7, 0.15, 4))
+    # -----------------------------------------------------------------------
+    virtual = np.array([[outer, inner, 0.3]
+                        for outer in np.linspace(-0.7, 0.15, 4)
+                        for inner in np.linspace(-0.2, 0.6, 5)])
+    expected = virtual[:, [1, 0, 2]] @ arrangement.correction_matrix.T
+    assert np.allclose(sweep.actual_values_V('gate1'), expected[:, 0])
+    assert np.allclose(sweep.actual_values_V('gate2'), expected[:, 1])
+    assert np.allclose(sweep.actual_values_V('gate3'), expected[:, 2])
+
+
+def test_compiled_sweeps_are_cached(qdac):  # noqa
+    arrangement = qdac.arrange(contacts={'gate1': 1, 'gate2': 2})
+    first = arrangement._calculate_1d_values('gate1', [0.1, 0.2])
+    # -----------------------------------------------------------------------
+    second = arrangement._calculate_1d_values('gate1', [0.1, 0.2])
+    arrangement.initiate_correction('gate2', [0.5, 1.0])
+    corrected = arrangement._calculate_1d_values('gate1', [0.1, 0.2])
+    # -----------------------------------------------------------------------
+    assert second is first
+    assert corrected is not first
+    assert np.allclose(corrected[:, 1], [0.05, 0.1])
+
+
+def test_rerun_sweep_uploads_only_changed_lists(qdac):  # noqa
+    qdac.free_all_triggers()
+    arrangement = qdac.arrange(contacts={'gate1': 1, 'gate2': 2})
+    with arrangement.virtual_sweep2d(
+            inner_contact='gate1', inner_voltages=np.linspace(-0.2, 0.6, 5),
+            outer_contact='gate2', outer_voltages=np.linspace(-0.7, 0.15, 5)):
+        pass
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    with arrangement.virtual_sweep2d(
+            inner_contact='gate1', inner_voltages=np.linspace(-0.2, 0.6, 5),
+            outer_contact='gate2', outer_voltages=np.linspace(-0.7, 0.2, 5)):
+        pass
+    # -----------------------------------------------------------------------
+    uploads = [command for command in qdac.get_recorded_scpi_commands()
+               if ':list:volt ' in command]
+    assert len(uploads) == 1
+    assert uploads[0].startswith('sour2:list:volt -0.7,')
+
+
+def run_sweep(arrangement):
+    with arrangement.virtual_sweep(contact='gate1', voltages=[0.1, 0.2, 0.3]):
+        pass
+
+
+def uploaded_lists(qdac):  # noqa
+    return [command for command in qdac.get_recorded_scpi_commands()
+            if ':list:volt ' in command]
+
+
+def test_raw_list_write_forgets_uploaded_list(qdac):  # noqa
+    qdac.free_all_triggers()
+    arrangement = qdac.arrange(contacts={'gate1': 1})
+    run_sweep(arrangement)
+    qdac.write('sour1:list:volt 1,2,3')
+    qdac.start_recording_scpi()
+    # -----------------------------------------------------------------------
+    run_sweep(arrangement)
+    # -----------------------------------------------------------------------
+    assert len(uploaded_lists(qdac)) == 1
+
+
+def test_raw_reset_forgets_uploaded_lists(qdac):  # noqa
+    qdac.free_all_triggers()
+    arrangement = qdac.arrange(contacts={'gate1': 1})
+    run_sweep(arrangement)
+    # -----------------------------------------------------------------------
+    qdac.write('*rst')
+    # -----------------------------------------------------------------------
+    assert qdac.ch01._dc_list_V is None
+
+
+def test_failed_append_forgets_uploaded_list(qdac, mocker):  # noqa
+    dc_list = qdac.ch01.dc_list(voltages=[1, 2])
+    assert qdac.ch01._dc_list_V is not None
+    mocker.patch.object(qdac, 'stream_floats',
+                        side_effect=RuntimeError('VISA timeout'))
+    # -----------------------------------------------------------------------
+    with pytest.raises(RuntimeError):
+        dc_list.append([3, 4])
+    # -----------------------------------------------------------------------
+    assert qdac.ch01._dc_list_V is None
+
+
+def test_failed_batch_forgets_uploaded_lists(qdac):  # noqa
+    qdac.ch01.dc_list(voltages=[1, 2])
+    # -----------------------------------------------------------------------
+    with pytest.raises(RuntimeError):
+        with qdac.batch():
+            raise RuntimeError('interrupted')
+    # -----------------------------------------------------------------------
+    assert qdac.ch01._dc_list_V is None
@@ -2,6 +2,10 @@ import unittest
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
+import numpy as np
+
+from qcodes_contrib_drivers.drivers.Spectrum import pyspcm_sim
+
 
 class TestM2j(unittest.TestCase):
 
@@ -20,3 +24,226 @@ class TestM2j(unittest.TestCase):
             m4i.wait_ready()
             self.mock_pyspcm_module.spcm_dwSetParam_i32.assert_called()
             m4i.close()
+
+
+class SimulatedCardTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pyspcm = pyspcm_sim
+        patcher = patch.dict('sys.modules', pyspcm=pyspcm_sim)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        import qcodes_contrib_drivers.drivers.Spectrum.M4i
+        self.m4i = qcodes_contrib_drivers.drivers.Spectrum.M4i.M4i('test_m4i_sim')
+        self.addCleanup(self.m4i.close)
+        self.card = pyspcm_sim.cards[self.m4i.hCard]
+        self.m4i.enable_channels(pyspcm_sim.CHANNEL0 | pyspcm_sim.CHANNEL1)
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def setUp(self):
+        with patch.dict('sys.modules', pyspcm=pyspcm_sim):
+            from qcodes_contrib_drivers.drivers.Spectrum.M4i import BufferPool
+        self.pool = BufferPool()
+
+    def test_lease_release_reuses_buffer(self):
+        buffer = self.pool.lease(np.int16, 4096)
+        self.assertEqual(buffer.dtype, np.int16)
+        self.assertEqual(buffer.size, 4096)
+        self.assertEqual(buffer.ctypes.data % 4096, 0)
+        self.assertEqual(self.pool.leased_bytes, 8192)
+
+        self.pool.release(buffer)
+        self.assertEqual(self.pool.free_bytes, 8192)
+        self.assertIs(self.pool.lease(np.int16, 4096), buffer)
+        self.assertIsNot(self.pool.lease(np.int16, 4096), buffer)
+        self.assertIsNot(self.pool.lease(np.int32, 4096), buffer)
+
+    def test_release_unknown_buffer(self):
+        buffer = self.pool.lease(np.int16, 16)
+        self.pool.release(buffer)
+        with self.assertRaises(ValueError):
+            self.pool.release(buffer)
+        with self.assertRaises(ValueError):
+            self.pool.release(np.zeros(16, dtype=np.int16))
+
+    def test_free_bytes_are_capped(self):
+        self.pool.max_free_bytes = 3 * 8192
+        old = [self.pool.lease(np.int16, 4096) for _ in range(2)]
+        new = [self.pool.lease(np.int16, 2048) for _ in range(4)]
+        for buffer in old + new:
+            self.pool.release(buffer)
+
+        # buffers of the least recently used size are dropped first
+        self.assertEqual(self.pool.free_bytes, 3 * 8192)
+        self.assertIs(self.pool.lease(np.int16, 4096), old[0])
+        self.assertIsNot(self.pool.lease(np.int16, 4096), old[1])
+
+
+class TestM4iConversion(SimulatedCardTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.card.registers[pyspcm_sim.SPC_AMP0] = 500
+        self.card.registers[pyspcm_sim.SPC_AMP1] = 2000
+        self.card.registers[pyspcm_sim.SPC_MIINST_MAXADCVALUE] = 32767
+        self.raw_data = np.arange(-4000, 4000, dtype=np.int16)
+
+    def test_convert_to_channel_voltages(self):
+        voltages = self.m4i.convert_to_channel_voltages(self.raw_data, [0, 1], divisor=2)
+
+        self.assertEqual(voltages.shape, (2, 4000))
+        self.assertEqual(voltages.dtype, np.float64)
+        np.testing.assert_allclose(voltages[0], self.raw_data[0::2] * 0.5 / 32767 / 2)
+        np.testing.assert_allclose(voltages[1], self.raw_data[1::2] * 2.0 / 32767 / 2)
+
+    def test_convert_to_channel_voltages_into_out(self):
+        out = np.empty((2, 4000), dtype=np.float32)
+        voltages = self.m4i.convert_to_channel_voltages(self.raw_data, [0, 1], out=out)
+
+        self.assertIs(voltages, out)
+        np.testing.assert_allclose(out[1], self.raw_data[1::2] * 2.0 / 32767, rtol=1e-6)
+
+    def test_single_software_trigger_acquisition_releases_buffer(self):
+        self.m4i.single_software_trigger_acquisition(500, 4096, 4000)
+        self.m4i.single_software_trigger_acquisition(500, 4096, 4000)
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+        self.assertEqual(self.m4i.buffer_pool.free_bytes, 4096 * 2 * 2)
+
+    def test_failed_conversion_releases_buffer(self):
+        with patch.object(self.m4i, 'convert_to_voltage', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                self.m4i.single_software_trigger_acquisition(500, 4096, 4000)
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+
+
+class TestM4iPipeline(SimulatedCardTestCase):
+
+    def test_pipelined_acquisition(self):
+        results = list(self.m4i.pipelined_multiple_trigger_acquisition(
+            1000, 4096, 1024, 1000, n_batches=5, process=np.shape))
+
+        self.assertEqual(results, [(8192,)] * 5)
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+        self.assertEqual(self.m4i.card_mode(), self.pyspcm.SPC_REC_STD_MULTI)
+
+    def test_pipelined_acquisition_closed_early(self):
+        acquisition = self.m4i.pipelined_multiple_trigger_acquisition(
+            1000, 4096, 1024, 1000, queue_size=1)
+        voltages = next(acquisition)
+        acquisition.close()
+
+        self.assertEqual(voltages.shape, (8192,))
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+
+    def test_pipelined_acquisition_process_error(self):
+        def process(voltages):
+            raise RuntimeError('processing failed')
+
+        with self.assertRaisesRegex(RuntimeError, 'processing failed'):
+            list(self.m4i.pipelined_multiple_trigger_acquisition(
+                1000, 4096, 1024, 1000, n_batches=3, process=process))
+
+    def test_pipelined_acquisition_conversion_error_releases_buffers(self):
+        with patch.object(self.m4i, 'convert_to_voltage', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                list(self.m4i.pipelined_multiple_trigger_acquisition(
+                    1000, 4096, 1024, 1000, n_batches=3))
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+
+
+class TestM4iFifo(SimulatedCardTestCase):
+
+    def test_fifo_acquisition_wraps_ring_buffer(self):
+        self.card.waveform = 'ramp'
+        self.m4i.setup_fifo_recording(1024, n_segments=0)
+        self.assertEqual(self.m4i.card_mode(), self.pyspcm.SPC_REC_FIFO_MULTI)
+
+        blocks = []
+        for block in self.m4i.fifo_acquisition(segments_per_block=2, buffer_blocks=3, n_blocks=7):
+            self.assertEqual(block.shape, (2, 1024, 2))
+            blocks.append(block.copy())
+
+        self.assertEqual(len(blocks), 7)
+        data = np.concatenate([b.ravel() for b in blocks])
+        np.testing.assert_array_equal(data, np.arange(data.size).astype(np.int16))
+        self.assertEqual(self.card.user_len, 0)
+        self.assertEqual(self.card.user_pos, (7 % 3) * 2 * 1024 * 2 * 2)
+        self.assertFalse(self.card.running)
+
+    def test_fifo_ring_buffer_is_reused_and_page_aligned(self):
+        self.m4i.setup_fifo_recording(1024)
+        block = next(self.m4i.fifo_acquisition(segments_per_block=2, n_blocks=1))
+        buffer_address = block.ctypes.data
+        self.assertEqual(buffer_address % 4096, 0)
+        self.assertEqual(self.m4i.buffer_pool.leased_bytes, 0)
+        block = next(self.m4i.fifo_acquisition(segments_per_block=2, n_blocks=1))
+        self.assertEqual(block.ctypes.data, buffer_address)
+
+    def test_fifo_block_size_must_be_page_multiple(self):
+        self.m4i.setup_fifo_recording(32)
+        with self.assertRaises(ValueError):
+            next(self.m4i.fifo_acquisition(segments_per_block=1))
+
+
+class TestM4iSimulation(SimulatedCardTestCase):
+
+    def test_single_software_trigger_acquisition(self):
+        voltages = self.m4i.single_software_trigger_acquisition(1000, 4096, 4000)
+        voltages = voltages.reshape(-1, 2).T
+
+        t = np.arange(4096) / 500e6
+        np.testing.assert_allclose(voltages[0], 0.5 * np.sin(2 * np.pi * 10e6 * t), atol=1e-3)
+        np.testing.assert_allclose(voltages[1], 0.5 * np.sin(2 * np.pi * 20e6 * t), atol=1e-3)
+
+    def test_benchmark(self):
+        from qcodes_contrib_drivers.drivers.Spectrum.benchmark import benchmark_acquisitions
+
+        results = benchmark_acquisitions(self.m4i, channels=(0, 1), large_memsize=2**18, n_shots=2)
+        self.assertIn('fifo_acquisition', results)
+        for name, result in results.items():
+            # timings depend on the machine, only the structure is checked
+            self.assertEqual(set(result), {'overhead', 'throughput'}, name)
+            self.assertGreater(result['overhead'], 0, name)
+            self.assertTrue(np.isfinite(result['throughput']), name)
+
+
+class TestSegmentReducer(unittest.TestCase):
+
+    def setUp(self):
+        from qcodes_contrib_drivers.drivers.Spectrum.reduction import SegmentReducer, segments_view
+        self.SegmentReducer = SegmentReducer
+        self.segments_view = segments_view
+
+        sample_rate = 1e9
+        t = np.arange(400) / sample_rate
+        segments = np.empty((10, 2, 400))
+        for i in range(10):
+            segments[i, 0] = 1000 * np.cos(2 * np.pi * 50e6 * t + 0.1 * i)
+            segments[i, 1] = 10 * i
+        # interleave as the card does: segment, sample, channel
+        self.raw_data = np.round(segments).astype(np.int16).transpose(0, 2, 1).ravel()
+        self.segments = segments
+
+    def test_segments_view(self):
+        view = self.segments_view(self.raw_data, 2, 400)
+        self.assertEqual(view.shape, (10, 2, 400))
+        self.assertTrue(np.shares_memory(view, self.raw_data))
+        np.testing.assert_array_equal(view[3, 1], 30)
+
+    def test_reduction_in_chunks(self):
+        reducer = self.SegmentReducer([1e-3, 1e-3], 400, 1e9, windows=[(0, 100), (100, 400)],
+                                      demodulation_frequency=50e6,
+                                      histogram_bins=np.linspace(-1e-8, 1e-8, 5), chunk_size=3)
+        reducer.update(self.raw_data)
+
+        self.assertEqual(reducer.n_segments, 10)
+        np.testing.assert_allclose(reducer.mean[1], 0.045)
+        np.testing.assert_allclose(reducer.integrals[:, 1, 1], 1e-2 * np.arange(10) * 300 / 1e9)
+        iq = reducer.demodulated
+        self.assertEqual(iq.shape, (10, 2))
+        np.testing.assert_allclose(np.abs(iq[:, 0]), 1.0, rtol=1e-3)
+        np.testing.assert_allclose(np.angle(iq[:, 0]), 0.1 * np.arange(10), atol=1e-3)
+        self.assertEqual(reducer.histogram.shape, (2, 2, 4))
+        self.assertEqual(reducer.histogram[0, 0].sum(), 10)
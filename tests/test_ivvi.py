@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from qcodes_contrib_drivers.drivers.QuTech.IVVI import IVVI
+
+
+class _D5Module:
+    ''' Answers the set and get DAC commands of the rs232 link protocol '''
+
+    def __init__(self, numdacs):
+        self.codes = [0] * numdacs
+        self.writes = []
+        self.buffer = b''
+        self.handle = MagicMock()
+        self.handle.write_raw.side_effect = self.write_raw
+        self.handle.visalib.read.side_effect = self.read
+        type(self.handle).bytes_in_buffer = PropertyMock(
+            side_effect=lambda: len(self.buffer))
+
+    def write_raw(self, data):
+        self.writes.append(data)
+        while data:
+            size, error, length, command = data[:4]
+            if command == 1:
+                self.codes[data[4] - 1] = int.from_bytes(data[5:7], 'big')
+                self.buffer += bytes([length, 0])
+            elif command == 2:
+                self.buffer += bytes([length, 0]) + b''.join(
+                    code.to_bytes(2, 'big') for code in self.codes)
+            data = data[size:]
+
+    def read(self, session, size):
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data, 0
+
+
+class TestIVVI(unittest.TestCase):
+
+    def setUp(self):
+        self.device = _D5Module(8)
+        with patch.object(IVVI, '_open_resource',
+                          return_value=(self.device.handle, 'sim', MagicMock())):
+            self.ivvi = IVVI('ivvi', 'ASRL1::INSTR', numdacs=8,
+                             polarity=['POS', 'POS'])
+        self.ivvi.dac_read_buffer_sleep(0)
+        for i in range(1, 9):
+            self.ivvi.parameters['dac{}'.format(i)].inter_delay = 0
+        self.device.writes.clear()
+
+    def tearDown(self):
+        self.ivvi.close()
+
+    def test_ask_multiple(self):
+        replies = self.ivvi.ask_multiple([bytes([2, 1, 1, 0, 10]),
+                                          bytes([18, 2])])
+
+        self.assertEqual(self.device.writes,
+                         [bytes([7, 0, 2, 1, 1, 0, 10, 4, 0, 18, 2])])
+        self.assertEqual(replies, [bytes([2, 0]),
+                                   bytes([18, 0, 0, 10]) + bytes(14)])
+
+    def test_batch_size_defaults_to_one_command_per_write(self):
+        self.ivvi.set_dacs({1: 1, 'dac2': 2, 3: 3})
+
+        self.assertEqual(len(self.device.writes), 3)
+        self.assertEqual(self.device.writes[0],
+                         bytes([7, 0, 2, 1, 1]) + (16).to_bytes(2, 'big'))
+
+    def test_batched_set_dacs(self):
+        self.ivvi.dac_batch_size(2)
+
+        self.ivvi.set_dacs({1: 1, 2: 2, 3: 3})
+
+        self.assertEqual([len(data) for data in self.device.writes], [14, 7])
+        self.assertEqual(self.device.codes[:4], [16, 33, 49, 0])
+        self.assertEqual(self.ivvi.dac3.cache.get(get_if_invalid=False), 3)
+
+    def test_unchanged_codes_are_skipped(self):
+        self.ivvi.set_dacs({1: 1, 2: 2})
+        self.device.writes.clear()
+
+        self.ivvi.set_dacs({1: 1, 2: 5})
+
+        self.assertEqual(self.device.writes,
+                         [bytes([7, 0, 2, 1, 2]) + (82).to_bytes(2, 'big')])
+
+    def test_lockstep_step_count(self):
+        self.ivvi.dac_batch_size(8)
+
+        self.ivvi.set_dacs({1: 100, 2: 20})
+
+        # dac1 needs 100 mV / 10 mV = 10 steps, dac2 follows in the same 10
+        self.assertEqual(len(self.device.writes), 10)
+        self.assertTrue(all(len(data) == 14 for data in self.device.writes))
+        self.assertEqual(self.ivvi.dac1.cache.get(get_if_invalid=False), 100)
+        self.assertEqual(self.ivvi.dac2.cache.get(get_if_invalid=False), 20)
+
+    def test_cache_follows_replies(self):
+        def write_raw(data):
+            if self.device.writes:
+                raise RuntimeError('link lost')
+            self.device.write_raw(data)
+        self.device.handle.write_raw.side_effect = write_raw
+
+        with self.assertRaises(RuntimeError):
+            self.ivvi.set_dacs({1: 10, 2: 10})
+
+        self.assertAlmostEqual(
+            self.ivvi.dac1.cache.get(get_if_invalid=False), 10, delta=0.1)
+        self.assertEqual(self.ivvi.dac2.cache.get(get_if_invalid=False), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
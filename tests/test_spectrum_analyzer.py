@@ -0,0 +1,229 @@
+import socket
+import threading
+import unittest
+
+import numpy as np
+from qcodes.instrument import Instrument
+
+from qcodes_contrib_drivers.drivers.common.spectrum_analyzer import (
+    FrequencySweep, SpectrumAnalyzerMixin, TraceReader, parse_ascii_trace,
+    read_response, split_traces)
+
+
+def _ieee_block(payload: bytes) -> bytes:
+    length = str(len(payload)).encode()
+    return b'#' + str(len(length)).encode() + length + payload + b'\n'
+
+
+class _IPInstrumentStub:
+    """ Instrument answering every message with the next queued response """
+
+    name = 'stub'
+
+    def __init__(self, responses):
+        self._socket, self._peer = socket.socketpair()
+        self.responses = list(responses)
+        self.messages = []
+        self.connections = 1
+
+    def _connect(self):
+        self.close()
+        self._socket, self._peer = socket.socketpair()
+        self.connections += 1
+
+    def _send(self, message):
+        self.messages.append(message)
+        response = self.responses.pop(0)
+        if response is None:
+            # the instrument closes the connection
+            self._peer.close()
+            return
+        threading.Thread(target=self._peer.sendall, args=(response,)).start()
+
+    def close(self):
+        self._socket.close()
+        self._peer.close()
+
+
+class TestTraceTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.trace = np.linspace(-120, -20, 40001, dtype=np.float32)
+
+    def test_read_response(self):
+        sock, peer = socket.socketpair()
+        self.addCleanup(sock.close)
+        self.addCleanup(peer.close)
+        payload = self.trace.astype('<f4').tobytes()
+        sender = threading.Thread(target=peer.sendall, args=(_ieee_block(payload) + b'1,2\n',))
+        sender.start()
+
+        is_block, data = read_response(sock)
+        self.assertTrue(is_block)
+        self.assertEqual(bytes(data), payload)
+        self.assertEqual(read_response(sock), (False, b'1,2\n'))
+        sender.join()
+
+    def test_parse_ascii_trace(self):
+        np.testing.assert_array_equal(parse_ascii_trace('-1.5, 2.25,3\n'), [-1.5, 2.25, 3])
+        np.testing.assert_array_equal(parse_ascii_trace('#15-1,21'), [-1, 21])
+
+    def test_trace_reader_binary(self):
+        for little_endian in (True, False):
+            dtype = '<f4' if little_endian else '>f4'
+            instrument = _IPInstrumentStub([_ieee_block(self.trace.astype(dtype).tobytes())])
+            self.addCleanup(instrument.close)
+            reader = TraceReader(instrument, little_endian=little_endian)
+
+            trace = reader.read('TRAC:DATA? TRACE1')
+
+            self.assertEqual(trace.dtype, np.float32)
+            np.testing.assert_array_equal(trace, self.trace)
+            border = 'SWAP' if little_endian else 'NORM'
+            self.assertEqual(instrument.messages,
+                             [f'FORM REAL,32;:FORM:BORD {border};:TRAC:DATA? TRACE1'])
+
+    def test_trace_reader_float64(self):
+        trace = np.linspace(-1, 1, 201)
+        instrument = _IPInstrumentStub([_ieee_block(trace.astype('<f8').tobytes())])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument, datatype='d')
+
+        data = reader.read('CALC:DATA:DALL? SDAT')
+
+        self.assertEqual(data.dtype, np.float64)
+        np.testing.assert_array_equal(data, trace)
+        self.assertEqual(instrument.messages,
+                         ['FORM REAL,64;:FORM:BORD SWAP;:CALC:DATA:DALL? SDAT'])
+
+    def test_split_traces(self):
+        data = np.arange(12, dtype=np.float64)
+
+        traces = split_traces(data, [('S11', np.float64), ('S21', np.complex128),
+                                     ('S22', np.float64)], 3)
+
+        np.testing.assert_array_equal(traces['S11'], [0, 1, 2])
+        np.testing.assert_array_equal(traces['S21'], [3 + 4j, 5 + 6j, 7 + 8j])
+        np.testing.assert_array_equal(traces['S22'], [9, 10, 11])
+        with self.assertRaises(ValueError):
+            split_traces(data, [('S11', np.complex128)], 3)
+        with self.assertRaises(ValueError):
+            split_traces(data, [('S11', np.complex128), ('S21', np.complex128)], 4)
+
+    def test_trace_reader_ascii_fallback(self):
+        instrument = _IPInstrumentStub([b'1,2,3\n', b'-1.5,-2.5\n', b'3,4\n'])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument)
+
+        with self.assertLogs(level='WARNING'):
+            np.testing.assert_array_equal(reader.read('TRAC:DATA? TRACE1'), [-1.5, -2.5])
+        self.assertFalse(reader.binary)
+        np.testing.assert_array_equal(reader.read('TRAC:DATA? TRACE1'), [3, 4])
+        self.assertEqual(instrument.messages[1:], ['FORM ASC;:TRAC:DATA? TRACE1'] * 2)
+
+    def test_trace_reader_drains_partial_response(self):
+        # the first block is not a float32 array, the second one is not read
+        response = (_ieee_block(b'12345')[:-1] + b';'
+                    + _ieee_block(self.trace.astype('<f4').tobytes()))
+        instrument = _IPInstrumentStub([response, b'1,2;3\n'])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument)
+
+        with self.assertLogs(level='WARNING'):
+            traces = reader.read_many(['CALC:TRAC1:DATA?', 'CALC:TRAC2:DATA?'])
+
+        np.testing.assert_array_equal(traces[0], [1, 2])
+        np.testing.assert_array_equal(traces[1], [3])
+        self.assertEqual(instrument.connections, 1)
+
+    def test_trace_reader_reconnects_closed_connection(self):
+        instrument = _IPInstrumentStub([None, b'3,4\n'])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument)
+
+        with self.assertLogs(level='WARNING'):
+            trace = reader.read('TRAC:DATA? TRACE1')
+
+        np.testing.assert_array_equal(trace, [3, 4])
+        self.assertEqual(instrument.connections, 2)
+
+    def test_trace_reader_read_many(self):
+        first, second = np.arange(4, dtype='<f8'), np.arange(3, dtype='<f8') - 1
+        response = (_ieee_block(first.tobytes())[:-1] + b';'
+                    + _ieee_block(second.tobytes()))
+        instrument = _IPInstrumentStub([response])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument, datatype='d')
+
+        traces = reader.read_many(['CALC:TRAC1:DATA?', 'CALC:TRAC2:DATA?'])
+
+        np.testing.assert_array_equal(traces[0], first)
+        np.testing.assert_array_equal(traces[1], second)
+        self.assertEqual(instrument.messages,
+                         ['FORM REAL,64;:FORM:BORD SWAP;:CALC:TRAC1:DATA?;:CALC:TRAC2:DATA?'])
+
+    def test_trace_reader_read_many_ascii(self):
+        instrument = _IPInstrumentStub([b'1,2;-3\n'])
+        self.addCleanup(instrument.close)
+        reader = TraceReader(instrument, binary=False)
+
+        traces = reader.read_many(['CALC:TRAC1:DATA?', 'CALC:TRAC2:DATA?'])
+
+        np.testing.assert_array_equal(traces[0], [1, 2])
+        np.testing.assert_array_equal(traces[1], [-3])
+        self.assertEqual(instrument.messages,
+                         ['FORM ASC;:CALC:TRAC1:DATA?;:CALC:TRAC2:DATA?'])
+
+
+class _SweepInstrument(SpectrumAnalyzerMixin, Instrument):
+    """ Spectrum analyzer answering sweep queries from a dictionary """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.settings = {'SENS:FREQ:START': 1e9, 'SENS:FREQ:STOP': 2e9,
+                         'SENS:SWE:POIN': 101}
+        self.queries = []
+        self._add_sweep_parameters()
+        self.trace_reader = self
+        self.add_parameter(name='trace', parameter_class=FrequencySweep)
+
+    def write_raw(self, cmd):
+        key, _, value = cmd.partition(' ')
+        if key in self.settings:
+            self.settings[key] = float(value)
+
+    def ask_raw(self, cmd):
+        self.queries.append(cmd)
+        return '{:g}'.format(self.settings[cmd.rstrip('?')])
+
+    def read(self, query):
+        return np.zeros(int(self.settings['SENS:SWE:POIN']), dtype=np.float32)
+
+
+class TestSweepGeometry(unittest.TestCase):
+
+    def setUp(self):
+        self.instrument = _SweepInstrument('sweep_instrument')
+        self.addCleanup(self.instrument.close)
+
+    def test_trace_uses_cached_geometry(self):
+        self.instrument.queries.clear()
+        for _ in range(3):
+            trace = self.instrument.trace()
+        self.assertEqual(trace.shape, (101,))
+        self.assertEqual(self.instrument.queries, [])
+
+        setpoints = self.instrument.trace.setpoints[0]
+        np.testing.assert_array_equal(setpoints, np.linspace(1e9, 2e9, 101))
+        with self.assertRaises(ValueError):
+            setpoints[0] = 0
+
+    def test_setters_invalidate_geometry(self):
+        setpoints = self.instrument.sweep_setpoints()
+        self.instrument.npts(201)
+        self.instrument.stop(3e9)
+
+        self.assertEqual(self.instrument.trace().shape, (201,))
+        self.assertIsNot(self.instrument.trace.setpoints[0], setpoints)
+        self.assertEqual(self.instrument.trace.setpoints[0][-1], 3e9)
+        self.assertEqual(self.instrument.sweep_geometry(), (1e9, 3e9, 201))